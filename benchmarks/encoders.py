@@ -0,0 +1,105 @@
+"""
+Scaling of the writer with the number of encoder processes.
+
+The writer (`write_to_file`) runs in its own process exactly like during a recording, but instead of a device this
+process commits precomputed blocks to the ring buffer as fast as the writer releases them, so the measured rate is
+the rate at which the writer can encode and store samples. Every worker count is measured with the same blocks, the
+speedup is relative to the first worker count. Encoding only runs in parallel on as many cores as are available.
+
+Results are saved as json, arguments not listed below are passed on to the data reader, e.g.
+
+    python -m benchmarks.encoders --workers 1 2 4 8 --channels 8 --output encoders.json
+    python -m benchmarks.encoders --workers 1 4 -sd 10 -z
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import data_reader
+from simulated_daq import LSB
+from storage import EXTENSIONS
+
+
+def _write_quietly(args, metadata, ring):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        data_reader.write_to_file(args, metadata, ring)
+
+
+def run_workers(args, n_workers: int, n_blocks: int) -> dict:
+    """Write `n_blocks` blocks with `n_workers` encoder processes and return the measured rates."""
+    args = argparse.Namespace(**{**vars(args), "encoders": n_workers})
+    ring = data_reader.create_ring_buffer(args, dtype=np.int16 if args.raw else np.float64)
+    # a sine of 16 bit resolution per channel, formatted like acquired samples
+    positions = np.arange(ring.block_size)
+    codes = np.array([np.round(8 / (i + 1) * np.sin(positions * 2 * np.pi / (1000 * (i + 1))) / LSB)
+                      for i in range(len(args.channels))])
+    block = codes.astype(ring.dtype) if args.raw else codes * LSB
+    with tempfile.TemporaryDirectory() as directory:
+        args.filename = os.path.join(directory, "benchmark" + EXTENSIONS[args.format])
+        writer = multiprocessing.Process(target=_write_quietly,
+                                         args=(args, data_reader.create_metadata(args), ring))
+        writer.start()
+        start = time.perf_counter()
+        ring.mark_start()
+        for i in range(n_blocks):
+            ring.reserve(ring.block_size)[:] = block
+            ring.commit(i * ring.block_size)
+        ring.close_writer()
+        writer.join()
+        elapsed = time.perf_counter() - start
+        # segments, index and metadata included
+        size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+    ring.unlink()
+    samples = n_blocks * ring.block_size
+    return {
+        "workers": n_workers,
+        "format": args.format,
+        "channels": len(args.channels),
+        "block_size": ring.block_size,
+        "seconds": elapsed,
+        "samples_per_second": samples / elapsed,
+        "aggregate_samples_per_second": samples * len(args.channels) / elapsed,
+        "mb_per_second": size / (1024 * 1024) / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    benchmark_parser = argparse.ArgumentParser(description="Writer throughput per number of encoder processes")
+    benchmark_parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8],
+                                  help="Encoder process counts to measure (Default: 1 2 4 8)")
+    benchmark_parser.add_argument("--channels", type=int, default=8,
+                                  help="Number of channels (Default: 8)")
+    benchmark_parser.add_argument("--blocks", type=int, default=200,
+                                  help="Blocks written per worker count (Default: 200)")
+    benchmark_parser.add_argument("--output", type=str, default=None,
+                                  help="Json file the results are written to")
+    benchmark_args, reader_arguments = benchmark_parser.parse_known_args()
+    channel_arguments = [argument for i in range(benchmark_args.channels) for argument in ("-c", f"ai{i}")]
+    reader_args = data_reader.parser.parse_args(channel_arguments + ["-sr", "1000000"] + reader_arguments)
+
+    runs = []
+    print(f"{'workers':>8}{'S/s per channel':>18}{'aggregate S/s':>16}{'MB/s':>9}{'speedup':>9}")
+    for n_workers in benchmark_args.workers:
+        result = run_workers(reader_args, n_workers, benchmark_args.blocks)
+        result["speedup"] = result["samples_per_second"] / (runs[0] if runs else result)["samples_per_second"]
+        runs.append(result)
+        print(f"{n_workers:>8}{result['samples_per_second']:>18.0f}{result['aggregate_samples_per_second']:>16.0f}"
+              f"{result['mb_per_second']:>9.1f}{result['speedup']:>9.2f}", flush=True)
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, "w") as f:
+            json.dump({
+                "timestamp": datetime.datetime.now().isoformat(),
+                "platform": platform.platform(),
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "runs": runs,
+            }, f, indent=2)
@@ -0,0 +1,108 @@
+"""
+Throughput of the merger of several devices.
+
+Per device a producer process commits precomputed blocks to the ring of the device as fast as the merger releases
+them, the merger (`merge.StreamMerger`) runs in this process and a consumer process releases the merged blocks right
+away, so the measured rate is the rate at which the devices can be merged. To mimic independent readers the devices
+commit blocks of different sizes. The merge keeps up if its aggregate rate exceeds the sum of the sampling rates of
+all devices.
+
+Results are saved as json, e.g.
+
+    python -m benchmarks.merge --devices 2 3 4 --channels 8 --output merge.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from merge import StreamMerger
+from ring_buffer import SharedRingBuffer
+
+# samples per channel of a ring slot
+BLOCK_SIZE = 10000
+# slots per ring
+N_BLOCKS = 32
+
+
+def _produce(ring, n_samples: int, block_size: int):
+    data = np.random.default_rng().standard_normal((ring.n_channels, block_size))
+    ring.mark_start()
+    position = 0
+    while position < n_samples:
+        n = min(block_size, n_samples - position)
+        ring.reserve(n)[:] = data[:, :n]
+        ring.commit(position, time.time_ns())
+        position += n
+    ring.close_writer()
+
+
+def _consume(ring):
+    while ring.get() is not None:
+        ring.release()
+    ring.close()
+
+
+def run_devices(n_devices: int, n_channels: int, n_samples: int) -> dict:
+    """Merge `n_samples` samples of `n_devices` devices with `n_channels` channels each and return the rates."""
+    rings = {f"Dev{i + 1}": SharedRingBuffer(n_channels, BLOCK_SIZE, N_BLOCKS) for i in range(n_devices)}
+    ring = SharedRingBuffer(n_devices * n_channels, BLOCK_SIZE, N_BLOCKS)
+    processes = [multiprocessing.Process(target=_consume, args=(ring,))]
+    # block sizes differ per device, so the merged blocks are cut across the blocks of the devices
+    processes += [multiprocessing.Process(target=_produce, args=(device_ring, n_samples, BLOCK_SIZE - 1000 * i))
+                  for i, device_ring in enumerate(rings.values())]
+    merger = StreamMerger(rings, ring)
+    for process in processes:
+        process.start()
+    start = time.perf_counter()
+    merger.run()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    for device_ring in rings.values():
+        device_ring.unlink()
+    ring.unlink()
+    return {
+        "devices": n_devices,
+        "channels_per_device": n_channels,
+        "samples": merger.position,
+        "seconds": elapsed,
+        "samples_per_second": merger.position / elapsed,
+        "aggregate_samples_per_second": merger.position * n_devices * n_channels / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    benchmark_parser = argparse.ArgumentParser(description="Merge throughput per number of devices")
+    benchmark_parser.add_argument("--devices", nargs="+", type=int, default=[2, 3, 4],
+                                  help="Device counts to measure (Default: 2 3 4)")
+    benchmark_parser.add_argument("--channels", type=int, default=8,
+                                  help="Channels per device (Default: 8)")
+    benchmark_parser.add_argument("--samples", type=int, default=5000000,
+                                  help="Samples per channel merged per device count (Default: 5000000)")
+    benchmark_parser.add_argument("--output", type=str, default=None,
+                                  help="Json file the results are written to")
+    benchmark_args = benchmark_parser.parse_args()
+
+    runs = []
+    print(f"{'devices':>8}{'S/s per channel':>18}{'aggregate S/s':>16}")
+    for n_devices in benchmark_args.devices:
+        result = run_devices(n_devices, benchmark_args.channels, benchmark_args.samples)
+        runs.append(result)
+        print(f"{n_devices:>8}{result['samples_per_second']:>18.0f}{result['aggregate_samples_per_second']:>16.0f}",
+              flush=True)
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, "w") as f:
+            json.dump({
+                "timestamp": datetime.datetime.now().isoformat(),
+                "platform": platform.platform(),
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "runs": runs,
+            }, f, indent=2)
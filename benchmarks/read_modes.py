@@ -0,0 +1,92 @@
+"""
+Compares CPU usage and end-to-end latency of the acquisition read modes.
+
+Every mode runs `data_reader.main_data_loop` in its own process for the given duration, while this process consumes
+the ring buffer like the file writer would. The latency of a block is the time between the acquisition of its last
+sample, derived from the start time of the task and the sample index, and its arrival at the consumer.
+
+All arguments not listed below are passed on to the data reader, e.g.
+
+    python -m benchmarks.read_modes --duration 10 -c ai0 -c ai1 -sr 100000
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+
+import data_reader
+
+
+def _acquire(args, ring, stop_event, cpu_seconds):
+    in_task = data_reader.create_task(args)
+    start = time.process_time()
+    data_reader.main_data_loop(args, in_task, ring, stop_event)
+    cpu_seconds.value = time.process_time() - start
+
+
+def run_mode(args, read_mode: str, duration: float) -> dict:
+    """Run the acquisition for `duration` seconds in `read_mode` and return its CPU usage and latency statistics."""
+    args = argparse.Namespace(**{**vars(args), "read_mode": read_mode})
+    ring = data_reader.create_ring_buffer(args, dtype=np.int16 if args.raw else np.float64)
+    stop_event = multiprocessing.Event()
+    cpu_seconds = multiprocessing.Value("d", 0.0)
+    acquisition = multiprocessing.Process(target=_acquire, args=(args, ring, stop_event, cpu_seconds))
+    acquisition.start()
+
+    latencies = []
+    samples_per_read = []
+    start = time.perf_counter()
+    while True:
+        if time.perf_counter() - start > duration:
+            stop_event.set()
+        block = ring.get(timeout=0.5)
+        if block is None:
+            if ring.closed:
+                break
+            continue
+        arrival_ns = time.time_ns()
+        n_samples = block.data.shape[1]
+        acquired_ns = ring.start_time_ns + (block.first_sample + n_samples) / args.sampling_rate * 1e9
+        latencies.append((arrival_ns - acquired_ns) / 1e6)
+        samples_per_read.append(n_samples)
+        ring.release()
+    elapsed = time.perf_counter() - start
+    acquisition.join()
+    overflows = ring.overflows
+    ring.close()
+    ring.unlink()
+
+    return {
+        "read_mode": read_mode,
+        "duration_s": elapsed,
+        "cpu_percent": 100 * cpu_seconds.value / elapsed,
+        "reads": len(latencies),
+        "samples_per_read_mean": float(np.mean(samples_per_read)) if samples_per_read else 0.0,
+        "latency_mean_ms": float(np.mean(latencies)) if latencies else None,
+        "latency_p99_ms": float(np.percentile(latencies, 99)) if latencies else None,
+        "overflows": overflows,
+    }
+
+
+if __name__ == "__main__":
+    benchmark_parser = argparse.ArgumentParser(description="Compares CPU usage and latency of the read modes")
+    benchmark_parser.add_argument("--duration", type=float, default=10.0,
+                                  help="Seconds to acquire per read mode (Default: 10)")
+    benchmark_parser.add_argument("--modes", nargs="+", default=["poll", "event"], choices=["poll", "event"],
+                                  help="Read modes to compare (Default: poll event)")
+    benchmark_parser.add_argument("--output", type=str, default=None,
+                                  help="Optional json file the results are written to")
+    benchmark_args, reader_arguments = benchmark_parser.parse_known_args()
+    reader_args = data_reader.parser.parse_args(reader_arguments)
+
+    results = [run_mode(reader_args, mode, benchmark_args.duration) for mode in benchmark_args.modes]
+    print(f"{'mode':<8}{'cpu %':>8}{'reads':>10}{'samples/read':>15}{'mean ms':>10}{'p99 ms':>10}{'overflows':>11}")
+    for result in results:
+        print(f"{result['read_mode']:<8}{result['cpu_percent']:>8.1f}{result['reads']:>10}"
+              f"{result['samples_per_read_mean']:>15.1f}{result['latency_mean_ms'] or 0:>10.2f}"
+              f"{result['latency_p99_ms'] or 0:>10.2f}{result['overflows']:>11}")
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, "w") as f:
+            json.dump(results, f, indent=2)
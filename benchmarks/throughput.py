@@ -0,0 +1,181 @@
+"""
+Sustained throughput benchmark of the acquisition pipeline on the simulated backend.
+
+For every storage format and channel count the sampling rate is raised step by step, while `main_data_loop` and
+`write_to_file` run exactly like during a recording: the acquisition in this process, the writer in its own process.
+A configuration is sustainable if neither the device buffer nor the ring buffer overflowed and the writer finished
+the remaining blocks within a second after the acquisition stopped. Per run the queue latency (ring depth times the
+duration of a block) and the writer throughput in MB/s are measured.
+
+Results are saved as json, so runs on different machines or commits can be compared. Arguments not listed below are
+passed on to the data reader, e.g.
+
+    python -m benchmarks.throughput --duration 5 --output throughput.json
+    python -m benchmarks.throughput --formats npy --compare throughput.json --raw
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from nidaqmx.errors import DaqError
+
+import data_reader
+from storage import EXTENSIONS, storage_size
+
+DEFAULT_RATES = [1000, 10000, 100000, 250000, 500000, 1000000, 2000000, 4000000]
+# seconds the writer may need after the acquisition stopped for a run to count as sustainable
+MAX_DRAIN_TIME = 1.0
+
+
+def _write_quietly(args, metadata, ring):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        data_reader.write_to_file(args, metadata, ring)
+
+
+def run_pipeline(args, duration: float) -> dict:
+    """Record for `duration` seconds with the configuration in `args` and return the measured figures."""
+    with tempfile.TemporaryDirectory() as directory:
+        args.filename = os.path.join(directory, "benchmark" + EXTENSIONS[args.format])
+        in_task = data_reader.create_task(args)
+        ring = data_reader.create_ring_buffer(args, dtype=np.int16 if args.raw else np.float64)
+        writer = multiprocessing.Process(target=_write_quietly,
+                                         args=(args, data_reader.create_metadata(args, in_task), ring))
+        writer.start()
+
+        stop_event = threading.Event()
+        depths = []
+
+        def monitor():
+            while not stop_event.is_set():
+                depths.append(ring.depth)
+                time.sleep(0.01)
+
+        monitor_thread = threading.Thread(target=monitor, daemon=True)
+        monitor_thread.start()
+        timer = threading.Timer(duration, stop_event.set)
+        timer.start()
+
+        error = None
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                data_reader.main_data_loop(args, in_task, ring, stop_event)
+        except DaqError as e:
+            error = e.error_code
+            stop_event.set()
+        acquisition_time = time.perf_counter() - start
+        acquisition_cpu = time.process_time() - cpu_start
+        timer.cancel()
+        writer.join()
+        drain_time = time.perf_counter() - start - acquisition_time
+        monitor_thread.join()
+
+        size = storage_size(args.filename)
+        blocks = ring.blocks_written
+        committed_samples = in_task.in_stream.curr_read_pos - ring.dropped_samples
+        block_duration = committed_samples / max(blocks, 1) / args.sampling_rate
+        result = {
+            "format": args.format,
+            "raw": args.raw,
+            "channels": len(args.channels),
+            "sampling_rate": args.sampling_rate,
+            "duration_s": acquisition_time,
+            "device_error": error,
+            "ring_overflows": ring.overflows,
+            "drain_time_s": drain_time,
+            "acquisition_cpu_percent": 100 * acquisition_cpu / acquisition_time,
+            "ring_depth_mean": float(np.mean(depths)) if depths else 0.0,
+            "ring_depth_max": int(np.max(depths)) if depths else 0,
+            "queue_latency_mean_ms": 1000 * block_duration * (float(np.mean(depths)) if depths else 0.0),
+            "writer_mb_per_s": size / (1024 * 1024) / (acquisition_time + drain_time),
+            "file_size_mb": size / (1024 * 1024),
+        }
+        result["sustainable"] = error is None and ring.overflows == 0 and drain_time <= MAX_DRAIN_TIME
+        ring.close()
+        ring.unlink()
+    return result
+
+
+def run_suite(formats: list, channel_counts: list, rates: list, duration: float, reader_arguments: list) -> dict:
+    """Search the maximum sustainable sampling rate for every format and channel count."""
+    runs = []
+    max_sustainable = []
+    for file_format in formats:
+        for n_channels in channel_counts:
+            best = None
+            for rate in rates:
+                channel_arguments = [argument for i in range(n_channels) for argument in ("-c", f"ai{i}")]
+                args = data_reader.parser.parse_args(
+                    channel_arguments + ["-sr", str(rate), "-b", "simulated", "-fmt", file_format] + reader_arguments)
+                result = run_pipeline(args, duration)
+                runs.append(result)
+                print(f"{file_format:<5}{n_channels:>3} ch {rate:>9} Hz  "
+                      f"{'ok' if result['sustainable'] else 'FAILED':<7}"
+                      f"writer {result['writer_mb_per_s']:>8.1f} MB/s  "
+                      f"queue {result['queue_latency_mean_ms']:>8.1f} ms  "
+                      f"cpu {result['acquisition_cpu_percent']:>5.1f} %", flush=True)
+                if not result["sustainable"]:
+                    break
+                best = rate
+            max_sustainable.append({
+                "format": file_format,
+                "raw": "--raw" in reader_arguments or "-raw" in reader_arguments,
+                "channels": n_channels,
+                "sampling_rate": best,
+                "aggregate_rate": None if best is None else best * n_channels,
+            })
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "duration_s": duration,
+        "max_sustainable": max_sustainable,
+        "runs": runs,
+    }
+
+
+def compare(results: dict, previous: dict):
+    """Print the maximum sustainable aggregate rates next to those of a previous run."""
+    previous_rates = {(entry["format"], entry["raw"], entry["channels"]): entry["aggregate_rate"]
+                      for entry in previous["max_sustainable"]}
+    print(f"{'format':<8}{'channels':>9}{'previous S/s':>15}{'current S/s':>15}")
+    for entry in results["max_sustainable"]:
+        before = previous_rates.get((entry["format"], entry["raw"], entry["channels"]))
+        print(f"{entry['format']:<8}{entry['channels']:>9}{before or 0:>15}{entry['aggregate_rate'] or 0:>15}")
+
+
+if __name__ == "__main__":
+    benchmark_parser = argparse.ArgumentParser(description="Sustained throughput benchmark on the simulated backend")
+    benchmark_parser.add_argument("--duration", type=float, default=5.0,
+                                  help="Seconds to record per configuration (Default: 5)")
+    benchmark_parser.add_argument("--formats", nargs="+", default=["csv", "npy"], choices=list(EXTENSIONS),
+                                  help="Storage formats to measure (Default: csv npy)")
+    benchmark_parser.add_argument("--channels", nargs="+", type=int, default=[1, 2, 4, 8],
+                                  help="Channel counts to measure (Default: 1 2 4 8)")
+    benchmark_parser.add_argument("--rates", nargs="+", type=int, default=DEFAULT_RATES,
+                                  help="Sampling rates tried in ascending order until one is not sustainable")
+    benchmark_parser.add_argument("--output", type=str, default=None,
+                                  help="Json file the results are written to")
+    benchmark_parser.add_argument("--compare", type=str, default=None,
+                                  help="Json file of a previous run to compare the results with")
+    benchmark_args, reader_arguments = benchmark_parser.parse_known_args()
+
+    results = run_suite(benchmark_args.formats, benchmark_args.channels, sorted(benchmark_args.rates),
+                        benchmark_args.duration, reader_arguments)
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if benchmark_args.compare is not None:
+        with open(benchmark_args.compare) as f:
+            compare(results, json.load(f))
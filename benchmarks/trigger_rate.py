@@ -0,0 +1,150 @@
+"""
+Maximum sustainable trigger rate of the retriggerable capture mode on the simulated backend.
+
+The simulated device fires its reference trigger periodically, the trigger rate is raised step by step while
+`main_data_loop` runs in this process and `write_to_file` in its own process, exactly like a recording with
+`--retrigger`. A trigger rate is sustainable if neither the device buffer nor the ring buffer overflowed, at most one
+complete record was left unread when the acquisition stopped, no trigger timestamp was taken after the following
+trigger already occurred and the writer finished within a second. Per run the captured events per second and the
+CPU usage of the acquisition are reported.
+
+Triggers arriving during a record or the pretrigger phase of the next one are ignored by the device, so the rate of
+records is limited to `sampling_rate / (number_of_samples + 2)` independent of the software. Arguments not listed
+below are passed on to the data reader, e.g.
+
+    python -m benchmarks.trigger_rate --duration 5 -c ai0 -sr 1000000 -ns 98 --output trigger_rate.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from nidaqmx.errors import DaqError
+
+import data_reader
+from storage import EVENT_LENGTH, EVENT_TIME, EXTENSIONS, read_events
+
+DEFAULT_TRIGGER_RATES = [10, 100, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+# seconds the writer may need after the acquisition stopped for a run to count as sustainable
+MAX_DRAIN_TIME = 1.0
+
+
+def _write_quietly(args, metadata, ring):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        data_reader.write_to_file(args, metadata, ring)
+
+
+def run_trigger_rate(args, duration: float) -> dict:
+    """Capture events for `duration` seconds with the configuration in `args` and return the measured figures."""
+    with tempfile.TemporaryDirectory() as directory:
+        args.filename = os.path.join(directory, "benchmark" + EXTENSIONS[args.format])
+        in_task = data_reader.create_task(args)
+        ring = data_reader.create_ring_buffer(args, dtype=np.int16 if args.raw else np.float64)
+        writer = multiprocessing.Process(target=_write_quietly,
+                                         args=(args, data_reader.create_metadata(args, in_task), ring))
+        writer.start()
+
+        stop_event = threading.Event()
+        timer = threading.Timer(duration, stop_event.set)
+        timer.start()
+        error = None
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                data_reader.main_data_loop(args, in_task, ring, stop_event)
+        except DaqError as e:
+            error = e.error_code
+            stop_event.set()
+        acquisition_time = time.perf_counter() - start
+        acquisition_cpu = time.process_time() - cpu_start
+        record_length = data_reader.block_size(args)
+        # complete records still waiting in the device buffer when the acquisition stopped
+        unread_records = in_task.in_stream.avail_samp_per_chan // record_length
+        timer.cancel()
+        writer.join()
+        drain_time = time.perf_counter() - start - acquisition_time
+
+        events = read_events(args.filename)
+        trigger_times = events[:, EVENT_TIME] / 1e9
+        record_duration = record_length / args.sampling_rate
+        # a timestamp taken after the next trigger repeats the trigger time of the following record
+        ambiguous = int(np.sum(np.diff(trigger_times) < record_duration))
+        result = {
+            "format": args.format,
+            "channels": len(args.channels),
+            "sampling_rate": args.sampling_rate,
+            "record_length": record_length,
+            "trigger_rate": args.simulated_trigger_rate,
+            "duration_s": acquisition_time,
+            "device_error": error,
+            "ring_overflows": ring.overflows,
+            "unread_records": unread_records,
+            "ambiguous_timestamps": ambiguous,
+            "events": len(events),
+            "samples": int(events[:, EVENT_LENGTH].sum()),
+            "events_per_second": len(events) / acquisition_time,
+            "drain_time_s": drain_time,
+            "acquisition_cpu_percent": 100 * acquisition_cpu / acquisition_time,
+        }
+        result["sustainable"] = error is None and ring.overflows == 0 and unread_records <= 1 and ambiguous == 0 \
+            and drain_time <= MAX_DRAIN_TIME
+        ring.close()
+        ring.unlink()
+    return result
+
+
+def run_suite(trigger_rates: list, duration: float, reader_arguments: list) -> dict:
+    """Raise the trigger rate until a run is not sustainable anymore and return all runs."""
+    runs = []
+    best = None
+    for trigger_rate in trigger_rates:
+        args = data_reader.parser.parse_args(
+            ["-b", "simulated", "-tc", "pfi0", "-rtr", "-str", str(trigger_rate)] + reader_arguments)
+        result = run_trigger_rate(args, duration)
+        runs.append(result)
+        print(f"{trigger_rate:>9} triggers/s  {'ok' if result['sustainable'] else 'FAILED':<7}"
+              f"events {result['events_per_second']:>9.1f}/s  "
+              f"unread {result['unread_records']:>6}  "
+              f"ambiguous {result['ambiguous_timestamps']:>6}  "
+              f"cpu {result['acquisition_cpu_percent']:>5.1f} %", flush=True)
+        if not result["sustainable"]:
+            break
+        best = result
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "duration_s": duration,
+        "max_sustainable_trigger_rate": None if best is None else best["trigger_rate"],
+        "max_sustainable_events_per_second": None if best is None else best["events_per_second"],
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    benchmark_parser = argparse.ArgumentParser(description="Maximum sustainable rate of the retriggerable capture "
+                                                           "mode on the simulated backend")
+    benchmark_parser.add_argument("--duration", type=float, default=5.0,
+                                  help="Seconds to capture per trigger rate (Default: 5)")
+    benchmark_parser.add_argument("--trigger_rates", nargs="+", type=float, default=DEFAULT_TRIGGER_RATES,
+                                  help="Trigger rates tried in ascending order until one is not sustainable")
+    benchmark_parser.add_argument("--output", type=str, default=None,
+                                  help="Json file the results are written to")
+    benchmark_args, reader_arguments = benchmark_parser.parse_known_args()
+
+    results = run_suite(sorted(benchmark_args.trigger_rates), benchmark_args.duration, reader_arguments)
+    print(f"Maximum sustainable trigger rate: {results['max_sustainable_trigger_rate']} triggers/s "
+          f"({results['max_sustainable_events_per_second'] or 0:.1f} events/s captured)")
+    if benchmark_args.output is not None:
+        with open(benchmark_args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import threading
+
+from segments import SegmentIndex
+from storage import EXTENSIONS, HEADER_FILE, Recording, metadata_path, read_metadata, storage_size
+
+CATALOG_FILE = ".catalog.json"
+# bytes read from the end of a csv file to find its last complete line
+_TAIL_BYTES = 64 * 1024
+INDEX_SUFFIX = ".index.json"
+
+
+def _state(path: str) -> list:
+    """Modification time and size of a recording, the catalog entry is outdated once they change."""
+    if path.endswith(INDEX_SUFFIX):
+        # the index of a segmented recording is rewritten whenever a segment is started, closed or compressed
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+    if os.path.isdir(path):
+        # binary recordings rewrite their header when closed and grow while they are recorded
+        return [os.stat(os.path.join(path, HEADER_FILE)).st_mtime_ns, storage_size(path)]
+    stat = os.stat(path)
+    # the sidecar receives the number of samples when the csv file is closed
+    sidecar = metadata_path(path)
+    return [stat.st_mtime_ns, stat.st_size, os.stat(sidecar).st_mtime_ns if os.path.exists(sidecar) else 0]
+
+
+def _csv_lines(path: str):
+    """Header, first and last complete data line of a csv file, the data lines are None if there are none."""
+    with open(path, "rb") as f:
+        header = f.readline().decode("ascii").strip()
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - _TAIL_BYTES))
+        tail = f.read()
+    # the last line may still be written
+    lines = [line for line in tail.split(b"\n")[:-1] if line.strip()]
+    if not first.endswith(b"\n") or not lines:
+        return header, None, None
+    return header, first.decode("ascii"), lines[-1].decode("ascii")
+
+
+def describe_csv(path: str) -> dict:
+    """
+    Channels, sampling rate and sample count of a csv file.
+
+    The metadata sidecar holds the sample count once the file is closed. For files which are still written or were
+    written without metadata, the sample count is derived from the time column of the first and last line, so the
+    file is never read completely. The sampling rate of files without metadata is taken from the first two lines.
+    """
+    metadata = read_metadata(path) or {}
+    header, first, last = _csv_lines(path)
+    channels = metadata.get("channels") or header.split(",")[1:]
+    sampling_rate = metadata.get("sampling_rate")
+    n_samples = metadata.get("n_samples") or 0
+    if first is not None and (not n_samples or sampling_rate is None):
+        first_time = float(first.split(",", 1)[0])
+        if sampling_rate is None:
+            with open(path) as f:
+                f.readline()
+                f.readline()
+                second = f.readline()
+            if second.endswith("\n") and float(second.split(",", 1)[0]) > first_time:
+                sampling_rate = 1 / (float(second.split(",", 1)[0]) - first_time)
+        if sampling_rate is not None and not n_samples:
+            # blocks dropped during the acquisition leave gaps of the time axis, which are counted here
+            n_samples = round(float(last.split(",", 1)[0]) * sampling_rate) - round(first_time * sampling_rate) + 1
+    return {"format": "csv", "channels": channels, "sampling_rate": sampling_rate, "n_samples": n_samples,
+            "start_time": metadata.get("start_time")}
+
+
+def describe_recording(path: str) -> dict:
+    """Channels, sampling rate and sample count of a binary recording, read from its header."""
+    recording = Recording(path)
+    return {"format": "npy", "channels": recording.channels, "sampling_rate": recording.sampling_rate,
+            "n_samples": recording.n_samples, "start_time": recording.metadata.get("start_time")}
+
+
+def describe_segments(path: str) -> dict:
+    """
+    Channels, sampling rate and sample count of a segmented recording, read from its index file `path`.
+
+    The segments themselves are only stat'ed for their size. The index holds the samples of the current segment as of
+    its last update, see `segments.SegmentedWriter`.
+    """
+    index = SegmentIndex(path)
+    first_sample = index.segments[0]["first_sample"] if index.segments else 0
+    size = 0
+    for segment in index.segments:
+        segment_file = os.path.join(index.directory, segment["file"])
+        if os.path.exists(segment_file):
+            size += storage_size(segment_file)
+    return {"format": index.index["format"], "channels": index.channels, "sampling_rate": index.sampling_rate,
+            "n_samples": index.n_samples - first_sample, "start_time": index.index.get("start_time"),
+            "segments": len(index.segments), "size": size}
+
+
+def describe(path: str) -> dict:
+    """Catalog entry of the recording at `path` without its path, see `Catalog`."""
+    if path.endswith(INDEX_SUFFIX):
+        entry = describe_segments(path)
+    else:
+        entry = describe_recording(path) if path.endswith(EXTENSIONS["npy"]) else describe_csv(path)
+        entry["size"] = storage_size(path)
+    entry["duration"] = entry["n_samples"] / entry["sampling_rate"] if entry["sampling_rate"] else None
+    entry["state"] = _state(path)
+    return entry
+
+
+def _segment_pattern(index_file: str):
+    """Pattern of the names of the segments belonging to the index `index_file`, see `segments.segment_path`."""
+    stem = index_file[:-len(INDEX_SUFFIX)]
+    return re.compile(re.escape(stem) + r"_\d{4}(\.csv|\.csv\.gz|\.rec)$")
+
+
+def find_recordings(directory: str) -> list:
+    """
+    Paths of all csv files, binary recordings and segmented recordings below `directory`.
+
+    A segmented recording is listed once by its index file, its segments are not listed separately.
+    """
+    recordings = []
+    for root, dirs, files in os.walk(directory):
+        # hidden folders hold caches of the dashboard and recordings which are still converted, see convert.py
+        dirs[:] = [directory for directory in dirs if not directory.startswith(".")]
+        segments = [_segment_pattern(file) for file in files if file.endswith(INDEX_SUFFIX)]
+        recordings.extend(os.path.join(root, file) for file in files if file.endswith(INDEX_SUFFIX))
+        dirs[:] = [directory for directory in dirs if not any(pattern.match(directory) for pattern in segments)]
+        # binary recordings are directories, their content is not listed separately
+        recordings.extend(os.path.join(root, directory) for directory in dirs if directory.endswith(".rec"))
+        dirs[:] = [directory for directory in dirs if not directory.endswith(".rec")]
+        recordings.extend(os.path.join(root, file) for file in files
+                          if file.endswith(".csv") and not any(pattern.match(file) for pattern in segments))
+    return recordings
+
+
+class Catalog:
+    """
+    Persistent catalog of the recordings below a data directory.
+
+    Every csv file and binary recording is described by an entry holding its path relative to `directory`, name,
+    format ('csv' or 'npy'), channel names from the stored header, sampling rate, number of samples per channel,
+    duration in seconds, size in bytes and start time. Segmented recordings are one entry named after their index
+    file, with the format and total size of their segments and the number of segments as `segments`. The catalog is
+    stored as json file in `directory`. A `refresh` only stats the recordings and describes those whose modification
+    time or size changed since the last refresh, so neither headers nor samples of unchanged recordings are read
+    again.
+
+    Parameters
+    ----------
+    directory : str
+        Data directory, e.g. 'data'.
+    path : str, optional
+        Path of the json file (Default: `<directory>/.catalog.json`).
+
+    Example
+    -------
+    >>> catalog = Catalog("data")
+    >>> catalog.refresh()
+    >>> [entry["name"] for entry in catalog.search("ai1", formats=["npy"])]
+    ['measurements.rec']
+    """
+
+    def __init__(self, directory: str, path: str = None):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, CATALOG_FILE) if path is None else path
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(temporary_path, self.path)
+
+    def _describe(self, key: str, path: str) -> dict:
+        entry = describe(path)
+        entry["path"] = key
+        entry["name"] = os.path.basename(path)
+        return entry
+
+    def refresh(self) -> int:
+        """Describe new and changed recordings, drop entries of removed ones and return the number of changes."""
+        with self._lock:
+            changes = 0
+            entries = {}
+            for path in find_recordings(self.directory):
+                key = os.path.relpath(path, self.directory)
+                entry = self._entries.get(key)
+                try:
+                    if entry is None or entry["state"] != _state(path):
+                        entry = self._describe(key, path)
+                        changes += 1
+                except (OSError, ValueError, KeyError, TypeError):
+                    # recordings which are just created or were not written by the data reader
+                    continue
+                entries[key] = entry
+            changes += len(self._entries.keys() - entries.keys())
+            self._entries = entries
+            if changes:
+                self._save()
+            return changes
+
+    def update(self, path: str) -> dict:
+        """Describe a single recording, e.g. right after it was written, and return its entry."""
+        key = os.path.relpath(os.path.abspath(path), self.directory)
+        with self._lock:
+            entry = self._entries[key] = self._describe(key, os.path.join(self.directory, key))
+            self._save()
+        return entry
+
+    def absolute_path(self, entry: dict) -> str:
+        return os.path.join(self.directory, entry["path"])
+
+    @property
+    def entries(self) -> list:
+        """All entries ordered by path."""
+        with self._lock:
+            return [self._entries[key] for key in sorted(self._entries)]
+
+    def search(self, text: str = "", formats: list = None, min_duration: float = None) -> list:
+        """
+        Entries whose path or one of whose channels contains `text` (case insensitive), optionally restricted to
+        the given formats and to recordings of at least `min_duration` seconds.
+        """
+        text = (text or "").casefold()
+        return [entry for entry in self.entries
+                if (not text or text in entry["path"].casefold()
+                    or any(text in channel.casefold() for channel in entry["channels"]))
+                and (not formats or entry["format"] in formats)
+                and (not min_duration or (entry["duration"] or 0) >= min_duration)]
@@ -0,0 +1,289 @@
+"""
+Batch conversion of csv files into binary recordings.
+
+Every csv file below a directory is converted into a binary recording (see `storage.NpyWriter`) by a pool of worker
+processes, e.g.
+
+    python convert.py data --workers 4
+
+Each file is streamed in chunks of `CHUNK_ROWS` rows, so the memory needed does not depend on its size. Gaps of the
+time axis left by dropped blocks are filled like the data reader does (NaN, 0 for raw ADC codes). While writing, a
+CRC32 checksum of the stored samples of every channel is computed. After the recording is closed its sample count is
+checked against the time axis and the metadata of the csv file, and every channel is read back to compare the
+checksums while its zoom pyramid is built. Only a verified recording is moved into place and entered into the catalog.
+
+Recordings are written to a temporary directory first and carry the size and modification time of their csv file in
+their header, so an interrupted conversion is resumed by running the same command again: converted files are skipped
+and partial ones are converted again.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from catalog import Catalog, describe_csv, find_recordings
+from pyramid import build_pyramid, pyramid_path
+from storage import (EXTENSIONS, HEADER_FILE, NpyWriter, Recording, apply_scaling, events_path, read_metadata,
+                     recording_metadata, storage_size)
+
+# csv rows parsed at once, a chunk takes (channels + 1) * 8 bytes per row
+CHUNK_ROWS = 500_000
+# prefix of recordings which are not yet verified, hidden from the catalog and replaced when the conversion is resumed
+TEMPORARY_PREFIX = ".converting-"
+# header field holding the state of the converted csv file
+SOURCE_FIELD = "converted_from"
+
+
+def output_path(path: str, directory: str, output_directory: str = None) -> str:
+    """Path of the recording converted from the csv file at `path` below `directory`."""
+    stem = os.path.splitext(path)[0]
+    if output_directory is not None:
+        stem = os.path.join(output_directory, os.path.relpath(stem, directory))
+    return stem + EXTENSIONS["npy"]
+
+
+def source_state(path: str) -> dict:
+    """Size and modification time of a csv file, a recording converted from it is outdated once they change."""
+    stat = os.stat(path)
+    return {"file": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_converted(path: str, destination: str) -> bool:
+    """Whether `destination` holds a verified recording converted from the current state of the csv file."""
+    metadata = read_metadata(destination) if os.path.isdir(destination) else None
+    source = (metadata or {}).get(SOURCE_FIELD)
+    return source is not None and all(source[key] == value for key, value in source_state(path).items())
+
+
+def _checksum(samples: np.ndarray, crc: int) -> int:
+    return zlib.crc32(memoryview(np.ascontiguousarray(samples)).cast("B"), crc)
+
+
+def _fill(writer: NpyWriter, checksums: list, position: int, n_samples: int):
+    """Write `n_samples` fill values per channel for samples missing from the csv file."""
+    dtype = np.dtype(writer.metadata["dtype"])
+    for start in range(position, position + n_samples, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, position + n_samples - start)
+        block = np.full((len(checksums), n), np.nan if dtype.kind == "f" else 0, dtype=dtype)
+        checksums[:] = [_checksum(samples, crc) for samples, crc in zip(block, checksums)]
+        writer.write_block(block, start)
+
+
+class _ChecksumReader:
+    """
+    Passed as `values` to `build_pyramid`, which reads every channel chunk by chunk from start to end. The checksum
+    of the stored samples is computed on the way, so the recording is only read once for verification and pyramid.
+    """
+
+    def __init__(self, recording: Recording):
+        self.recording = recording
+        self.checksums = {channel: 0 for channel in recording.channels}
+        self.positions = {channel: 0 for channel in recording.channels}
+
+    def __call__(self, channel: str, start: int, stop: int) -> np.ndarray:
+        if start != self.positions[channel]:
+            raise ValueError(f"{channel} is not read consecutively")
+        samples = self.recording.channel(channel)[start:stop]
+        self.checksums[channel] = _checksum(samples, self.checksums[channel])
+        self.positions[channel] = stop
+        if self.recording.scaling is None:
+            return samples
+        return apply_scaling(samples, self.recording.scaling[channel])
+
+
+def convert_file(path: str, destination: str) -> dict:
+    """
+    Convert the csv file at `path` into a verified binary recording at `destination` with its zoom pyramid.
+
+    Returns the statistics of the conversion: number of samples per channel, missing samples filled in, size of the
+    csv file and of the recording in bytes and the duration in seconds. Raises ValueError if the csv file cannot be
+    converted or the recording does not match it.
+    """
+    start_time = time.perf_counter()
+    state = source_state(path)
+    description = describe_csv(path)
+    if not description["sampling_rate"]:
+        raise ValueError("sampling rate unknown, the file holds less than two samples and no metadata")
+    sampling_rate = description["sampling_rate"]
+    metadata = read_metadata(path) or recording_metadata(description["channels"], sampling_rate,
+                                                         start_time=description["start_time"])
+    channels = metadata["channels"]
+    dtype = np.dtype(metadata["dtype"])
+    temporary_path = os.path.join(os.path.dirname(destination), TEMPORARY_PREFIX + os.path.basename(destination))
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    writer = None
+    try:
+        # csv files written with metadata start at its first sample, dropped blocks at the start are filled in
+        position = metadata.get("first_sample", 0) if read_metadata(path) is not None else None
+        checksums = [0] * len(channels)
+        missing = 0
+        for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS, dtype=np.float64, engine="c"):
+            if list(chunk.columns[1:]) != channels:
+                raise ValueError(f"columns {list(chunk.columns[1:])} do not match the channels {channels}")
+            # the time column is written from the absolute sample index, see `storage.format_csv_block`
+            indices = np.rint(chunk.iloc[:, 0].to_numpy() * sampling_rate).astype(np.int64)
+            if position is None:
+                position = int(indices[0])
+            if writer is None:
+                writer = NpyWriter(temporary_path, {**metadata, "first_sample": position, "n_samples": 0})
+            values = chunk.iloc[:, 1:].to_numpy(dtype=dtype).T
+            # contiguous runs of samples, separated by blocks dropped during the acquisition
+            breaks = list(np.flatnonzero(np.diff(indices) != 1) + 1)
+            for run_start, run_stop in zip([0, *breaks], [*breaks, len(indices)]):
+                first = int(indices[run_start])
+                if first < position:
+                    raise ValueError(f"time column is not increasing at {chunk.iloc[run_start, 0]} s")
+                if first > position:
+                    _fill(writer, checksums, position, first - position)
+                    missing += first - position
+                block = np.ascontiguousarray(values[:, run_start:run_stop])
+                checksums = [_checksum(samples, crc) for samples, crc in zip(block, checksums)]
+                writer.write_block(block, first)
+                position = first + block.shape[1]
+        if writer is None:
+            writer = NpyWriter(temporary_path, {**metadata, "n_samples": 0})
+        writer.close()
+
+        if os.path.exists(events_path(path)):
+            shutil.copyfile(events_path(path), events_path(temporary_path))
+        recording = Recording(temporary_path)
+        n_samples = recording.n_samples
+        expected = 0 if position is None else position - recording.first_sample
+        if n_samples != expected:
+            raise ValueError(f"recording holds {n_samples} samples per channel instead of {expected}")
+        if metadata.get("n_samples") and metadata["n_samples"] != n_samples:
+            raise ValueError(f"csv metadata lists {metadata['n_samples']} samples per channel, the file holds "
+                             f"{n_samples}")
+        # the header is written once more, the pyramid is built from the final state of the recording
+        writer.update_metadata(**{SOURCE_FIELD: {**state, "checksums": dict(zip(channels, checksums))}})
+        reader = _ChecksumReader(recording)
+        # the dashboard identifies a recording by the modification time of its header and its size
+        source = [os.stat(os.path.join(temporary_path, HEADER_FILE)).st_mtime_ns, storage_size(temporary_path)]
+        build_pyramid(pyramid_path(destination), channels, reader, n_samples, source)
+        for channel, crc in zip(channels, checksums):
+            if reader.positions[channel] != n_samples or reader.checksums[channel] != crc:
+                shutil.rmtree(pyramid_path(destination), ignore_errors=True)
+                raise ValueError(f"checksum of {channel} does not match the csv file")
+        if source_state(path) != state:
+            raise ValueError("csv file changed during the conversion")
+        shutil.rmtree(destination, ignore_errors=True)
+        os.rename(temporary_path, destination)
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+    return {"n_samples": n_samples, "missing_samples": missing, "source_bytes": state["size"],
+            "output_bytes": storage_size(destination), "seconds": time.perf_counter() - start_time}
+
+
+def _convert_worker(task):
+    # a Ctrl+C is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    path, destination = task
+    try:
+        return path, destination, convert_file(path, destination), None
+    except (OSError, ValueError, KeyError, pd.errors.ParserError) as e:
+        return path, destination, None, f"{type(e).__name__}: {e}"
+
+
+def find_csv_files(directory: str, output_directory: str = None, force: bool = False) -> tuple:
+    """
+    Conversion tasks `(path, destination)` of the csv files below `directory` and the csv files which are skipped,
+    as they were converted already.
+    """
+    tasks, converted = [], []
+    for path in sorted(find_recordings(directory)):
+        if not path.endswith(EXTENSIONS["csv"]):
+            continue
+        destination = output_path(path, directory, output_directory)
+        if not force and is_converted(path, destination):
+            converted.append(path)
+        elif os.path.exists(destination) and not force and (read_metadata(destination) or {}).get(SOURCE_FIELD) is None:
+            # recordings of the data reader are never overwritten
+            print(f"Skipping {path}: {destination} was not converted from it, see --force")
+            converted.append(path)
+        else:
+            tasks.append((path, destination))
+    return tasks, converted
+
+
+def remove_source(path: str):
+    """Remove a converted csv file together with its metadata, event index and pyramid."""
+    for file in [path, os.path.splitext(path)[0] + ".json", events_path(path)]:
+        if os.path.exists(file):
+            os.remove(file)
+    shutil.rmtree(pyramid_path(path), ignore_errors=True)
+
+
+def format_rate(n_bytes: float, seconds: float) -> str:
+    return f"{n_bytes / max(seconds, 1e-9) / 1024 ** 2:.1f} MiB/s"
+
+
+if __name__ == "__main__":
+    convert_parser = argparse.ArgumentParser(description="Convert the csv files below a directory into binary "
+                                                         "recordings")
+    convert_parser.add_argument("directory", type=str, nargs="?", default="data",
+                                help="Directory searched recursively for csv files (Default: 'data')")
+    convert_parser.add_argument("-o", "--output", dest="output", type=str, default=None,
+                                help="Directory the recordings are written to, keeping the folder structure below "
+                                     "`directory` (Default: next to the csv files)")
+    convert_parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(),
+                                help="Number of files converted in parallel (Default: number of CPUs)")
+    convert_parser.add_argument("-cat", "--catalog", dest="catalog", type=str, default=None,
+                                help="Data directory whose catalog receives the recordings, see catalog.py "
+                                     "(Default: the output directory)")
+    convert_parser.add_argument("-rm", "--remove_csv", dest="remove_csv", action="store_true",
+                                help="Remove every csv file with its metadata once its recording is verified")
+    convert_parser.add_argument("--force", dest="force", action="store_true",
+                                help="Convert all files again, also overwriting binary recordings of the same name")
+    args = convert_parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        convert_parser.error(f"{args.directory} is not a directory")
+    output_directory = args.output if args.output is not None else args.directory
+    tasks, converted = find_csv_files(args.directory, args.output, args.force)
+    print(f"{len(tasks)} csv files to convert, {len(converted)} already converted")
+    catalog = Catalog(args.catalog if args.catalog is not None else output_directory)
+
+    total = {"files": 0, "failed": 0, "n_samples": 0, "source_bytes": 0, "output_bytes": 0}
+    interrupted = False
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(max(1, min(args.workers, len(tasks))))
+    try:
+        for path, destination, result, error in pool.imap_unordered(_convert_worker, tasks):
+            if error is not None:
+                total["failed"] += 1
+                print(f"Failed {path}: {error}")
+                continue
+            total["files"] += 1
+            for key in ["n_samples", "source_bytes", "output_bytes"]:
+                total[key] += result[key]
+            if os.path.commonpath([catalog.directory, os.path.abspath(destination)]) == catalog.directory:
+                catalog.update(destination)
+            if args.remove_csv:
+                remove_source(path)
+            print(f"Converted {path} -> {destination}: {result['n_samples']} samples per channel"
+                  + (f" ({result['missing_samples']} missing)" if result["missing_samples"] else "")
+                  + f", {result['output_bytes'] / result['source_bytes']:.0%} of the csv size, "
+                    f"{format_rate(result['source_bytes'], result['seconds'])}", flush=True)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        interrupted = True
+        print("Interrupted, run the same command again to resume the conversion")
+    pool.join()
+    if args.remove_csv:
+        # drops the entries of the removed csv files
+        catalog.refresh()
+
+    elapsed = time.perf_counter() - start
+    print(f"{total['files']} files converted, {total['failed']} failed in {elapsed:.1f} s: "
+          f"{total['source_bytes'] / 1024 ** 2:.1f} MiB csv -> {total['output_bytes'] / 1024 ** 2:.1f} MiB binary, "
+          f"{format_rate(total['source_bytes'], elapsed)}")
+    sys.exit(1 if total["failed"] or interrupted else 0)
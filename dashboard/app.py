@@ -1,16 +1,26 @@
+import argparse
 import multiprocessing
+import os
 import time
+import uuid
 from dash import Dash, _dash_renderer, Input, Output, State, no_update, callback_context, html
-from dash.dcc import Graph, Interval
-from numpy import genfromtxt
-from plotly_resampler import FigureResampler
-import trace_updater
+from dash.dcc import Graph, Interval, Store
 import dash_mantine_components as dmc
 import plotly.graph_objects as go
 import nidaqmx
 import logging
 
 import utility
+from live import get_tail
+from loader import DatasetCache, Selection
+from sessions import SessionStore
+from summary import STATISTICS, summary_channel, summary_path
+from viewer import viewport
+
+# memory budget of recently loaded datasets and the state of all sessions, configurable with --cache_size
+DEFAULT_CACHE_SIZE = 2048
+# milliseconds between two updates of the live view
+LIVE_UPDATE_INTERVAL = 500
 
 _dash_renderer._set_react_version("18.2.0")
 logger = logging.getLogger(__name__)
@@ -20,7 +30,9 @@ app = Dash(
     external_stylesheets=dmc.styles.ALL,
     suppress_callback_exceptions=True
 )
-fig = FigureResampler()
+datasets = DatasetCache(budget=DEFAULT_CACHE_SIZE * 1024 * 1024)
+# every browser session displays its own measurement, the datasets are shared
+sessions = SessionStore(datasets, budget=DEFAULT_CACHE_SIZE * 1024 * 1024)
 
 """
 Allgemeiner Aufbau der Oberfläche
@@ -68,6 +80,48 @@ app.layout = dmc.MantineProvider(
             value=["measurement",],
             multiple=True,
             children=[
+                dmc.AccordionItem(
+                    value="measurement",
+                    children=[
+                        dmc.AccordionControl("Datenaufzeichnung"),
+                        dmc.AccordionPanel(
+                            [
+                                dmc.Stack(
+                                    gap="xs",
+                                    children=[
+                                        dmc.Center(
+                                            dmc.Group([
+                                                dmc.Select(
+                                                    label="Laufende Messung wählen",
+                                                    placeholder="Messung auswählen",
+                                                    id="live-selection",
+                                                    data=utility.get_measurement_file_names(),
+                                                    w=500
+                                                ),
+                                                dmc.NumberInput(
+                                                    label="Zeitfenster",
+                                                    id="live-window",
+                                                    value=10,
+                                                    min=1,
+                                                    max=600,
+                                                    suffix=" s",
+                                                    w=120
+                                                ),
+                                            ], align="flex-end")
+                                        ),
+                                        dmc.Center(
+                                            dmc.Switch(label="Live-Ansicht", id="live-switch", checked=False)
+                                        ),
+                                        Graph("live-plot", figure=utility.default_plot),
+                                        Interval(id="live-interval", interval=LIVE_UPDATE_INTERVAL, disabled=True),
+                                        # Fortschritt der Live-Ansicht dieser Sitzung, nur neue Datenpunkte werden gesendet
+                                        Store(id="live-cursor")
+                                    ]
+                                )
+                            ]
+                        )
+                    ]
+                ),
                 dmc.AccordionItem(
                     value="visualization",
                     children=[
@@ -97,19 +151,89 @@ app.layout = dmc.MantineProvider(
                                             shadow="md",
                                             zIndex=2000,
                                         ),
+                                        # Filter des Messungskatalogs, Suche nach Dateiname oder Kanal
+                                        dmc.Center(
+                                            dmc.Group([
+                                                dmc.TextInput(
+                                                    label="Suche",
+                                                    placeholder="Dateiname oder Kanal",
+                                                    id="catalog-search",
+                                                    debounce=300,
+                                                    w=200
+                                                ),
+                                                dmc.MultiSelect(
+                                                    label="Format",
+                                                    placeholder="Alle",
+                                                    id="catalog-format",
+                                                    data=[{"value": "csv", "label": "CSV"},
+                                                          {"value": "npy", "label": "Binär"}],
+                                                    w=160
+                                                ),
+                                                dmc.NumberInput(
+                                                    label="Mindestdauer",
+                                                    id="catalog-min-duration",
+                                                    min=0,
+                                                    suffix=" s",
+                                                    w=130
+                                                ),
+                                                dmc.Button("Aktualisieren", id="catalog-refresh-btn", variant="light"),
+                                            ], align="flex-end")
+                                        ),
                                         dmc.Center(
                                             dmc.Select(
                                                 label="Datensatz wählen",
-                                                placeholder="CSV-Datei auswählen",
+                                                placeholder="Messung auswählen",
                                                 id="data-selection",
                                                 data=utility.get_measurement_file_names(),
+                                                searchable=True,
+                                                nothingFoundMessage="Keine Messung gefunden",
                                                 w=500
                                             )
                                         ),
+                                        dmc.Center(
+                                            dmc.Text(id="dataset-info", size="sm", c="dimmed")
+                                        ),
+                                        # Auswahl von Kanälen und Zeitbereich, nur diese werden geladen
+                                        dmc.Center(
+                                            dmc.Group([
+                                                dmc.MultiSelect(
+                                                    label="Kanäle",
+                                                    placeholder="Alle Kanäle",
+                                                    id="channel-selection",
+                                                    data=[],
+                                                    searchable=True,
+                                                    clearable=True,
+                                                    w=300
+                                                ),
+                                                dmc.NumberInput(
+                                                    label="Von",
+                                                    id="time-start",
+                                                    min=0,
+                                                    suffix=" s",
+                                                    w=120
+                                                ),
+                                                dmc.NumberInput(
+                                                    label="Bis",
+                                                    id="time-stop",
+                                                    min=0,
+                                                    suffix=" s",
+                                                    w=120
+                                                ),
+                                            ], align="flex-end")
+                                        ),
+                                        dmc.Center(
+                                            dmc.Switch(label="Zusammenfassung anzeigen (Minimum, Maximum, Mittelwert, "
+                                                             "RMS und dominante Frequenz je Zeitfenster)",
+                                                       id="summary-switch", checked=False)
+                                        ),
                                         dmc.Center(
                                             dmc.Button("Datensatz laden", color="green", id="load-data-btn", loaderProps={"type": "dots"}, loading=False)
                                         ),
-                                        Graph("data-plot")
+                                        Graph("data-plot", figure=utility.default_plot),
+                                        # Pfad und Auswahl des angezeigten Datensatzes, benötigt beim Zoomen
+                                        Store(id="displayed-dataset"),
+                                        # Kennung der Sitzung, bleibt beim Neuladen der Seite erhalten
+                                        Store(id="session-id", storage_type="session")
                                     ]
                                 )
                             ]
@@ -118,40 +242,74 @@ app.layout = dmc.MantineProvider(
                 )
             ]
         ),
-        trace_updater.TraceUpdater(id="trace-updater", gdID="data-plot"),
     ]
 )
 
 
 
 # TODO: Plot vertikal größer machen
+@app.callback(
+    Output("session-id", "data"),
+    Output("data-plot", "figure", allow_duplicate=True),
+    Output("displayed-dataset", "data", allow_duplicate=True),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+    prevent_initial_call="initial_duplicate"
+)
+def on_session_start(timestamp, session_id):
+    """Neue Sitzungen erhalten eine Kennung, bestehende zeigen nach dem Neuladen wieder ihren Datensatz an."""
+    if session_id is None:
+        return str(uuid.uuid4()), no_update, no_update
+    restored = sessions.restore(session_id)
+    if restored is None:
+        return no_update, no_update, no_update
+    file, selection, fig = restored
+    return no_update, fig, {"file": file, "selection": list(selection or ())}
+
+
 @app.callback([
-    Output("data-plot", "figure"),
+    Output("data-plot", "figure", allow_duplicate=True),
     Output("notification-container", "children"),
+    Output("displayed-dataset", "data", allow_duplicate=True),
 ], [Input("load-data-btn", "n_clicks"),
-    State("data-selection", "value")]
+    State("data-selection", "value"),
+    State("channel-selection", "value"),
+    State("time-start", "value"),
+    State("time-stop", "value"),
+    State("summary-switch", "checked"),
+    State("session-id", "data")],
+    prevent_initial_call=True
 )
-def on_load_btn_click(n_clicks, file):
+def on_load_btn_click(n_clicks, file, channels, start, stop, show_summary, session_id):
     ctx = callback_context
+    channels = channels or None
+    if file is not None and show_summary and not file.endswith(".summary.rec"):
+        # die Zusammenfassung wird vom Datenleser mit --summary_window neben die Messung geschrieben
+        file = summary_path(file)
+        if not os.path.exists(file):
+            return utility.default_plot, dmc.Notification(
+                id="error-notification",
+                title="Keine Zusammenfassung vorhanden",
+                action="show",
+                autoClose=4000,
+                color="red",
+                message="Für diese Messung wurde keine Zusammenfassung aufgezeichnet (Option --summary_window)."
+            ), None
+        if channels is not None:
+            # die Zusammenfassung enthält je Kanal eine Spalte pro Kennwert
+            channels = [summary_channel(channel, statistic) for channel in channels for statistic in STATISTICS]
     if len(ctx.triggered) and "load-data-btn" in ctx.triggered[0]["prop_id"] and file is not None:
-        # load data
-        data = genfromtxt(file, delimiter=",", skip_header=1)
-        global fig
-        if len(fig.data):
-            fig.replace(go.Figure())
-
-        # num_channles = size of second dimension - 1 (first entry is timestamp)
-        num_channels = data.shape[1]-1
-        # for every data channel add a trace to plot
-        for i in range(num_channels):
-            fig.add_trace(go.Scattergl(name=f"ai{i}", hovertemplate="Zeit: %{x}s <br>Y: %{y} </br>"), hf_x=data[:, 0], hf_y=data[:, i+1])
-        fig.update_layout(height=700)
+        # binary recordings and the binary copies of CSV files are memory mapped, recently used datasets are cached
+        # and shared between the sessions, every trace shows the coarsest level of its pyramid. Only the selected
+        # channels and time range are read, an empty input selects all channels or the whole measurement.
+        selection = Selection.of(channels, start if start != "" else None, stop if stop != "" else None)
+        fig = sessions.open(session_id, file, selection)
         return fig, dmc.Notification(id="loading-notification", title="Messungen geladen",
                                      message="Visualisierung wurde erstellt", autoClose=2000, color="green",
-                                     action="update")
+                                     action="update"), {"file": file, "selection": list(selection)}
     else:
         if n_clicks is None:
-            return utility.default_plot, None
+            return utility.default_plot, None, None
         return utility.default_plot , dmc.Notification(
             id="error-notification",
             title="Keine Messungen ausgewählt",
@@ -159,9 +317,121 @@ def on_load_btn_click(n_clicks, file):
             autoClose=4000,
             color="red",
             message="Es wurde keine Messung zur Visualisierung ausgewählt."
-        )
+        ), None
+
+
+@app.callback(
+    Output("data-selection", "data"),
+    Input("catalog-search", "value"),
+    Input("catalog-format", "value"),
+    Input("catalog-min-duration", "value"),
+    Input("catalog-refresh-btn", "n_clicks"),
+    Input("data-selection", "dropdownOpened"),
+    prevent_initial_call=True
+)
+def on_catalog_filter(search, formats, min_duration, n_clicks, opened):
+    """
+    Filtert den Messungskatalog. Vor jeder Filterung werden neue und geänderte Messungen erfasst, dabei werden nur
+    die Messungen gelesen, deren Änderungszeit oder Größe sich geändert hat.
+    """
+    if callback_context.triggered_id == "data-selection" and not opened:
+        return no_update
+    return utility.get_measurement_file_names(search, formats, min_duration or None)
+
+
+@app.callback(
+    Output("dataset-info", "children"),
+    Output("channel-selection", "data"),
+    Output("channel-selection", "value"),
+    Input("data-selection", "value"),
+)
+def on_data_selection(file):
+    """
+    Zeigt Kanäle, Abtastrate, Anzahl der Samples, Dauer, Größe und Format der gewählten Messung und bietet ihre
+    Kanäle zur Auswahl an.
+    """
+    entry = None if file is None else next(
+        (entry for entry in utility.catalog.entries if utility.catalog.absolute_path(entry) == file), None)
+    if entry is None:
+        return "", [], []
+    return utility.describe_entry(entry), entry["channels"], []
 
-fig.register_update_graph_callback(app=app, graph_id="data-plot", trace_updater_id="trace-updater")
+
+@app.callback(
+    Output("live-selection", "data"),
+    Input("live-selection", "dropdownOpened"),
+    prevent_initial_call=True
+)
+def on_live_selection_opened(opened):
+    """Messungen, die nach dem Start des Dashboards begonnen wurden, werden ebenfalls angeboten."""
+    if not opened:
+        return no_update
+    return utility.get_measurement_file_names()
+
+
+@app.callback(
+    Output("live-interval", "disabled"),
+    Output("live-cursor", "data"),
+    Input("live-switch", "checked"),
+    Input("live-selection", "value"),
+    Input("live-window", "value"),
+)
+def on_live_switch(checked, file, window):
+    # jede Änderung startet die Live-Ansicht mit dem vollständigen Zeitfenster neu
+    return not checked or file is None or not window, None
+
+
+@app.callback(
+    Output("live-plot", "figure"),
+    Output("live-plot", "extendData"),
+    Output("live-cursor", "data", allow_duplicate=True),
+    Input("live-interval", "n_intervals"),
+    State("live-selection", "value"),
+    State("live-window", "value"),
+    State("live-cursor", "data"),
+    prevent_initial_call=True
+)
+def on_live_interval(n_intervals, file, window, cursor):
+    """
+    Liest die seit dem letzten Aufruf geschriebenen Samples der laufenden Messung. Beim ersten Aufruf wird das
+    vollständige Zeitfenster gesendet, danach werden nur die neuen Datenpunkte per extendData angehängt.
+    """
+    if file is None or not window:
+        return no_update, no_update, no_update
+    tail = get_tail(file, float(window))
+    tail.poll()
+    if cursor is None or tail.expired(cursor):
+        fig, index = tail.figure()
+        return fig, no_update, index
+    x, ys, index = tail.points(cursor)
+    if not len(x):
+        return no_update, no_update, index
+    extend_data = dict(x=[x] * len(ys), y=ys)
+    return no_update, [extend_data, list(range(len(ys))), tail.max_points], index
+
+
+@app.callback(
+    Output("data-plot", "figure", allow_duplicate=True),
+    Input("data-plot", "relayoutData"),
+    State("displayed-dataset", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def on_plot_relayout(relayout_data, displayed, session_id):
+    """Beim Zoomen und Verschieben werden nur die sichtbaren Datenpunkte in passender Auflösung nachgeladen."""
+    if displayed is None or relayout_data is None:
+        return no_update
+    try:
+        x_range = viewport(relayout_data)
+    except KeyError:
+        return no_update
+    return sessions.relayout(session_id, displayed["file"], x_range, Selection.of(*displayed["selection"]))
 
 if __name__ == "__main__":
+    dashboard_parser = argparse.ArgumentParser(description="Dashboard to visualize stored measurements")
+    dashboard_parser.add_argument("--cache_size", type=int, default=DEFAULT_CACHE_SIZE,
+                                  help="Memory in MiB shared by recently loaded datasets and the state of all "
+                                       f"sessions (Default: {DEFAULT_CACHE_SIZE})")
+    dashboard_args = dashboard_parser.parse_args()
+    datasets.budget = sessions.budget = dashboard_args.cache_size * 1024 * 1024
     app.run(debug=True)
@@ -0,0 +1,282 @@
+import io
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import utility  # noqa: F401, adds the repository root to the import path
+from pyramid import aggregate
+from segments import SegmentIndex
+from storage import apply_scaling, channel_file_name, read_metadata, read_npy, sample_times
+from viewer import HOVER_TEMPLATE, MAX_POINTS, _envelope
+
+# seconds after which the tail of a recording nobody looks at anymore is dropped
+IDLE_TIMEOUT = 60.0
+
+
+class RollingBuffer:
+    """
+    The last `capacity` samples of every channel together with their timestamps.
+
+    Samples are counted from the start of the tail, `end` being the index following the newest sample. The buffer
+    holds twice the capacity, so appending only moves data once per `capacity` samples.
+    """
+
+    def __init__(self, n_channels: int, capacity: int):
+        self.capacity = capacity
+        self._time = np.empty(2 * capacity)
+        self._values = np.empty((n_channels, 2 * capacity))
+        self._length = 0
+        self.end = 0
+
+    @property
+    def start(self) -> int:
+        """Index of the oldest sample inside the window."""
+        return self.end - min(self._length, self.capacity)
+
+    def extend(self, time: np.ndarray, values: np.ndarray):
+        # samples older than the window are counted but not kept
+        self.end += len(time) - min(len(time), self.capacity)
+        time, values = time[-self.capacity:], values[:, -self.capacity:]
+        n = len(time)
+        if self._length + n > len(self._time):
+            keep = self.capacity - n
+            self._time[:keep] = self._time[self._length - keep:self._length]
+            self._values[:, :keep] = self._values[:, self._length - keep:self._length]
+            self._length = keep
+        self._time[self._length:self._length + n] = time
+        self._values[:, self._length:self._length + n] = values
+        self._length += n
+        self.end += n
+
+    def since(self, index: int):
+        """Timestamps and samples from `index`, or from the oldest sample held, up to the newest one."""
+        first = self._length - (self.end - max(index, self.start))
+        return self._time[first:self._length], self._values[:, first:self._length]
+
+
+class RecordingTail:
+    """Follows a binary recording while it is written, reading only the rows appended since the last poll."""
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        metadata = read_metadata(path)
+        self.channels = metadata["channels"]
+        self.sampling_rate = metadata["sampling_rate"]
+        self.scaling = metadata.get("scaling")
+        self.first_sample = metadata.get("first_sample", 0)
+        self._position = max(0, self._available() - capacity)
+
+    def _columns(self):
+        return [read_npy(os.path.join(self.path, channel_file_name(channel))) for channel in self.channels]
+
+    def _available(self) -> int:
+        return min(len(column) for column in self._columns())
+
+    def read(self):
+        """Timestamps and samples in volts appended since the last call."""
+        columns = self._columns()
+        stop = min(len(column) for column in columns)
+        values = np.empty((len(self.channels), stop - self._position))
+        for i, (channel, column) in enumerate(zip(self.channels, columns)):
+            samples = column[self._position:stop]
+            values[i] = samples if not self.scaling else apply_scaling(samples, self.scaling[channel])
+        time = sample_times(self.first_sample + self._position, stop - self._position, self.sampling_rate)
+        self._position = stop
+        return time, values
+
+
+class CsvTail:
+    """Follows a CSV file while it is written, parsing only the complete lines appended since the last poll."""
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        metadata = read_metadata(path) or {}
+        self.scaling = metadata.get("scaling")
+        with open(path, "rb") as f:
+            header = f.readline()
+            self.channels = header.decode("ascii").strip().split(",")[1:]
+            self._offset = f.tell()
+            # start about `capacity` lines before the end, estimated from the length of the first lines
+            sample = f.read(64 * 1024)
+            lines = sample.count(b"\n")
+            size = os.fstat(f.fileno()).st_size
+            if lines and size - self._offset > capacity * len(sample) / lines:
+                f.seek(size - int(capacity * len(sample) / lines))
+                f.readline()
+                self._offset = f.tell()
+
+    def read(self):
+        """Timestamps and samples in volts of the lines appended since the last call."""
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # the last line may still be incomplete, it is parsed with the next poll
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        if not data:
+            return np.empty(0), np.empty((len(self.channels), 0))
+        rows = pd.read_csv(io.BytesIO(data), header=None, dtype=np.float64, engine="c").to_numpy().T
+        values = rows[1:]
+        if self.scaling:
+            values = np.array([apply_scaling(samples, self.scaling[channel])
+                               for channel, samples in zip(self.channels, values)])
+        return rows[0], values
+
+
+class SegmentTail:
+    """
+    Follows a segmented recording while it is written, see `segments.SegmentedWriter`.
+
+    The newest segment listed in the index is tailed. Once the writer starts a new segment, the rest of the closed
+    one is read before the tail moves on to the next segment.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        index = SegmentIndex(path)
+        self.channels = index.channels
+        self._format = index.index["format"]
+        self._number = len(index.segments) - 1
+        self._source = self._open(index.segments[self._number])
+
+    def _open(self, segment: dict):
+        """Tail of `segment`, None while the writer has not flushed the header of a new segment yet."""
+        path = os.path.join(os.path.dirname(self.path), segment["file"])
+        try:
+            if self._format == "npy":
+                return RecordingTail(path, self.capacity)
+            with open(path, "rb") as f:
+                if not f.readline().endswith(b"\n"):
+                    return None
+            return CsvTail(path, self.capacity)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def read(self):
+        """Timestamps and samples in volts appended since the last call, across the segments started meanwhile."""
+        segments = SegmentIndex(self.path).segments
+        parts = []
+        while True:
+            if self._source is None:
+                self._source = self._open(segments[self._number])
+            if self._source is not None:
+                try:
+                    parts.append(self._source.read())
+                except OSError:
+                    # closed csv segments are replaced by their compressed copy, the rest of this one is skipped
+                    pass
+            if self._number + 1 >= len(segments):
+                break
+            self._number += 1
+            self._source = None
+        parts = [(time, values) for time, values in parts if len(time)]
+        if not parts:
+            return np.empty(0), np.empty((len(self.channels), 0))
+        return np.concatenate([time for time, _ in parts]), np.concatenate([values for _, values in parts], axis=1)
+
+
+class LiveTail:
+    """
+    Rolling window of the last `window` seconds of a measurement which is still being recorded.
+
+    The file written by the data reader is tailed incrementally. It is flushed by the writer once per second, so the
+    view lags the acquisition by about a second. One tail is shared by every session showing the same measurement.
+
+    Parameters
+    ----------
+    path : str
+        Path of the CSV file, binary recording or index of a segmented recording being written.
+    window : float
+        Length of the window in seconds.
+    """
+
+    def __init__(self, path: str, window: float):
+        segmented = path.endswith(".index.json")
+        metadata = SegmentIndex(path).index if segmented else read_metadata(path) or {}
+        self.sampling_rate = metadata.get("sampling_rate") or self._estimate_sampling_rate(path)
+        self.window = window
+        capacity = max(1, int(window * self.sampling_rate))
+        if segmented:
+            self._source = SegmentTail(path, capacity)
+        else:
+            self._source = RecordingTail(path, capacity) if path.endswith(".rec") else CsvTail(path, capacity)
+        self.channels = self._source.channels
+        self.buffer = RollingBuffer(len(self.channels), capacity)
+        # samples per bucket, so the whole window is shown with at most MAX_POINTS points per channel
+        self.bucket_size = max(1, math.ceil(capacity / (MAX_POINTS // 2)))
+        self.last_access = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _estimate_sampling_rate(path: str) -> float:
+        time_column = pd.read_csv(path, nrows=2, usecols=[0]).to_numpy().ravel()
+        return 1 / (time_column[1] - time_column[0])
+
+    @property
+    def max_points(self) -> int:
+        """Number of points per trace covering the whole window."""
+        return self.buffer.capacity if self.bucket_size == 1 \
+            else 2 * math.ceil(self.buffer.capacity / self.bucket_size)
+
+    def poll(self):
+        with self._lock:
+            self.last_access = time.monotonic()
+            time_values, values = self._source.read()
+            if len(time_values):
+                self.buffer.extend(time_values, values)
+
+    def points(self, index: int):
+        """
+        Points of every channel for the samples from `index`, decimated to screen resolution.
+
+        Only complete buckets are returned. Returns the x values, the y values of every channel and the index to
+        continue from with the next call.
+        """
+        with self._lock:
+            time_values, values = (array.copy() for array in self.buffer.since(index))
+            first = self.buffer.end - len(time_values)
+        if self.bucket_size == 1:
+            return time_values, list(values), first + len(time_values)
+        # buckets are aligned to multiples of the bucket size, so consecutive calls continue seamlessly
+        skip = -first % self.bucket_size
+        n_buckets = (len(time_values) - skip) // self.bucket_size
+        if n_buckets <= 0:
+            return np.empty(0), [np.empty(0) for _ in self.channels], first + skip
+        stop = skip + n_buckets * self.bucket_size
+        centers = time_values[skip + self.bucket_size // 2:stop:self.bucket_size]
+        envelopes = [_envelope(centers, aggregate(samples[skip:stop], self.bucket_size)) for samples in values]
+        return envelopes[0][0], [y for _, y in envelopes], first + stop
+
+    def figure(self):
+        """Figure of the whole window and the index to continue from with `points`."""
+        x, ys, index = self.points(0)
+        fig = go.Figure([go.Scattergl(name=channel, x=x, y=y, hovertemplate=HOVER_TEMPLATE)
+                         for channel, y in zip(self.channels, ys)])
+        fig.update_layout(height=500, uirevision="live")
+        return fig, index
+
+    def expired(self, index: int) -> bool:
+        """True if samples from `index` on are no longer held, a client that far behind needs the whole window."""
+        return index < self.buffer.start
+
+
+_tails = {}
+_tails_lock = threading.Lock()
+
+
+def get_tail(path: str, window: float) -> LiveTail:
+    """Shared tail of `path` with a window of `window` seconds, tails nobody polled for a while are dropped."""
+    with _tails_lock:
+        now = time.monotonic()
+        for key in [key for key, tail in _tails.items() if now - tail.last_access > IDLE_TIMEOUT]:
+            del _tails[key]
+        tail = _tails.get((path, window))
+        if tail is None:
+            tail = _tails[(path, window)] = LiveTail(path, window)
+        return tail
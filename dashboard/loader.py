@@ -0,0 +1,486 @@
+import collections
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import utility  # noqa: F401, adds the repository root to the import path
+from pyramid import Pyramid, build_pyramid, pyramid_path
+from segments import SegmentIndex
+from storage import NpyAppender, Recording, apply_scaling, channel_file_name, metadata_path, read_metadata, \
+    read_npy, sample_times, storage_size
+
+# hidden folder next to the CSV files holding their binary copies
+CACHE_DIRECTORY = ".cache"
+# rows parsed at once, bounds the memory needed while a CSV file is converted
+CSV_CHUNK_ROWS = 500_000
+COLUMNS_FILE = "columns.json"
+# bytes below which the bisection of a CSV file ends and the lines are scanned instead
+CSV_SCAN_BYTES = 64 * 1024
+# selections with fewer samples are aggregated on the fly while the measurement has no pyramid, larger ones build it
+SELECTION_PYRAMID_SAMPLES = 2 ** 20
+
+
+class Selection(collections.namedtuple("Selection", ["channels", "start", "stop"], defaults=[None, None, None])):
+    """
+    Channels and time range of a measurement to load, None selects all channels or the start or end of the
+    measurement respectively. The times are in seconds of the time axis of the measurement.
+    """
+
+    @classmethod
+    def of(cls, channels=None, start=None, stop=None):
+        """Selection from values of the dashboard, e.g. a list of channels, usable as key of a cache."""
+        return cls(tuple(sorted(channels)) if channels else None, start, stop)
+
+    @property
+    def complete(self) -> bool:
+        return not self.channels and self.start is None and self.stop is None
+
+    def select(self, channels: list) -> list:
+        """The selected channels of `channels`, in their stored order."""
+        return list(channels) if not self.channels else [channel for channel in channels if channel in self.channels]
+
+
+class Dataset:
+    """
+    Time axis and samples of every channel of a measurement, as plotted by the dashboard.
+
+    The samples are kept as stored, usually memory mapped, and converted to volts only for the requested range.
+
+    Parameters
+    ----------
+    path : str
+        Path of the measurement.
+    channels : list
+        Channel names.
+    columns : dict
+        Stored samples of every channel, keyed by channel name.
+    sampling_rate : float, optional
+        Sampling rate in Hz, the time axis is derived from it if no `time` column is given.
+    time : numpy.ndarray, optional
+        Timestamps in seconds of every sample.
+    scaling : dict, optional
+        Polynomial scaling coefficients of every channel for raw recordings, see `storage.apply_scaling`.
+    first_sample : int, optional
+        Sample index of the first sample, the time axis derived from the sampling rate starts there (Default: 0).
+    selection : Selection, optional
+        Channels and time range of the measurement the dataset holds (Default: everything).
+    offset : int, optional
+        Index of the first sample among the samples of the whole measurement, which its pyramid aggregates, None if
+        it is unknown (Default: 0).
+    """
+
+    def __init__(self, path: str, channels: list, columns: dict, sampling_rate: float = None,
+                 time: np.ndarray = None, scaling: dict = None, first_sample: int = 0,
+                 selection: Selection = Selection(), offset: int = 0):
+        self.path = path
+        self.selection = selection
+        self.offset = offset
+        self.first_sample = first_sample
+        self.channels = channels
+        self.columns = columns
+        self.sampling_rate = sampling_rate
+        self._time = time
+        self.scaling = scaling
+        self.n_samples = min((len(column) for column in columns.values()), default=0)
+        self.pyramid = None
+
+    def values(self, channel: str, start: int = 0, stop: int = None) -> np.ndarray:
+        """Samples `start` to `stop` of `channel` in volts."""
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        samples = self.columns[channel][start:stop]
+        if not self.scaling:
+            return samples
+        return apply_scaling(samples, self.scaling[channel])
+
+    def time(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Timestamps in seconds of the samples `start` to `stop`."""
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        if self._time is not None:
+            return self._time[start:stop]
+        return sample_times(self.first_sample + start, stop - start, self.sampling_rate)
+
+    def time_at(self, indices: np.ndarray) -> np.ndarray:
+        """Timestamps in seconds of the samples at `indices`."""
+        if self._time is not None:
+            return self._time[indices]
+        return (self.first_sample + np.asarray(indices)) / self.sampling_rate
+
+    def sample_index(self, time: float) -> int:
+        """Index of the first sample at or after `time`, clipped to the samples of the measurement."""
+        if self._time is not None:
+            index = int(np.searchsorted(self._time[:self.n_samples], time))
+        else:
+            index = math.ceil(time * self.sampling_rate) - self.first_sample
+        return min(max(index, 0), self.n_samples)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory, memory mapped arrays are backed by the page cache and do not count."""
+        arrays = [*self.columns.values()] if self._time is None else [self._time, *self.columns.values()]
+        return sum(array.nbytes for array in arrays if not isinstance(array, np.memmap))
+
+
+def _file_key(path: str) -> tuple:
+    """Identifies the current state of a measurement, it changes whenever the measurement is rewritten."""
+    if os.path.isdir(path):
+        # binary recordings rewrite their header when closed and grow while they are recorded
+        return os.path.abspath(path), os.stat(metadata_path(path)).st_mtime_ns, storage_size(path)
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def csv_cache_path(path: str) -> str:
+    """Directory of the binary copy of a CSV file, named after its path, modification time and size."""
+    absolute_path, mtime, size = _file_key(path)
+    path_hash = hashlib.sha1(absolute_path.encode()).hexdigest()[:16]
+    return os.path.join(os.path.dirname(absolute_path), CACHE_DIRECTORY, f"{path_hash}-{mtime}-{size}")
+
+
+def build_csv_cache(path: str, cache_path: str):
+    """
+    Convert a CSV file chunk by chunk into one .npy file per column inside `cache_path`.
+
+    Only `CSV_CHUNK_ROWS` rows are held in memory at a time. The copy is built in a temporary directory and moved
+    into place once complete, outdated copies of the same file are removed.
+    """
+    cache_directory = os.path.dirname(cache_path)
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(dir=cache_directory, prefix=".tmp-")
+    try:
+        columns = None
+        column_files = []
+        for chunk in pd.read_csv(path, chunksize=CSV_CHUNK_ROWS, dtype=np.float64, engine="c"):
+            if columns is None:
+                columns = [str(column) for column in chunk.columns]
+                column_files = [NpyAppender(os.path.join(temporary_path, channel_file_name(column)), np.float64)
+                                for column in columns]
+            for column_file, column in zip(column_files, columns):
+                column_file.append(chunk[column].to_numpy())
+        if columns is None:
+            columns = [str(column) for column in pd.read_csv(path, nrows=0).columns]
+        for column_file in column_files:
+            column_file.close()
+        with open(os.path.join(temporary_path, COLUMNS_FILE), "w") as f:
+            json.dump(columns, f)
+        try:
+            os.rename(temporary_path, cache_path)
+        except OSError:
+            # built concurrently by another callback in the meantime
+            shutil.rmtree(temporary_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+    path_hash = os.path.basename(cache_path).split("-")[0]
+    for entry in os.listdir(cache_directory):
+        if entry.startswith(path_hash + "-") and entry != os.path.basename(cache_path):
+            shutil.rmtree(os.path.join(cache_directory, entry), ignore_errors=True)
+
+
+def _sample_range(selection: Selection, first_sample: int, sampling_rate: float, n_samples: int) -> tuple:
+    """Indices `start, stop` of the stored samples inside the time range of `selection`."""
+    start = 0 if selection.start is None else \
+        min(max(math.ceil(selection.start * sampling_rate) - first_sample, 0), n_samples)
+    stop = n_samples if selection.stop is None else \
+        min(max(math.floor(selection.stop * sampling_rate) + 1 - first_sample, start), n_samples)
+    return start, stop
+
+
+class _ByteRange(io.RawIOBase):
+    """Read access to the bytes `start` to `stop` of an open binary file."""
+
+    def __init__(self, file, start: int, stop: int):
+        self._file = file
+        self._file.seek(start)
+        self._remaining = stop - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._file.readinto(memoryview(buffer)[:min(len(buffer), self._remaining)])
+        self._remaining -= n
+        return n
+
+
+def _line_time(file, offset: int, data_start: int) -> tuple:
+    """Offset and time of the first complete line starting at or after `offset`, the time is inf past the end."""
+    file.seek(offset)
+    if offset > data_start:
+        file.readline()
+    position = file.tell()
+    line = file.readline()
+    return position, float(line.split(b",", 1)[0]) if line.endswith(b"\n") else math.inf
+
+
+def csv_offset(file, time: float, data_start: int, size: int) -> int:
+    """
+    Byte offset of the first line of a CSV file whose time is at or after `time`, `size` if there is none.
+
+    The time column grows monotonically, so the offset is found by bisecting the file, only a few kilobytes around
+    every probed offset are read.
+    """
+    low, high = data_start, size
+    while high - low > CSV_SCAN_BYTES:
+        position, line_time = _line_time(file, (low + high) // 2, data_start)
+        if position >= high:
+            break
+        if line_time < time:
+            low = position
+        else:
+            high = position
+    position = low
+    while position < size:
+        next_position, line_time = _line_time(file, position, position)
+        if line_time >= time:
+            return next_position
+        position = file.tell()
+    return size
+
+
+def read_csv_window(path: str, selection: Selection) -> Dataset:
+    """
+    Load the channels and time range of `selection` directly from a CSV file.
+
+    The byte range of the time range is located with `csv_offset`, only this range is parsed, in chunks of
+    `CSV_CHUNK_ROWS` rows, and only the time column and the selected channels are kept, so memory and load time
+    depend on the selection and not on the size of the file. The number of lines before the time range is not known,
+    so the dataset has no offset inside the measurement.
+    """
+    metadata = read_metadata(path) or {}
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        time_column, *channels = f.readline().decode("ascii").strip().split(",")
+        data_start = f.tell()
+        start = data_start if selection.start is None else csv_offset(f, selection.start, data_start, size)
+        stop = size if selection.stop is None else csv_offset(f, math.nextafter(selection.stop, math.inf),
+                                                               data_start, size)
+        selected = selection.select(channels)
+        columns = {column: [] for column in (time_column, *selected)}
+        if stop > start:
+            chunks = pd.read_csv(io.BufferedReader(_ByteRange(f, start, stop)), header=None,
+                                 names=[time_column, *channels], usecols=list(columns), chunksize=CSV_CHUNK_ROWS,
+                                 dtype=np.float64, engine="c")
+            for chunk in chunks:
+                for column in columns:
+                    columns[column].append(chunk[column].to_numpy())
+    columns = {column: np.concatenate(parts) if parts else np.empty(0) for column, parts in columns.items()}
+    return Dataset(path, selected, {channel: columns[channel] for channel in selected},
+                   sampling_rate=metadata.get("sampling_rate"), time=columns[time_column],
+                   scaling=metadata.get("scaling"), selection=selection, offset=None)
+
+
+def load_csv(path: str, selection: Selection = Selection()) -> Dataset:
+    """
+    Load a CSV measurement through its binary copy, which is built on first access.
+
+    Selections of a file without binary copy are read from the CSV file itself instead, see `read_csv_window`.
+    """
+    cache_path = csv_cache_path(path)
+    if not os.path.isdir(cache_path):
+        if not selection.complete:
+            return read_csv_window(path, selection)
+        build_csv_cache(path, cache_path)
+    with open(os.path.join(cache_path, COLUMNS_FILE)) as f:
+        time_column, *channels = json.load(f)
+    channels = selection.select(channels)
+    columns = {column: read_npy(os.path.join(cache_path, channel_file_name(column)))
+               for column in (time_column, *channels)}
+    time = columns[time_column]
+    start = 0 if selection.start is None else int(np.searchsorted(time, selection.start))
+    stop = len(time) if selection.stop is None else int(np.searchsorted(time, selection.stop, side="right"))
+    metadata = read_metadata(path) or {}
+    # raw recordings store ADC codes, they are converted to volts on access
+    return Dataset(path, channels, {channel: columns[channel][start:stop] for channel in channels},
+                   sampling_rate=metadata.get("sampling_rate"), time=time[start:stop],
+                   scaling=metadata.get("scaling"), selection=selection, offset=start)
+
+
+def load_recording(path: str, selection: Selection = Selection()) -> Dataset:
+    """Load the selected channels and samples of a binary recording, its channel files are memory mapped."""
+    recording = Recording(path)
+    start, stop = _sample_range(selection, recording.first_sample, recording.sampling_rate, recording.n_samples)
+    channels = selection.select(recording.channels)
+    return Dataset(path, channels, {channel: recording.channel(channel)[start:stop] for channel in channels},
+                   sampling_rate=recording.sampling_rate, scaling=recording.scaling,
+                   first_sample=recording.first_sample + start, selection=selection, offset=start)
+
+
+class SegmentedDataset(Dataset):
+    """
+    Selection of a segmented recording, read through its index on access instead of being held in memory.
+
+    Samples are addressed by their sample index, the lines of dropped blocks missing from csv segments read as NaN,
+    so the time axis follows from the sampling rate. Only the segments holding the requested samples are opened and,
+    for csv segments, only the blocks around them are read, see `segments.SegmentIndex.read_samples`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the index file.
+    index : segments.SegmentIndex
+        Index of the recording.
+    channels : list
+        Selected channel names.
+    start, stop : int
+        Sample indices of the first sample and following the last sample of the selection.
+    selection : Selection, optional
+        Channels and time range of the measurement the dataset holds (Default: everything).
+    """
+
+    def __init__(self, path: str, index: SegmentIndex, channels: list, start: int, stop: int,
+                 selection: Selection = Selection()):
+        super().__init__(path, channels, {}, sampling_rate=index.sampling_rate, first_sample=start,
+                         selection=selection, offset=start)
+        self.index = index
+        self.n_samples = stop - start
+
+    def values(self, channel: str, start: int = 0, stop: int = None) -> np.ndarray:
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        first = self.first_sample + start
+        time, values = self.index.read_samples(first, self.first_sample + stop, [channel])
+        if len(time) == stop - start:
+            return values[0]
+        samples = np.full(max(stop - start, 0), np.nan)
+        samples[np.rint(time * self.sampling_rate).astype(np.int64) - first] = values[0]
+        return samples
+
+
+def load_segments(path: str, selection: Selection = Selection()) -> Dataset:
+    """Open the selected channels and samples of a segmented recording through its index file `path`."""
+    index = SegmentIndex(path)
+    start, stop = _sample_range(selection, 0, index.sampling_rate, index.n_samples)
+    return SegmentedDataset(path, index, selection.select(index.channels), start, stop, selection)
+
+
+def _measurement_samples(dataset: Dataset):
+    """
+    Channels, access to the samples and number of samples of the whole measurement of a dataset, as read by
+    `build_pyramid`.
+    """
+    if dataset.selection.complete:
+        return dataset.channels, dataset.values, dataset.n_samples
+    if dataset.path.endswith(".rec"):
+        measurement = load_recording(dataset.path)
+    elif dataset.path.endswith(".index.json"):
+        measurement = load_segments(dataset.path)
+    else:
+        # selections of CSV files with an offset were loaded from the binary copy, see `load_csv`
+        measurement = load_csv(dataset.path)
+    return measurement.channels, measurement.values, measurement.n_samples
+
+
+def load_pyramid(dataset: Dataset):
+    """
+    Open the min/max/mean pyramid of the measurement of a dataset, it is built and stored next to the measurement if
+    missing.
+
+    A selection is a contiguous part of the measurement, so it uses the pyramid of the whole measurement starting at
+    its offset, see `Dataset.offset` and `viewer.trace_data`. While the measurement has no pyramid, selections of
+    fewer than `SELECTION_PYRAMID_SAMPLES` samples are aggregated on the fly and larger ones build it. Selections
+    without offset have no pyramid.
+    """
+    if dataset.offset is None:
+        return None
+    path = pyramid_path(dataset.path)
+    source = list(_file_key(dataset.path)[1:])
+    pyramid = Pyramid.open(path, source)
+    if pyramid is None and (dataset.selection.complete or dataset.n_samples >= SELECTION_PYRAMID_SAMPLES):
+        build_pyramid(path, *_measurement_samples(dataset), source)
+        pyramid = Pyramid.open(path, source)
+    if pyramid is None or dataset.offset + dataset.n_samples > pyramid.n_samples:
+        return None
+    return pyramid
+
+
+def load_dataset(path: str, selection: Selection = Selection()) -> Dataset:
+    if path.endswith(".rec"):
+        dataset = load_recording(path, selection)
+    elif path.endswith(".index.json"):
+        dataset = load_segments(path, selection)
+    else:
+        dataset = load_csv(path, selection)
+    dataset.pyramid = load_pyramid(dataset)
+    return dataset
+
+
+class DatasetCache:
+    """
+    In-process LRU cache of loaded datasets limited by the memory they hold.
+
+    Datasets are keyed on path, modification time, size and selection, so a rewritten measurement is loaded again,
+    while every caller asking for the same selection of a measurement shares one instance. If the memory held by all
+    cached datasets exceeds `budget` bytes, the least recently used ones are evicted, datasets whose path is returned
+    by `pinned` (e.g. those displayed by a session) only if that is not sufficient.
+
+    Parameters
+    ----------
+    budget : int
+        Memory budget in bytes, see `Dataset.nbytes`.
+    pinned : callable, optional
+        Returns the paths of datasets which are still in use.
+
+    Example
+    -------
+    >>> datasets = DatasetCache(budget=1024 ** 3)
+    >>> dataset = datasets.get("data/measurements.csv")
+    >>> window = datasets.get("data/measurements.csv", Selection(channels=("ai0",), start=10.0, stop=20.0))
+    """
+
+    def __init__(self, budget: int, pinned=None):
+        self.budget = budget
+        self.pinned = pinned
+        self._datasets = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(dataset.nbytes for dataset in self._datasets.values())
+
+    def get(self, path: str, selection: Selection = Selection()) -> Dataset:
+        """The dataset holding `selection` of the measurement at `path`, loaded if it is not cached."""
+        selection = Selection.of(*selection)
+        key = (*_file_key(path), selection)
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is not None:
+                self._datasets.move_to_end(key)
+                return dataset
+        dataset = load_dataset(path, selection)
+        with self._lock:
+            # outdated versions of the same measurement are of no use anymore
+            for outdated_key in [cached_key for cached_key in self._datasets
+                                 if cached_key[0] == key[0] and cached_key[1:3] != key[1:3]]:
+                del self._datasets[outdated_key]
+            self._datasets[key] = dataset
+            self.trim(self.budget)
+        return dataset
+
+    def _pinned_paths(self) -> set:
+        return {os.path.abspath(path) for path in self.pinned()} if self.pinned is not None else set()
+
+    @property
+    def pinned_nbytes(self) -> int:
+        """Bytes held by the datasets which are still in use, see `pinned`."""
+        with self._lock:
+            pinned = self._pinned_paths()
+            return sum(dataset.nbytes for key, dataset in self._datasets.items() if key[0] in pinned)
+
+    def trim(self, budget: int):
+        """Evict least recently used datasets until they hold at most `budget` bytes, keeping the newest one."""
+        with self._lock:
+            pinned = self._pinned_paths()
+            for evict_pinned in (False, True):
+                for key in list(self._datasets)[:-1]:
+                    if self.nbytes <= budget:
+                        return
+                    if evict_pinned or key[0] not in pinned:
+                        del self._datasets[key]
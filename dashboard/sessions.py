@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+
+from viewer import create_figure, patch_figure, view
+
+# seconds after which the state of a session without any interaction is dropped
+SESSION_TIMEOUT = 3600.0
+
+
+class SessionState:
+    """
+    Measurement and selection of it displayed by a browser session together with its visible time range and plotted
+    points.
+    """
+
+    def __init__(self, path: str, selection=None):
+        self.path = path
+        self.selection = selection
+        self.x_range = None
+        self.traces = []
+        self.last_access = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(x.nbytes + y.nbytes for x, y in self.traces)
+
+
+class SessionStore:
+    """
+    Server side state of every dashboard session, bounded by a global memory budget.
+
+    Each session references the measurement it displays by path only, the samples themselves live in the shared
+    `DatasetCache`, so sessions displaying the same measurement share its memory. The budget covers the cached
+    datasets and the points plotted by every session. If it is exceeded, the least recently used sessions are dropped
+    first, then datasets which are no longer displayed by any session. A dropped session is restored from the path
+    kept by the browser with its next interaction.
+
+    Parameters
+    ----------
+    datasets : DatasetCache
+        Cache of loaded datasets shared by all sessions.
+    budget : int
+        Memory budget in bytes of the datasets and sessions together.
+
+    Example
+    -------
+    >>> sessions = SessionStore(DatasetCache(budget=1024 ** 3), budget=1024 ** 3)
+    >>> figure = sessions.open(session_id, "data/measurements.rec", Selection.of(["ai0"], 0.0, 60.0))
+    >>> patch = sessions.relayout(session_id, "data/measurements.rec", [10.0, 10.5])
+    """
+
+    def __init__(self, datasets, budget: int):
+        self.datasets = datasets
+        self.budget = budget
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.RLock()
+        datasets.pinned = self.paths
+
+    def paths(self) -> set:
+        """Paths of the measurements displayed by at least one session."""
+        with self._lock:
+            return {state.path for state in self._sessions.values()}
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the plotted points of all sessions."""
+        with self._lock:
+            return sum(state.nbytes for state in self._sessions.values())
+
+    def _session(self, session_id: str, path: str, selection=None) -> SessionState:
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state.path != path or state.selection != selection:
+                state = self._sessions[session_id] = SessionState(path, selection)
+            self._sessions.move_to_end(session_id)
+            state.last_access = time.monotonic()
+            return state
+
+    def _trim(self):
+        with self._lock:
+            now = time.monotonic()
+            for session_id in [session_id for session_id, state in self._sessions.items()
+                               if now - state.last_access > SESSION_TIMEOUT]:
+                del self._sessions[session_id]
+            # datasets no longer displayed are evicted below, only the displayed ones are weighed against sessions
+            while len(self._sessions) > 1 and self.nbytes + self.datasets.pinned_nbytes > self.budget:
+                self._sessions.popitem(last=False)
+            self.datasets.trim(self.budget - self.nbytes)
+
+    def open(self, session_id: str, path: str, selection=None):
+        """
+        Display `selection` of the measurement at `path` in a session, None for all of it, and return the figure
+        showing it completely.
+        """
+        dataset = self.datasets.get(path, selection or ())
+        state = self._session(session_id, path, selection)
+        state.x_range = None
+        state.traces = view(dataset)
+        self._trim()
+        return create_figure(dataset, state.traces)
+
+    def restore(self, session_id: str):
+        """
+        Path, selection and figure of the measurement a session displayed, e.g. before the page was reloaded, None if
+        unknown.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        try:
+            dataset = self.datasets.get(state.path, state.selection or ())
+        except OSError:
+            # the measurement was deleted or moved in the meantime
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return None
+        state = self._session(session_id, state.path, state.selection)
+        state.traces = view(dataset, state.x_range)
+        self._trim()
+        fig = create_figure(dataset, state.traces)
+        if state.x_range is not None:
+            fig.update_xaxes(range=state.x_range)
+        return state.path, state.selection, fig
+
+    def relayout(self, session_id: str, path: str, x_range, selection=None):
+        """
+        Show the time range `x_range` of the displayed `selection` of the measurement at `path` and return the patch
+        updating the figure.
+        """
+        dataset = self.datasets.get(path, selection or ())
+        state = self._session(session_id, path, selection)
+        state.x_range = x_range
+        state.traces = view(dataset, x_range)
+        self._trim()
+        return patch_figure(state.traces)
@@ -1,8 +1,16 @@
 from typing import List
 import os
+import sys
 
 module_path = os.path.abspath(__file__)
 module_dir = os.path.dirname(module_path)
+# modules shared with the data reader (e.g. storage) live in the repository root
+sys.path.append(os.path.abspath(os.path.join(module_dir, "..")))
+
+from catalog import Catalog  # noqa: E402
+
+# recordings below data/, described once and updated whenever they change
+catalog = Catalog(os.path.join(module_dir, "..", "data"))
 
 default_plot = {
     "layout": {
@@ -27,7 +35,39 @@ default_plot = {
 }
 
 
-def get_measurement_file_names() -> List[dict[str, str]]:
-    return [{"value": os.path.join(root, file), "label": file}
-            for root, _, files in os.walk(os.path.abspath(os.path.join(module_dir, "..", "data"))) 
-            for file in files if file.endswith(".csv")]
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def format_size(n_bytes: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n_bytes < 1024 or unit == "GB":
+            return f"{n_bytes:.0f} {unit}" if unit == "B" else f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+
+
+def describe_entry(entry: dict) -> str:
+    """Zusammenfassung eines Katalogeintrags, z.B. zur Anzeige unter der Auswahl."""
+    rate = "?" if entry["sampling_rate"] is None else f"{entry['sampling_rate']:g} Hz"
+    return (f"{len(entry['channels'])} Kanäle ({', '.join(entry['channels'])}) · {rate} · "
+            f"{entry['n_samples']} Samples · {format_duration(entry['duration'])} · {format_size(entry['size'])} · "
+            f"{'CSV' if entry['format'] == 'csv' else 'Binär'}"
+            + (f" · {entry['segments']} Segmente" if entry.get("segments") else ""))
+
+
+def measurement_options(entries: List[dict]) -> List[dict[str, str]]:
+    """Auswahloptionen der Katalogeinträge, die Beschriftung enthält Dauer und Kanalanzahl."""
+    return [{"value": catalog.absolute_path(entry),
+             "label": f"{entry['path']} ({format_duration(entry['duration'])}, {len(entry['channels'])} Kanäle)"}
+            for entry in entries]
+
+
+def get_measurement_file_names(search: str = "", formats: List[str] = None,
+                               min_duration: float = None) -> List[dict[str, str]]:
+    """Gefilterte Messungen des Katalogs, neue und geänderte Messungen werden vorher erfasst."""
+    catalog.refresh()
+    return measurement_options(catalog.search(search, formats, min_duration))
@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+import plotly.graph_objects as go
+from dash import Patch
+
+import utility  # noqa: F401, adds the repository root to the import path
+from pyramid import MAX, MIN, aggregate, bucket_size
+from summary import is_frequency_channel
+
+# points per trace sent to the browser, a bucket is drawn by its minimum and maximum
+MAX_POINTS = 2000
+HOVER_TEMPLATE = "Zeit: %{x}s <br>Y: %{y} </br>"
+
+
+def _envelope(times: np.ndarray, buckets: np.ndarray):
+    """Interleave minimum and maximum of every bucket, both placed at the time of the bucket."""
+    x = np.repeat(times, 2)
+    y = np.empty(2 * len(buckets))
+    y[0::2] = buckets[:, MIN]
+    y[1::2] = buckets[:, MAX]
+    return x, y
+
+
+def _pyramid_buckets(dataset, channel: str, level: int, start: int, stop: int):
+    """
+    Index of the first sample of the first bucket of `level` showing the samples `start` to `stop` and the buckets.
+
+    The pyramid aggregates the whole measurement, the dataset starts at its sample `dataset.offset`. Buckets at the
+    edges of the dataset which also hold samples outside of it are aggregated from the samples of the dataset instead.
+    """
+    size = bucket_size(level)
+    first_bucket = (start + dataset.offset) // size
+    buckets = dataset.pyramid.level(channel, level)[first_bucket:math.ceil((stop + dataset.offset) / size)]
+    first = first_bucket * size - dataset.offset
+    for i in {0, len(buckets) - 1} if len(buckets) else ():
+        bucket_start, bucket_stop = first + i * size, first + (i + 1) * size
+        if bucket_start < 0 or bucket_stop > dataset.n_samples:
+            buckets = np.array(buckets)
+            values = dataset.values(channel, max(bucket_start, 0), min(bucket_stop, dataset.n_samples))
+            buckets[i] = aggregate(values, size)[0]
+    return first, buckets
+
+
+def trace_data(dataset, channel: str, start: int, stop: int):
+    """
+    At most `MAX_POINTS` points of `channel` showing the samples `start` to `stop`.
+
+    Small windows are returned as they are. Otherwise the coarsest resolution still providing `MAX_POINTS / 2`
+    buckets is used: the raw samples of the window aggregated on the fly, as long as there are fewer than
+    `MAX_POINTS / 2` buckets of pyramid level 0 inside of it, else the matching pyramid level. Either way only data
+    inside the window is read, so the cost depends on the number of points and not on the length of the recording.
+    """
+    n_samples = stop - start
+    if n_samples <= MAX_POINTS:
+        return dataset.time(start, stop), dataset.values(channel, start, stop)
+    max_buckets = MAX_POINTS // 2
+    # small selections of a measurement without pyramid are aggregated on the fly, see `loader.load_pyramid`
+    level = None if dataset.pyramid is None else dataset.pyramid.select_level(n_samples, max_buckets)
+    if level is None:
+        size = math.ceil(n_samples / max_buckets)
+        buckets = aggregate(dataset.values(channel, start, stop), size)
+        first = start
+    else:
+        size = bucket_size(level)
+        first, buckets = _pyramid_buckets(dataset, channel, level, start, stop)
+    centers = np.clip(first + np.arange(len(buckets)) * size + size // 2, 0, dataset.n_samples - 1)
+    return _envelope(dataset.time_at(centers), buckets)
+
+
+def _window(dataset, x_range):
+    if x_range is None:
+        return 0, dataset.n_samples
+    start = max(dataset.sample_index(x_range[0]) - 1, 0)
+    stop = min(dataset.sample_index(x_range[1]) + 1, dataset.n_samples)
+    return start, max(stop, start)
+
+
+def view(dataset, x_range=None) -> list:
+    """Points `(x, y)` of every channel inside the time range `x_range`, None for the whole measurement."""
+    start, stop = _window(dataset, x_range)
+    return [trace_data(dataset, channel, start, stop) for channel in dataset.channels]
+
+
+def create_figure(dataset, traces: list) -> go.Figure:
+    """
+    Figure of every channel of `dataset` showing the points of `traces`, see `view`.
+
+    The dominant frequencies of a summary (see `summary.SummaryWriter`) are drawn against a second y axis in Hz.
+    """
+    fig = go.Figure()
+    for channel, (x, y) in zip(dataset.channels, traces):
+        fig.add_trace(go.Scattergl(name=channel, x=x, y=y, hovertemplate=HOVER_TEMPLATE,
+                                   yaxis="y2" if is_frequency_channel(channel) else "y"))
+    fig.update_layout(height=700)
+    if any(is_frequency_channel(channel) for channel in dataset.channels):
+        fig.update_layout(yaxis2=dict(title="Frequenz [Hz]", overlaying="y", side="right", showgrid=False),
+                          legend=dict(x=1.05))
+    return fig
+
+
+def viewport(relayout_data: dict):
+    """
+    Visible time range `[start, stop]` of a `relayoutData` event, None to show everything.
+
+    Raises a KeyError for events which do not change the time axis, e.g. a zoom of the y axis only.
+    """
+    if relayout_data.get("xaxis.autorange"):
+        return None
+    if "xaxis.range" in relayout_data:
+        return relayout_data["xaxis.range"]
+    return [relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]]
+
+
+def patch_figure(traces: list) -> Patch:
+    """Patch replacing the points of every trace of a figure, see `view`."""
+    patch = Patch()
+    for i, (x, y) in enumerate(traces):
+        patch["data"][i]["x"] = x
+        patch["data"][i]["y"] = y
+    return patch
@@ -1,19 +1,47 @@
 import argparse
-import csv
+import collections
+import datetime
+import functools
 import math
 import multiprocessing
 import os
+import re
+import signal
 import sys
+import threading
+import time
 
 import numpy as np
 import nidaqmx
 import matplotlib.pyplot as plt
 import nidaqmx.constants
+import nidaqmx.errors
+import nidaqmx.stream_readers
+import nidaqmx.task
 from colorama import just_fix_windows_console, Fore, Style
 
+import simulated_daq
+from encoder_pool import EncoderPool
+from merge import StreamMerger
+from metrics import EXPORTERS, create_metrics
+from ring_buffer import SharedRingBuffer
+from segments import SegmentedWriter, index_path
+from storage import EXTENSIONS, EventIndexWriter, open_writer, recording_metadata
+from summary import SummaryWriter, summary_path
+
 just_fix_windows_console()
 plt.ion()
 
+# seconds to wait for an every N samples event before checking the available samples again
+EVENT_WAIT_TIMEOUT = 0.5
+# fill level of the device buffer above which an imminent overrun is reported, the warning is rearmed below half of it
+BUFFER_FILL_WARNING = 0.8
+# seconds between two flushes of the writer, bounds the amount of data only held in file buffers
+FLUSH_INTERVAL = 1.0
+# device of channels given without a device name
+DEFAULT_DEVICE = "Dev1"
+CHANNEL_PATTERN = re.compile(r"^(?:(?P<device>[A-Za-z][\w-]*)/)?(?P<channel>ai\d+)$")
+
 
 class UniqueListAction(argparse.Action):
     """
@@ -62,6 +90,33 @@ class UniqueListAction(argparse.Action):
             setattr(namespace, self.dest, sorted(list(value_set)))
 
 
+def channel_argument(value: str) -> str:
+    """Validate a channel argument, channels of the default device are stored without device name, e.g. 'ai0'."""
+    match = CHANNEL_PATTERN.match(value)
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid channel '{value}' (e.g. 'ai0' or 'Dev2/ai0')")
+    if match["device"] in (None, DEFAULT_DEVICE):
+        return match["channel"]
+    return value
+
+
+def device_of(channel: str) -> str:
+    """Name of the device a channel argument belongs to, e.g. 'Dev2' for 'Dev2/ai0'."""
+    return channel.split("/")[0] if "/" in channel else DEFAULT_DEVICE
+
+
+def physical_channel(channel: str) -> str:
+    """Physical channel name of a channel argument, e.g. '/Dev1/ai0' for 'ai0'."""
+    return f"/{device_of(channel)}/{channel.split('/')[-1]}"
+
+
+def group_by_device(channels: list) -> dict:
+    """Channels per device, the default device first, followed by the other devices in alphabetical order."""
+    devices = sorted({device_of(channel) for channel in channels},
+                     key=lambda device: (device != DEFAULT_DEVICE, device))
+    return {device: [channel for channel in channels if device_of(channel) == device] for device in devices}
+
+
 parser = argparse.ArgumentParser(
     prog="DAQ-Board-Reader",
     description="This program reads and visualizes the data of specified input channels of a connected DAQ-Board",
@@ -72,10 +127,22 @@ parser.add_argument("-t", "--task_name", dest="task_name", action="store", type=
                     help="Name of the data reading task (Default: 'AcquisitionTask')",
                     required=False)
 parser.add_argument("-c", "--channel", dest="channels", action=UniqueListAction,
-                    choices=["ai0", "ai1", "ai2", "ai3", "ai4", "ai5", "ai6", "ai7"],
+                    type=channel_argument,
                     help="Channel from which data is to be read (e.g. 'ai0'), multiple channels can be added by "
-                         "providing the argument multiple times",
+                         "providing the argument multiple times. Channels of other devices than Dev1 are prefixed with "
+                         "the device name (e.g. 'Dev2/ai0'), every device is read by its own process and the samples "
+                         "of all devices are merged into one recording, see --sync.",
                     required=True)
+parser.add_argument("-sy", "--sync", dest="sync", action="store",
+                    type=str,
+                    default="sample_clock",
+                    choices=["sample_clock", "start_trigger"],
+                    help="Synchronization of several devices, Dev1 (or the first device) leads. 'sample_clock' "
+                         "shares its start trigger and sample clock with the other devices, 'start_trigger' only the "
+                         "start trigger, every device then runs on its own timebase, its drift is reported and "
+                         "corrected by dropping or inserting samples, so only 'sample_clock' gives exactly "
+                         "time-aligned samples. The signals are routed by the driver, e.g. via RTSI cable or PXI "
+                         "backplane. (Default: sample_clock)")
 parser.add_argument("-tc", "--trigger_channel", dest="trigger_channel", action="store",
                     type=str,
                     help="Analog or digitial channel used as reference trigger",
@@ -87,6 +154,11 @@ parser.add_argument("-ts", "--trigger_slope", dest="trigger_slope", type=str,
                     choices=["RISING", "FALLING"])
 parser.add_argument("-tl", "--trigger_level", dest="trigger_level", type=float,
                     help="Specifies at what threshold to trigger. Specify this value in the units of the measurement.")
+parser.add_argument("-rtr", "--retrigger", dest="retrigger", action="store_true",
+                    help="Keep the task armed after every triggered record instead of stopping after the first one. "
+                         "All records are appended to the same recording and listed in its event index "
+                         "(<filename>.events.npy, events.npy inside binary recordings) with trigger time, sample "
+                         "offset and length. Requires a trigger channel.")
 parser.add_argument("-sr", "--sampling_rate", dest="sampling_rate", action="store",
                     type=int,
                     help="Rate at which samples are read from provided channels (positive integer up to 1000000)",
@@ -99,15 +171,130 @@ parser.add_argument("-ns", "--number_of_samples", dest="number_of_samples", acti
 parser.add_argument("-f", "--filename", dest="filename", action="store",
                     type=str,
                     default="measurements.csv",
-                    help="Filename to which read data will be written (has to be a csv file) stored inside data/ "
-                         "folder. In case a trigger channel is provided each triggered data acquisition will store "
-                         "file with defined name and an increasing version as suffix. (Default: measurements.csv)")
+                    help="Filename to which read data will be written stored inside data/ folder. The extension is "
+                         "replaced according to the chosen format. In case a trigger channel is provided the "
+                         "triggered records are stored in this file, see --retrigger. (Default: measurements.csv)")
+parser.add_argument("-fmt", "--format", dest="format", action="store",
+                    type=str,
+                    default="csv",
+                    choices=["csv", "npy"],
+                    help="Storage format of the recording. 'csv' writes a single text file, 'npy' writes a binary "
+                         "recording (directory with extension .rec) containing a json header with channel names, "
+                         "sampling rate, start time and trigger settings and one .npy file per channel, which can "
+                         "be memory mapped by the dashboard. (Default: csv)")
+parser.add_argument("-raw", "--raw", dest="raw", action="store_true",
+                    help="Store the unscaled 16 bit ADC codes instead of voltages. The device scaling coefficients of "
+                         "every channel are stored with the recording and applied when it is loaded.")
+parser.add_argument("-rm", "--read_mode", dest="read_mode", action="store",
+                    type=str,
+                    default="event",
+                    choices=["event", "poll"],
+                    help="'event' sleeps until the driver signals that new samples were acquired, 'poll' continuously "
+                         "checks for available samples and occupies a full core (Default: event)")
+parser.add_argument("-lat", "--latency", dest="latency", action="store",
+                    type=float,
+                    default=0.05,
+                    help="Targeted time in seconds between acquisition and read of a sample. Reads "
+                         "are merged into larger blocks automatically if the per-read overhead gets too high. "
+                         "(Default: 0.05)")
+parser.add_argument("-b", "--backend", dest="backend", action="store",
+                    type=str,
+                    default="nidaqmx",
+                    choices=["nidaqmx", "simulated"],
+                    help="Device backend. 'simulated' generates synthetic signals instead of reading from a "
+                         "connected board, e.g. for tests and benchmarks without hardware. (Default: nidaqmx)")
+parser.add_argument("-str", "--simulated_trigger_rate", dest="simulated_trigger_rate", action="store",
+                    type=float,
+                    default=1.0,
+                    help="Reference triggers per second generated by the simulated backend (Default: 1.0)")
+parser.add_argument("-sdr", "--simulated_drift", dest="simulated_drift", action="store",
+                    type=float,
+                    default=0.0,
+                    help="Deviation of the sample clock of every further simulated device in ppm, multiplied by the "
+                         "index of the device. Only applies to devices which do not share the sample clock. "
+                         "(Default: 0.0)")
+parser.add_argument("-rs", "--ring_size", dest="ring_size", action="store",
+                    type=int,
+                    default=64,
+                    help="Size of the shared memory ring buffer between acquisition and file writer in MiB. If the "
+                         "writer falls behind for longer than the ring timeout, samples are dropped and reported. "
+                         "(Default: 64)")
+parser.add_argument("-rt", "--ring_timeout", dest="ring_timeout", action="store",
+                    type=float,
+                    default=1.0,
+                    help="Seconds the acquisition waits for a free ring buffer slot before samples are dropped "
+                         "(Default: 1.0)")
+parser.add_argument("-enc", "--encoders", dest="encoders", action="store",
+                    type=int,
+                    default=1,
+                    help="Number of processes encoding the blocks of csv recordings in parallel, the writer process "
+                         "writes the encoded blocks in acquisition order. With --compress as many processes compress "
+                         "closed segments. Binary recordings are not encoded. (Default: 1, encoding in the writer "
+                         "process)")
+parser.add_argument("-ss", "--segment_size", dest="segment_size", action="store",
+                    type=float,
+                    default=None,
+                    help="Start a new segment of the recording once the current one reaches this size in MiB. The "
+                         "segments are named <filename>_0000, <filename>_0001, ... and listed together with their time "
+                         "ranges in <filename>.index.json. (Default: no rotation)")
+parser.add_argument("-sd", "--segment_duration", dest="segment_duration", action="store",
+                    type=float,
+                    default=None,
+                    help="Start a new segment of the recording after this many seconds of samples, can be combined "
+                         "with --segment_size (Default: no rotation)")
+parser.add_argument("-z", "--compress", dest="compress", action="store_true",
+                    help="Compress closed csv segments with gzip in a background process, binary segments are not "
+                         "compressed")
+parser.add_argument("-sw", "--summary_window", dest="summary_window", action="store",
+                    type=float,
+                    default=None,
+                    help="Write the minimum, maximum, mean, RMS and dominant frequency of every channel per window "
+                         "of this many seconds to the binary recording <filename>.summary.rec while recording, so "
+                         "trends of long runs can be plotted without loading the raw data. (Default: disabled)")
+parser.add_argument("-m", "--metrics", dest="metrics", action="store",
+                    type=str,
+                    default=None,
+                    choices=list(EXPORTERS),
+                    help="Export periodic snapshots of pipeline metrics (read durations, samples per read, device "
+                         "buffer fill level, ring depth, writer encode/write/flush times and throughput). 'jsonl' "
+                         "appends one json object per snapshot, 'prometheus' writes a textfile for the node "
+                         "exporter. Disabled by default.")
+parser.add_argument("-mp", "--metrics_path", dest="metrics_path", action="store",
+                    type=str,
+                    default=os.path.join("data", "metrics"),
+                    help="Directory receiving one metrics file per pipeline stage (Default: data/metrics)")
+parser.add_argument("-mi", "--metrics_interval", dest="metrics_interval", action="store",
+                    type=float,
+                    default=1.0,
+                    help="Seconds between two metrics snapshots (Default: 1.0)")
+# set per device by `device_arguments` when several devices are read
+parser.set_defaults(device=None, device_index=0, leader=None, simulated_start=None)
+
+
+Backend = collections.namedtuple("Backend", ["Task", "AnalogMultiChannelReader", "AnalogUnscaledReader"])
+
+
+def get_backend(args):
+    """Task and stream reader classes of the device backend selected by the `backend` argument."""
+    if args.backend == "simulated":
+        task = functools.partial(simulated_daq.SimulatedTask, trigger_rate=args.simulated_trigger_rate,
+                                 shared_start=args.simulated_start,
+                                 clock_drift=args.simulated_drift * args.device_index)
+        return Backend(task, simulated_daq.AnalogMultiChannelReader, simulated_daq.AnalogUnscaledReader)
+    return Backend(nidaqmx.task.Task, nidaqmx.stream_readers.AnalogMultiChannelReader,
+                   nidaqmx.stream_readers.AnalogUnscaledReader)
+
+
+def output_path(args):
+    """Path of the recording inside the data/ folder, absolute file names are used as they are."""
+    return os.path.join("data", args.filename)
 
-args = parser.parse_args()
 
 # check if filename already exists
-def check_file_name():
-    if os.path.exists(os.path.join("data", args.filename)):
+def check_file_name(args):
+    extension = EXTENSIONS[args.format]
+    args.filename = os.path.splitext(args.filename)[0] + extension
+    if os.path.exists(output_path(args)) or os.path.exists(index_path(output_path(args))):
         print(Fore.YELLOW + f"File '{args.filename}' does already exist inside data/" + Style.RESET_ALL)
         valid_answer = False
         while not valid_answer:
@@ -120,30 +307,226 @@ def check_file_name():
         while not valid_answer:
             new_filename = input("New file name: ")
             if len(new_filename.split(".")) == 1:
-                args.filename = new_filename + ".csv"
+                args.filename = new_filename + extension
                 valid_answer = True
-            if len(new_filename.split(".")) == 2 and new_filename.endswith(".csv"):
+            if len(new_filename.split(".")) == 2 and new_filename.endswith(extension):
                 args.filename = new_filename
                 valid_answer = True
-        
 
-def main_data_loop(data_q):
+
+def create_writer(args, metadata):
+    """Writer of the recording, a `SegmentedWriter` if a segment size or duration is provided."""
+    if args.segment_size is None and args.segment_duration is None:
+        return open_writer(args.format, output_path(args), metadata)
+    return SegmentedWriter(args.format, output_path(args), metadata,
+                           max_bytes=None if args.segment_size is None else int(args.segment_size * 1024 * 1024),
+                           max_duration=args.segment_duration, compress=args.compress,
+                           compress_workers=args.encoders)
+
+
+def block_size(args):
+    """
+    Maximum number of samples per channel returned by a single read.
+
+    In trigger mode every read returns the pretrigger samples plus 2 post trigger samples. Without a trigger
+    the provided number of samples is used or, if all available samples are read, a tenth of a second worth of
+    samples.
+    """
+    if args.trigger_channel is not None:
+        return args.number_of_samples + 2
+    if args.number_of_samples is not None:
+        return args.number_of_samples
+    return max(1, args.sampling_rate // 10)
+
+
+def create_ring_buffer(args, dtype=np.float64):
+    """Create the shared memory ring buffer sized by the `ring_size` argument."""
+    samples_per_block = block_size(args)
+    block_bytes = len(args.channels) * samples_per_block * np.dtype(dtype).itemsize
+    n_blocks = max(2, args.ring_size * 1024 * 1024 // block_bytes)
+    return SharedRingBuffer(len(args.channels), samples_per_block, n_blocks, dtype=dtype)
+
+
+def create_task(args):
+    """
+    Create the analog input task described by the command line arguments.
+
+    Adds the input channels, configures the sample clock and, if a trigger channel is provided, the reference
+    trigger. A task following the device `args.leader` waits for its start trigger and, with `sync` set to
+    'sample_clock', acquires with its sample clock. The task is returned without being started.
+    """
+    in_task = get_backend(args).Task(new_task_name=args.task_name)
+    for channel in args.channels:
+        in_task.ai_channels.add_ai_voltage_chan(physical_channel(channel))
+    device = device_of(args.channels[0])
+    # continuous acquisitions buffer at least one second of samples on the device to bridge scheduling hiccups
+    in_task.timing.cfg_samp_clk_timing(
+        rate=args.sampling_rate,
+        source=f"/{args.leader}/ai/SampleClock" if args.leader is not None and args.sync == "sample_clock" else "",
+        sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS if args.trigger_channel is None else nidaqmx.constants.AcquisitionType.FINITE,
+        samps_per_chan=max(block_size(args), args.sampling_rate) if args.trigger_channel is None else block_size(args)
+    )
+    if args.leader is not None:
+        in_task.triggers.start_trigger.cfg_dig_edge_start_trig(f"/{args.leader}/ai/StartTrigger")
+
+    # setting reference signal (ANALOG TRIGGER) for analog input task
+    try:
+        if args.trigger_channel is not None:
+            if args.trigger_channel.startswith("ai"):
+                in_task.triggers.reference_trigger.cfg_anlg_edge_ref_trig(
+                    trigger_source=f"{device}/{args.trigger_channel}",
+                    trigger_level=args.trigger_level,
+                    trigger_slope=nidaqmx.constants.Slope.RISING if args.trigger_slope == "RISING" else nidaqmx.constants.Slope.FALLING,
+                    pretrigger_samples=args.number_of_samples
+                )
+            else:
+                in_task.triggers.reference_trigger.cfg_dig_edge_ref_trig(
+                trigger_source=f"{device}/{args.trigger_channel}",
+                trigger_edge=nidaqmx.constants.Edge.RISING if args.trigger_slope == "RISING" else nidaqmx.constants.Edge.FALLING,
+                pretrigger_samples=args.number_of_samples
+            )
+            if args.retrigger:
+                configure_retrigger(args, in_task)
+    except Exception as e:
+        print(e)
+        in_task.close()
+    return in_task
+
+
+def configure_retrigger(args, in_task):
+    """
+    Keep the reference trigger armed after every record, so the next record starts with the next trigger.
+
+    Restarting the task per record costs milliseconds of dead time, a retriggerable task rearms in hardware. The
+    device buffer holds a second worth of records, so the reader may fall behind by several events. Trigger
+    timestamps of the device are enabled if it has a timestamping engine, see `trigger_time_ns`.
+    """
+    reference_trigger = in_task.triggers.reference_trigger
+    reference_trigger.retriggerable = True
+    in_task.in_stream.input_buf_size = max(block_size(args), args.sampling_rate)
+    try:
+        reference_trigger.timestamp_enable = True
+    except nidaqmx.errors.DaqError:
+        print(Fore.YELLOW + "Device does not support trigger timestamps, the host clock is used" + Style.RESET_ALL)
+
+
+def hardware_timestamps(in_task) -> bool:
+    """True if the device timestamps the reference triggers of `in_task`."""
+    try:
+        return bool(in_task.triggers.reference_trigger.timestamp_enable)
+    except nidaqmx.errors.DaqError:
+        return False
+
+
+def trigger_time_ns(in_task, device_timestamps: bool, sampling_rate: int) -> int:
+    """
+    Time in ns since the epoch of the trigger of the record which was completed last.
+
+    The device reports the time of its most recent trigger, so it has to be queried before the next trigger occurs,
+    i.e. within the pretrigger phase of the next record. Without device timestamps, the trigger is estimated from the
+    host clock: a record is complete 2 post trigger samples after its trigger.
+    """
+    if device_timestamps:
+        return int(in_task.triggers.reference_trigger.timestamp_val.timestamp() * 1e9)
+    return time.time_ns() - int(2e9 / sampling_rate)
+
+
+def create_metadata(args, in_task=None):
+    """
+    Metadata of the recording described by the command line arguments, see `storage.recording_metadata`.
+
+    For raw acquisitions the device scaling coefficients of every channel are read from `in_task`, so the stored
+    ADC codes can be converted to volts when the recording is loaded. Recordings of several devices pass the task of
+    every device in the order of `group_by_device` and list the channels per device together with the
+    synchronization.
+    """
+    in_tasks = in_task if isinstance(in_task, list) else [in_task]
+    devices = group_by_device(args.channels)
+    trigger = None
+    if args.trigger_channel is not None:
+        trigger = {
+            "channel": args.trigger_channel,
+            "slope": args.trigger_slope,
+            "level": args.trigger_level,
+            "pretrigger_samples": args.number_of_samples,
+            "retriggerable": args.retrigger,
+        }
+        if args.retrigger:
+            trigger["timestamps"] = "device" if in_task is not None and hardware_timestamps(in_task) else "host"
+    if not args.raw:
+        metadata = recording_metadata(args.channels, args.sampling_rate, trigger=trigger)
+    else:
+        scaling = {channel_name: list(ai_channel.ai_dev_scaling_coeff) for channel_name, ai_channel in
+                   zip(args.channels, (ai_channel for task in in_tasks for ai_channel in task.ai_channels))}
+        metadata = recording_metadata(args.channels, args.sampling_rate, trigger=trigger, dtype=np.int16,
+                                      scaling=scaling)
+    if len(devices) > 1:
+        metadata["devices"] = devices
+        metadata["sync"] = args.sync
+    return metadata
+
+
+class AdaptiveBlockSize:
+    """
+    Number of samples per channel to wait for before reading, balancing latency against per-read overhead.
+
+    Starts at `latency` seconds worth of samples. Whenever a read takes longer than `overhead` times the duration
+    covered by its samples, the block size is doubled to amortize the fixed cost of a read over more samples. If
+    reads are cheap again, it is halved back towards the latency target.
+
+    Parameters
+    ----------
+    sampling_rate : int
+        Sampling rate in Hz.
+    latency : float
+        Targeted time in seconds between acquisition of a sample and its read.
+    maximum : int
+        Largest allowed block size, e.g. the ring buffer block size.
+    overhead : float, optional
+        Tolerated fraction of the block duration spent inside a read (Default: 0.1).
+    """
+
+    def __init__(self, sampling_rate: int, latency: float, maximum: int, overhead: float = 0.1):
+        self.sampling_rate = sampling_rate
+        self.maximum = maximum
+        self.minimum = min(maximum, max(1, int(sampling_rate * latency)))
+        self.overhead = overhead
+        self.size = self.minimum
+
+    def update(self, read_duration: float, number_of_samples: int):
+        budget = self.overhead * number_of_samples / self.sampling_rate
+        if read_duration > budget:
+            self.size = min(self.maximum, self.size * 2)
+        elif read_duration < budget / 4:
+            self.size = max(self.minimum, self.size // 2)
+
+
+def main_data_loop(args, in_task, ring, stop_event=None, start_barrier=None):
     """
     Main loop to collect and process data from a National Instruments (NI) data acquisition task.
 
-    This function sets up an analog input task, configures the acquisition timing and trigger settings,
-    and continuously reads data from the specified input channels. The acquired data is then pushed
-    to a queue for further processing. The loop runs indefinitely until interrupted (e.g., by KeyboardInterrupt).
+    This function starts the analog input task created by `create_task` and continuously reads data from the
+    specified input channels. The samples are read in place into the slots of a shared memory ring buffer, from
+    which the writer process consumes them. The loop runs indefinitely until interrupted (e.g., by
+    KeyboardInterrupt).
 
     Parameters
     ----------
-    data_q : Queue
-        A queue object used to store the data read from the NI data acquisition task.
+    args : argparse.Namespace
+        Parsed command line arguments describing the acquisition (see Notes).
+    in_task : nidaqmx.task.Task
+        Configured but not yet started analog input task.
+    ring : SharedRingBuffer
+        Ring buffer receiving the acquired blocks of samples.
+    stop_event : multiprocessing.Event, optional
+        Ends the loop once set, e.g. by a benchmark. Without an event the loop runs until interrupted.
+    start_barrier : multiprocessing.Barrier, optional
+        Shared by the acquisition processes of several devices. The leading device (`args.leader` is None) only
+        starts once every other device was started and waits for its start trigger, see `acquire_device`.
 
     Notes
     -----
-    The function uses `nidaqmx` to interface with NI DAQ hardware and assumes the configuration is passed
-    via a global `args` object, which should have the following attributes:
+    The function uses `nidaqmx` to interface with NI DAQ hardware and expects the following attributes on `args`:
         - task_name : str
             The name of the NI task.
         - channels : list
@@ -154,6 +537,31 @@ def main_data_loop(data_q):
             The rate at which to sample data, in Hz.
         - number_of_samples : int or None
             The number of samples to read per channel per acquisition.
+        - ring_timeout : float
+            Seconds to wait for a free ring buffer slot before the block is dropped.
+        - raw : bool
+            Read unscaled 16 bit ADC codes instead of voltages, the ring has to be of dtype int16.
+        - read_mode : str
+            'event' waits for every-N-samples events of the driver, 'poll' spins on the number of available samples.
+        - latency : float
+            Targeted read latency in seconds, determines the event interval in event mode.
+        - retrigger : bool
+            Keep reading records of a retriggerable reference trigger, see `configure_retrigger`.
+        - device : str or None
+            Name of the device if several devices are read, their metrics are exported per device.
+
+    All available samples are read at once, but not before the adaptive block size is reached (see
+    `AdaptiveBlockSize`). In event mode the process sleeps until then instead of occupying a full core, in poll mode
+    it keeps checking the number of available samples.
+
+    Continuous blocks are committed together with the host time at which their last sample was available, from
+    which `merge.StreamMerger` estimates the drift between devices. In retrigger mode every read returns exactly one
+    record, committed to the ring together with its trigger time, see `trigger_time_ns`. Records are only read once
+    they are complete, so the loop never blocks on a trigger which may not come.
+
+    If the writer does not release a slot within `ring_timeout`, the block is still read from the device, to
+    prevent a buffer overrun on the board, but discarded and reported as overflow. The sample index of every
+    committed block allows the writer to detect the resulting gap.
 
     Raises
     ------
@@ -162,10 +570,14 @@ def main_data_loop(data_q):
 
     Example
     -------
-    >>> q = Queue()
-    >>> main_data_loop(q)
+    >>> in_task = create_task(args)
+    >>> ring = create_ring_buffer(args)
+    >>> main_data_loop(args, in_task, ring)
     """
     print("Starting " + Fore.BLUE + f"{args.task_name}" + Style.RESET_ALL)
+    if args.device is not None:
+        print("Device: " + Fore.BLUE + args.device + Style.RESET_ALL +
+              ("" if args.leader is None else f" (following {args.leader}, shared {args.sync.replace('_', ' ')})"))
     print("Input channels: " + Fore.BLUE + str(args.channels) + Style.RESET_ALL)
     if args.trigger_channel is not None:
         print("Trigger channel: " + Fore.BLUE + f"{args.trigger_channel}" + Style.RESET_ALL)
@@ -175,42 +587,43 @@ def main_data_loop(data_q):
               f"{'READ ALL' if args.trigger_channel is None else args.sampling_rate}" + Style.RESET_ALL)
     if args.trigger_channel is not None:
         print("Number of samples per read: " + Fore.BLUE + str(args.number_of_samples) + " + 2 post trigger" + Style.RESET_ALL)
+        if args.retrigger:
+            print("Trigger mode: " + Fore.BLUE + "retriggerable" + Style.RESET_ALL)
     else:
         print("Number of samples per read: " + Fore.BLUE + str(args.number_of_samples) + Style.RESET_ALL)
+    if args.raw:
+        print("Sample format: " + Fore.BLUE + "raw int16" + Style.RESET_ALL)
+
+    block_sizer = AdaptiveBlockSize(args.sampling_rate, args.latency, ring.block_size)
+    samples_acquired = threading.Event()
+    if args.read_mode == "event":
+        # blocking reads let the driver sleep instead of spinning until the requested samples are available
+        in_task.in_stream.wait_mode = nidaqmx.constants.WaitMode.SLEEP
+        if args.trigger_channel is None:
+            def on_samples_acquired(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+                samples_acquired.set()
+                return 0
+
+            # the input buffer has to be a multiple of the event interval
+            interval = block_sizer.minimum
+            in_task.in_stream.input_buf_size = -(-in_task.in_stream.input_buf_size // interval) * interval
+            in_task.register_every_n_samples_acquired_into_buffer_event(interval, on_samples_acquired)
+    # waiting for more than half of the device buffer risks an overrun
+    block_sizer.maximum = max(block_sizer.minimum, min(block_sizer.maximum, in_task.in_stream.input_buf_size // 2))
 
-    # creating task
-    in_task = nidaqmx.task.Task(new_task_name=args.task_name)
-    for channel in args.channels:
-        in_task.ai_channels.add_ai_voltage_chan(f"/Dev1/{channel}")
-    in_task.timing.cfg_samp_clk_timing(
-        rate=args.sampling_rate,
-        sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS if args.trigger_channel is None else nidaqmx.constants.AcquisitionType.FINITE,
-        samps_per_chan=args.number_of_samples if args.trigger_channel is None else args.number_of_samples + 2
-    )
-
-    # setting reference signal (ANALOG TRIGGER) for analog input task
     try:
-        if args.trigger_channel is not None:
-            # set in_task.triggers.retriggerable = True, so that after collecting num_samples the task wont complain about
-            # already consuming num_samples.
-            # task.trigger.reference_trigger.retriggerable
-            if args.trigger_channel.startswith("ai"):
-                in_task.triggers.reference_trigger.cfg_anlg_edge_ref_trig(
-                    trigger_source=f"Dev1/{args.trigger_channel}",
-                    trigger_level=args.trigger_level,
-                    trigger_slope=nidaqmx.constants.Slope.RISING if args.trigger_slope == "RISING" else nidaqmx.constants.Slope.FALLING,
-                    pretrigger_samples=args.number_of_samples
-                )
-            else:
-                in_task.triggers.reference_trigger.cfg_dig_edge_ref_trig(
-                trigger_source=f"Dev1/{args.trigger_channel}",
-                trigger_edge=nidaqmx.constants.Edge.RISING if args.trigger_slope == "RISING" else nidaqmx.constants.Edge.FALLING,
-                pretrigger_samples=args.number_of_samples
-            )
+        # followers are started first, their acquisition begins with the start trigger of the leader
+        if start_barrier is not None and args.leader is None:
+            start_barrier.wait()
         in_task.start()
+        ring.mark_start()
+        if start_barrier is not None and args.leader is not None:
+            start_barrier.wait()
     except Exception as e:
         print(e)
-        in_task.close()  
+        if start_barrier is not None:
+            start_barrier.abort()
+        in_task.close()
 
     # in case of:
     # Warning 200010 occurred.
@@ -223,63 +636,341 @@ def main_data_loop(data_q):
     # https://shop.cnrood.com/782263-01#:~:text=Onboard%20NI%2DSTC3%20timing%20and,engines%20and%20retriggerable%20measurement%20tasks.
     # https://www.artisantg.com/info/National_Instruments_PCIe_6323_Manual_2018115104919.pdf?srsltid=AfmBOopJpR58UNMqyJm2SnMXKIjdY0ayatv3sF3niD6Wwl6XH6p9sK71
 
+    backend = get_backend(args)
+    if args.raw:
+        read_block = backend.AnalogUnscaledReader(in_task.in_stream).read_int16
+    else:
+        read_block = backend.AnalogMultiChannelReader(in_task.in_stream).read_many_sample
+    # target for blocks which do not fit into the ring anymore, they have to be read to keep the device buffer free
+    overflow_buffer = np.empty(len(args.channels) * ring.block_size, dtype=ring.dtype)
+    sample_index = 0
+    metrics = create_metrics("acquisition" if args.device is None else f"acquisition_{args.device}", args.metrics,
+                             args.metrics_path, args.metrics_interval)
+    buffer_size = in_task.in_stream.input_buf_size
+    buffer_fill_warned = False
+    device_timestamps = args.trigger_channel is not None and args.retrigger and hardware_timestamps(in_task)
+    # seconds to sleep while a record is incomplete in event mode, a fraction of the pretrigger phase of the next
+    # record, so the trigger time of a completed record is taken before the next trigger occurs
+    pretrigger_samples = max(1, args.number_of_samples or 0)
+    record_wait = min(EVENT_WAIT_TIMEOUT, pretrigger_samples / args.sampling_rate / 4)
+    ambiguous_timestamps = 0
     try:
-        while True:
+        while stop_event is None or not stop_event.is_set():
             # main data reading logic
-            if in_task.in_stream.avail_samp_per_chan == 0:
-                continue
-            if args.trigger_channel is None:
-                data = in_task.read(number_of_samples_per_channel=args.number_of_samples + 2)
+            timestamp_ns = 0
+            if args.trigger_channel is not None and args.retrigger:
+                # the task stays armed, a record is read as soon as it is complete
+                if in_task.in_stream.avail_samp_per_chan < ring.block_size:
+                    if args.read_mode == "event":
+                        time.sleep(record_wait)
+                    continue
+                timestamp_ns = trigger_time_ns(in_task, device_timestamps, args.sampling_rate)
+                # the next trigger only occurs after the pretrigger samples of the next record were acquired, with
+                # fewer samples beyond the complete record the timestamp still belongs to it
+                if in_task.in_stream.avail_samp_per_chan - ring.block_size >= pretrigger_samples:
+                    ambiguous_timestamps += 1
+                    if ambiguous_timestamps == 1:
+                        print(Fore.YELLOW + "The reader fell behind the triggers, the trigger time of a record may "
+                                            "belong to a later one" + Style.RESET_ALL)
+                number_of_samples = ring.block_size
+                timeout = 10.0
+            elif args.trigger_channel is not None:
+                # blocking read of the whole finite record
+                if args.read_mode == "poll" and in_task.in_stream.avail_samp_per_chan == 0:
+                    continue
+                number_of_samples = ring.block_size
+                timeout = nidaqmx.constants.WAIT_INFINITELY
             else:
-                data = in_task.read(number_of_samples_per_channel=args.number_of_samples,
-                                    timeout=nidaqmx.constants.WAIT_INFINITELY)
-            data_q.put(data)
+                if args.read_mode == "event":
+                    samples_acquired.clear()
+                available = in_task.in_stream.avail_samp_per_chan
+                timestamp_ns = time.time_ns()
+                if args.read_mode == "poll" and available == 0:
+                    continue
+                # reading every sample as soon as it is available floods the ring and the writer with tiny blocks,
+                # so polling keeps spinning until the block size is reached as well
+                if args.number_of_samples is None and available < block_sizer.size:
+                    if args.read_mode == "event":
+                        samples_acquired.wait(timeout=EVENT_WAIT_TIMEOUT)
+                    continue
+                # a fixed number of samples is waited for by the driver (sleeping in event mode)
+                number_of_samples = min(available, ring.block_size) if args.number_of_samples is None \
+                    else args.number_of_samples
+                timeout = 10.0
+                # samples waiting in the device buffer, an overrun follows once it is full
+                buffer_fill = available / buffer_size
+                if metrics is not None:
+                    metrics.observe("device_buffer_fill", buffer_fill)
+                if buffer_fill > BUFFER_FILL_WARNING and not buffer_fill_warned:
+                    print(Fore.YELLOW + f"Device buffer {100 * buffer_fill:.0f} % full, the acquisition is close "
+                                        f"to an overrun" + Style.RESET_ALL)
+                buffer_fill_warned = buffer_fill > BUFFER_FILL_WARNING / 2 if buffer_fill_warned \
+                    else buffer_fill > BUFFER_FILL_WARNING
+            block = ring.reserve(number_of_samples, timeout=args.ring_timeout)
+            dropped = block is None
+            if dropped:
+                block = overflow_buffer[:len(args.channels) * number_of_samples].reshape(len(args.channels), -1)
+            read_start = time.perf_counter()
+            read_block(block, number_of_samples_per_channel=number_of_samples, timeout=timeout)
+            read_duration = time.perf_counter() - read_start
+            if args.trigger_channel is None and args.number_of_samples is not None:
+                # the read waited for the requested samples
+                timestamp_ns = time.time_ns()
+            block_sizer.update(read_duration, number_of_samples)
+            if dropped:
+                ring.drop(number_of_samples)
+                print(Fore.YELLOW + f"Ring buffer full, dropped {number_of_samples} samples per channel "
+                                    f"(overflows: {ring.overflows}, dropped: {ring.dropped_samples})" + Style.RESET_ALL)
+            else:
+                ring.commit(sample_index, timestamp_ns)
+            sample_index += number_of_samples
+            if metrics is not None:
+                metrics.observe("read_seconds", read_duration)
+                metrics.observe("samples_per_read", number_of_samples)
+                metrics.count("samples", number_of_samples)
+                metrics.gauge("ring_depth", ring.depth)
+                metrics.gauge("ring_fill", ring.depth / ring.n_blocks)
+                metrics.gauge("block_size", block_sizer.size)
+                metrics.gauge("ring_overflows_total", ring.overflows)
+                metrics.gauge("dropped_samples_total", ring.dropped_samples)
+                if args.trigger_channel is not None and args.retrigger:
+                    metrics.gauge("ambiguous_timestamps_total", ambiguous_timestamps)
+                metrics.maybe_emit()
     except KeyboardInterrupt:
+        pass
+    finally:
         in_task.close()
+        ring.close_writer()
+        if metrics is not None:
+            metrics.close()
 
 
-def write_to_file(cli_arguments, data_q):
-    print("Saving samples in " + Fore.RED + f"data/{cli_arguments.filename}" + Style.RESET_ALL)
+def write_to_file(cli_arguments, metadata, ring):
+    """
+    Consume the blocks of the ring buffer and write them to the recording, the counterpart of `main_data_loop`.
+
+    With more than one encoder (`encoders` argument) the blocks are encoded by an `EncoderPool` in parallel and
+    written here in the order they were acquired. Binary recordings store the blocks as they are, so they are always
+    written directly.
+    """
+    print("Saving samples in " + Fore.RED + output_path(cli_arguments) + Style.RESET_ALL)
+    writer = create_writer(cli_arguments, metadata)
+    # every record of a retriggered acquisition is listed in the event index of the recording
+    events = EventIndexWriter(output_path(cli_arguments)) \
+        if metadata["trigger"] is not None and metadata["trigger"].get("retriggerable") else None
+    summary = None if cli_arguments.summary_window is None \
+        else SummaryWriter(summary_path(output_path(cli_arguments)), metadata, cli_arguments.summary_window)
+    metrics = create_metrics("writer", cli_arguments.metrics, cli_arguments.metrics_path,
+                             cli_arguments.metrics_interval)
+    pool = None
+    if cli_arguments.encoders > 1 and writer.encoder is not None:
+        pool = EncoderPool(writer.encoder, ring, cli_arguments.encoders)
+    last_flush = time.monotonic()
+    total_samples = 0
+
+    def commit(block, payload, encode_seconds):
+        nonlocal last_flush, total_samples
+        if writer.metadata["start_time"] is None and ring.start_time_ns is not None:
+            start_time = datetime.datetime.fromtimestamp(ring.start_time_ns / 1e9).isoformat()
+            writer.update_metadata(start_time=start_time)
+            if summary is not None:
+                summary.update_metadata(start_time=start_time)
+        # blocks dropped by the acquisition show up as a jump of the sample index
+        if block.first_sample != total_samples:
+            print(Fore.YELLOW + f"Missing {block.first_sample - total_samples} samples per channel "
+                                f"due to ring buffer overflow" + Style.RESET_ALL)
+        write_start = time.perf_counter()
+        n_bytes = writer.write(payload)
+        write_end = time.perf_counter()
+        total_samples = block.first_sample + block.data.shape[1]
+        # the statistics are computed on the ring slot itself, before it is handed back
+        if summary is not None:
+            summary.add(block.data, block.first_sample)
+        summary_end = time.perf_counter()
+        if events is not None:
+            events.append(block.timestamp_ns, block.first_sample, block.data.shape[1])
+        ring.release()
+        if summary_end - last_flush >= FLUSH_INTERVAL:
+            writer.flush()
+            if events is not None:
+                events.flush()
+            if summary is not None:
+                summary.flush()
+            flush_duration = time.perf_counter() - summary_end
+            last_flush = summary_end
+            if metrics is not None:
+                metrics.observe("flush_seconds", flush_duration)
+        if metrics is not None:
+            metrics.observe("encode_seconds", encode_seconds)
+            metrics.observe("write_seconds", write_end - write_start)
+            if summary is not None:
+                metrics.observe("summary_seconds", summary_end - write_end)
+            metrics.count("bytes_written", n_bytes)
+            metrics.count("samples", block.data.shape[1])
+            if events is not None:
+                metrics.count("events", 1)
+            metrics.gauge("ring_depth", ring.depth)
+            if pool is not None:
+                metrics.gauge("encoder_blocks_in_flight", pool.in_flight)
+            metrics.maybe_emit()
+        # the writer counts its bytes itself, a stat of the output file per block costs a system call
+        print(
+            Fore.GREEN + "#samples per channel: " + Style.RESET_ALL + f"{total_samples:<15}" + Fore.GREEN +
+            5 * " " + "file_size: " + Style.RESET_ALL +
+            f"{writer.bytes_written / (1024 * 1024):.2f} Mb" + Style.RESET_ALL +
+            ("" if events is None else Fore.GREEN + 5 * " " + "#events: " + Style.RESET_ALL + str(events.n_events)))
+
     try:
-        with open(f"data/{cli_arguments.filename}", "w+", newline="") as f:
-            csv_writer = csv.writer(f)
-            header = ["time"]
-            header.extend(cli_arguments.channels)
-            # csv header
-            csv_writer.writerow(header)
-            timestamp = 0
-            total_samples = 0
-            while True:
-                samples = data_q.get()
-                # pair measured values for each channel into one element => e.g. 3 samples for 2 channels
-                # [[1,2,3],[4,5,6]] => [(1,4),(2,5),(3,6)]
-                if len(cli_arguments.channels) > 1:
-                    samples = list(zip(*samples))
-                total_samples += len(samples)
-                for item in samples:
-                    # in case measurements of multiple channels were paired
-                    if type(item) is tuple:
-                        csv_writer.writerow([timestamp, *item])
-                    else:
-                        csv_writer.writerow([timestamp, item])
-                    timestamp += 1 / cli_arguments.sampling_rate
-                print(
-                    Fore.GREEN + "#samples per channel: " + Style.RESET_ALL + f"{total_samples:<15}" + Fore.GREEN +
-                    5 * " " + "file_size: " + Style.RESET_ALL +
-                    f"{os.stat(f'data/{args.filename}').st_size / (1024 * 1024):.2f} Mb" + Style.RESET_ALL)
+        while True:
+            if pool is None:
+                block = ring.get(timeout=0.5)
+                if block is None:
+                    if ring.closed:
+                        break
+                    continue
+                # timestamps are derived from the sample index of the block, so gaps keep the time axis intact
+                encode_start = time.perf_counter()
+                payload = writer.encode(block.data, block.first_sample)
+                commit(block, payload, time.perf_counter() - encode_start)
+                continue
+            # every worker gets a block, the ring slots stay reserved until their block is committed
+            while pool.in_flight < pool.capacity:
+                block = ring.get(timeout=0.5 if not pool.in_flight else 0)
+                if block is None:
+                    break
+                pool.submit(block, ring.received - 1)
+            if not pool.in_flight:
+                if ring.closed:
+                    break
+                continue
+            for block, payload, encode_seconds in pool.completed(timeout=0.5):
+                commit(block, payload, encode_seconds)
     except KeyboardInterrupt:
         print("")
+    finally:
+        if pool is not None:
+            pool.close()
+        writer.close()
+        if events is not None:
+            events.close()
+        if summary is not None:
+            summary.close()
+        ring.close()
+        if metrics is not None:
+            metrics.close()
+
+
+def device_arguments(args, device: str, index: int, leader: str, simulated_start=None):
+    """Arguments of the acquisition of `device`, the `index`-th device of the recording following `leader`."""
+    return argparse.Namespace(**{
+        **vars(args),
+        "channels": group_by_device(args.channels)[device],
+        "task_name": f"{args.task_name}_{device}",
+        "device": device,
+        "device_index": index,
+        "leader": None if device == leader else leader,
+        "simulated_start": simulated_start,
+    })
+
+
+def acquire_device(args, ring, start_barrier):
+    """Acquisition process of one of several devices, see `record_devices`."""
+    main_data_loop(args, create_task(args), ring, start_barrier=start_barrier)
+
+
+def merge_devices(cli_arguments, rings, ring):
+    """Merger process of several devices, see `merge.StreamMerger`."""
+    # a Ctrl+C stops the acquisitions, the merger still merges the samples left in the rings of the devices
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    metrics = create_metrics("merge", cli_arguments.metrics, cli_arguments.metrics_path,
+                             cli_arguments.metrics_interval)
+    try:
+        # devices sharing only the start trigger drift apart, the merger follows the clock of the leader
+        StreamMerger(rings, ring, cli_arguments.ring_timeout,
+                     resync=cli_arguments.sync == "start_trigger").run(metrics)
+    finally:
+        ring.close()
+        if metrics is not None:
+            metrics.close()
 
 
-if __name__ == "__main__":
-    check_file_name()
-    data_q = multiprocessing.Queue()
+def record_devices(args):
+    """
+    Record the channels of several devices into one recording.
+
+    Every device is read by its own acquisition process into its own ring buffer, so the devices are read in
+    parallel on separate cores. The first device of `group_by_device` leads, the others share its start trigger and,
+    depending on the `sync` argument, its sample clock. A merger process aligns the blocks of all devices by their
+    sample index and passes the merged blocks on to the writer process through a further ring buffer.
+    """
+    devices = group_by_device(args.channels)
+    leader = next(iter(devices))
+    simulated_start = multiprocessing.Value("d", 0.0) if args.backend == "simulated" else None
+    per_device = {device: device_arguments(args, device, index, leader, simulated_start)
+                  for index, device in enumerate(devices)}
+    dtype = np.int16 if args.raw else np.float64
+    rings = {device: create_ring_buffer(device_args, dtype=dtype) for device, device_args in per_device.items()}
+    ring = create_ring_buffer(args, dtype=dtype)
+    in_tasks = []
+    if args.raw:
+        # the scaling coefficients are read from tasks of this process, the acquisitions create their own
+        in_tasks = [create_task(device_args) for device_args in per_device.values()]
+    metadata = create_metadata(args, in_tasks)
+    for in_task in in_tasks:
+        in_task.close()
+
+    start_barrier = multiprocessing.Barrier(len(devices))
+    processes = [multiprocessing.Process(target=write_to_file, args=(args, metadata, ring)),
+                 multiprocessing.Process(target=merge_devices, args=(args, rings, ring))]
+    processes += [multiprocessing.Process(target=acquire_device, args=(device_args, rings[device], start_barrier))
+                  for device, device_args in per_device.items()]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # every process received the interrupt as well and shuts down on its own
+        for process in processes:
+            process.join()
+    finally:
+        for device, device_ring in rings.items():
+            if device_ring.overflows:
+                print(Fore.YELLOW + f"Ring buffer of {device} overflowed {device_ring.overflows} times, "
+                                    f"{device_ring.dropped_samples} samples per channel were dropped" + Style.RESET_ALL)
+            device_ring.unlink()
+        if ring.overflows:
+            print(Fore.YELLOW + f"Merged ring buffer overflowed {ring.overflows} times, "
+                                f"{ring.dropped_samples} samples per channel were dropped" + Style.RESET_ALL)
+        ring.unlink()
 
-    write_process = multiprocessing.Process(target=write_to_file,
-                                            args=(args, data_q,))
-    write_process.start()
 
-    main_data_loop(data_q)
-        
-    write_process.join()
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.retrigger and args.trigger_channel is None:
+        parser.error("--retrigger requires a trigger channel")
+    devices = group_by_device(args.channels)
+    if len(devices) > 1 and args.trigger_channel is not None:
+        parser.error("a trigger channel is not supported for channels of several devices")
+    check_file_name(args)
+    if len(devices) > 1:
+        # the merged recording holds the channels device by device
+        args.channels = [channel for channels in devices.values() for channel in channels]
+        record_devices(args)
+    else:
+        in_task = create_task(args)
+        ring = create_ring_buffer(args, dtype=np.int16 if args.raw else np.float64)
+
+        write_process = multiprocessing.Process(target=write_to_file,
+                                                args=(args, create_metadata(args, in_task), ring,))
+        write_process.start()
+
+        try:
+            main_data_loop(args, in_task, ring)
+        finally:
+            write_process.join()
+            if ring.overflows:
+                print(Fore.YELLOW + f"Ring buffer overflowed {ring.overflows} times, "
+                                    f"{ring.dropped_samples} samples per channel were dropped" + Style.RESET_ALL)
+            ring.unlink()
     print(Fore.BLUE + "Finished process" + Style.RESET_ALL)
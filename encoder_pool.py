@@ -0,0 +1,112 @@
+import collections
+import multiprocessing
+import queue
+import signal
+import time
+
+
+def _encode_worker(encoder, ring, tasks, results):
+    # a Ctrl+C stops the acquisition, the worker still encodes the remaining blocks until the pool is closed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # results nobody waits for anymore must not keep the worker from exiting
+    results.cancel_join_thread()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, n_samples, first_sample = task
+        start = time.perf_counter()
+        try:
+            payload = encoder(ring.view(seq, n_samples), first_sample)
+        except Exception as e:
+            results.put((seq, e, 0.0))
+            continue
+        results.put((seq, payload, time.perf_counter() - start))
+
+
+class EncoderPool:
+    """
+    Worker processes encoding the blocks of a ring buffer in parallel, handed back in the order they were received.
+
+    The workers read the samples directly from the shared memory of the ring, only the encoded payloads are sent
+    back to the writer, which acts as the single ordered committer: it writes the payloads in sequence and releases
+    every ring slot once its block is written. A slot therefore stays reserved while its block is encoded, at most
+    `capacity` blocks are in flight at a time.
+
+    Parameters
+    ----------
+    encoder : callable
+        Picklable `encoder(data, first_sample)` returning the payload of a block, e.g. `storage.CsvEncoder`.
+    ring : SharedRingBuffer
+        Ring buffer the blocks are received from.
+    n_workers : int
+        Number of encoder processes.
+
+    Example
+    -------
+    >>> pool = EncoderPool(writer.encoder, ring, n_workers=4)
+    >>> block = ring.get()
+    >>> pool.submit(block, ring.received - 1)
+    >>> for block, payload, encode_seconds in pool.completed(timeout=0.5):
+    ...     writer.write(payload)
+    ...     ring.release()
+    >>> pool.close()
+    """
+
+    def __init__(self, encoder, ring, n_workers: int):
+        self.n_workers = n_workers
+        # every worker has a block to encode while the committer writes the previous ones
+        self.capacity = 2 * n_workers
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._workers = [
+            multiprocessing.Process(target=_encode_worker, args=(encoder, ring, self._tasks, self._results))
+            for _ in range(n_workers)]
+        for worker in self._workers:
+            worker.start()
+        self._in_flight = collections.deque()
+        self._done = {}
+
+    @property
+    def in_flight(self) -> int:
+        """Number of submitted blocks which were not yet returned by `completed`."""
+        return len(self._in_flight)
+
+    def submit(self, block, seq: int):
+        """Encode a block received from the ring, `seq` being its number, see `SharedRingBuffer.received`."""
+        self._in_flight.append((seq, block))
+        self._tasks.put((seq, block.data.shape[1], block.first_sample))
+
+    def completed(self, timeout: float) -> list:
+        """
+        Blocks whose payload is ready, together with the payload and the seconds spent encoding it.
+
+        Blocks are returned in the order they were submitted, so a block encoded early waits for its predecessors.
+        Waits at most `timeout` seconds for the next block in order if none is ready.
+        """
+        ready = []
+        while self._in_flight:
+            seq, block = self._in_flight[0]
+            if seq in self._done:
+                payload, encode_seconds = self._done.pop(seq)
+                if isinstance(payload, Exception):
+                    raise payload
+                self._in_flight.popleft()
+                ready.append((block, payload, encode_seconds))
+                continue
+            try:
+                result_seq, payload, encode_seconds = self._results.get_nowait() if ready \
+                    else self._results.get(timeout=timeout)
+            except queue.Empty:
+                if not ready and not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("an encoder process died")
+                break
+            self._done[result_seq] = payload, encode_seconds
+        return ready
+
+    def close(self):
+        """Stop the workers once every submitted block is encoded, results not returned by `completed` are dropped."""
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
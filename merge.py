@@ -0,0 +1,305 @@
+import collections
+
+import numpy as np
+from colorama import Fore, Style
+
+# seconds of samples a device has to span before the drift of its sample clock is estimated
+MIN_DRIFT_SPAN = 30.0
+# deviation of a sample clock from the one of the leading device in ppm above which a warning is printed
+DRIFT_WARNING_PPM = 100.0
+
+
+class ClockFit:
+    """
+    Least squares fit of the host time at which samples were read over their sample index.
+
+    The slope is the duration of a sample as measured by the host clock. Single timestamps jitter by the scheduling
+    latency of the reader, the fit over the whole acquisition averages this out, so a constant deviation of the
+    sample clock from the host clock becomes visible after some seconds. Sums are accumulated relative to the first
+    point to keep the precision of the float64 arithmetic.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._origin = None
+        self._sum_s = self._sum_t = self._sum_ss = self._sum_st = 0.0
+        self.span = 0
+
+    def add(self, sample: int, time_ns: int):
+        if self._origin is None:
+            self._origin = sample, time_ns
+        s = float(sample - self._origin[0])
+        t = (time_ns - self._origin[1]) / 1e9
+        self.n += 1
+        self._sum_s += s
+        self._sum_t += t
+        self._sum_ss += s * s
+        self._sum_st += s * t
+        self.span = sample - self._origin[0]
+
+    @property
+    def seconds_per_sample(self):
+        """Slope of the fit, None while fewer than three points with distinct sample indices were added."""
+        if self.n < 3:
+            return None
+        variance = self._sum_ss - self._sum_s * self._sum_s / self.n
+        if variance <= 0:
+            return None
+        return (self._sum_st - self._sum_s * self._sum_t / self.n) / variance
+
+
+class DeviceStream:
+    """Blocks received from the ring of one device which are not yet completely merged."""
+
+    def __init__(self, device: str, ring, rows: slice):
+        self.device = device
+        self.ring = ring
+        self.rows = rows
+        self.blocks = collections.deque()
+        # samples of the oldest block which were already merged
+        self.offset = 0
+        # index of the sample following the last received block
+        self.end = 0
+        self.gaps = 0
+        self.missing_samples = 0
+        self.finished = False
+        self.clock = ClockFit()
+        # device samples dropped (positive) or fill samples inserted (negative) to follow the clock of the leader
+        self.shift = 0
+
+    def receive(self, timeout: float) -> bool:
+        """Receive the next block of the device, False if none arrived within `timeout` seconds."""
+        block = self.ring.get(timeout=timeout)
+        if block is None:
+            self.finished = self.ring.closed
+            return False
+        # every device counts its samples from the shared start trigger, a jump is a block dropped by its reader
+        if block.first_sample != self.end:
+            self.gaps += 1
+            self.missing_samples += block.first_sample - self.end
+            print(Fore.YELLOW + f"{self.device}: missing {block.first_sample - self.end} samples per channel due to "
+                                f"ring buffer overflow" + Style.RESET_ALL)
+        self.blocks.append(block)
+        self.end = block.first_sample + block.data.shape[1]
+        if block.timestamp_ns:
+            self.clock.add(self.end, block.timestamp_ns)
+        return True
+
+    @property
+    def merged_end(self) -> int:
+        """Merged position following the last received sample, see `shift`."""
+        return self.end - self.shift
+
+    def _skip(self, n_samples: int):
+        while n_samples and self.blocks:
+            n = min(n_samples, self.blocks[0].data.shape[1] - self.offset)
+            self.offset += n
+            n_samples -= n
+            if self.offset == self.blocks[0].data.shape[1]:
+                self.blocks.popleft()
+                self.offset = 0
+                self.ring.release()
+
+    def copy_into(self, out: np.ndarray, position: int, fill):
+        """
+        Copy the device samples `position` to `position + out.shape[1]` into `out`, samples the device did not deliver
+        are set to `fill`. Samples before `position` which were not yet copied are skipped. Blocks are released as
+        soon as all of their samples are copied or skipped.
+        """
+        n_samples = out.shape[1]
+        copied = 0
+        if self.blocks and self.blocks[0].first_sample + self.offset < position:
+            self._skip(position - self.blocks[0].first_sample - self.offset)
+        while copied < n_samples:
+            if not self.blocks:
+                out[:, copied:] = fill
+                return
+            block = self.blocks[0]
+            start = block.first_sample + self.offset
+            if start > position + copied:
+                n = min(n_samples - copied, start - position - copied)
+                out[:, copied:copied + n] = fill
+                copied += n
+                continue
+            n = min(n_samples - copied, block.data.shape[1] - self.offset)
+            out[:, copied:copied + n] = block.data[:, self.offset:self.offset + n]
+            copied += n
+            self.offset += n
+            if self.offset == block.data.shape[1]:
+                self.blocks.popleft()
+                self.offset = 0
+                self.ring.release()
+
+
+class StreamMerger:
+    """
+    Merges the sample streams of several devices into a single time-aligned stream.
+
+    Every device is read by its own acquisition process into its own ring buffer. The devices share a start trigger,
+    so sample `i` of every device was acquired at the same time and the streams are aligned by the sample index of
+    their blocks, no matter how the readers cut them. Merged blocks contain the channels of all devices in the order
+    of `rings` and are committed to `ring`, from which the writer consumes them like the blocks of a single device.
+    A sample range is only merged once every device delivered it, samples a device dropped are filled with NaN (0
+    for raw recordings), as are the samples after a device stopped.
+
+    Per device the sequence of sample indices is checked for gaps and the sample clock is compared against the one of
+    the first device, see `drift_ppm`. Devices sharing a sample clock cannot drift, devices sharing only the start
+    trigger run on their own timebases and drift apart by their clock deviation. Aligned by sample index alone, a
+    faster device would deliver more and more samples ahead of the others until its ring overflows. With `resync`
+    the merger therefore follows the clock of the leader: once the drift of a device is estimated, samples of a
+    faster device are dropped and fill samples are inserted into the stream of a slower one, so every merged sample
+    stays within about one sample of the time of the leader and the lead of every device stays bounded. Only a
+    shared sample clock gives a recording whose samples were acquired at exactly the same time.
+
+    Parameters
+    ----------
+    rings : dict
+        Ring buffer of every device by device name, the first device is the leader providing the start trigger.
+    ring : SharedRingBuffer
+        Ring buffer receiving the merged blocks, with as many channels as all devices together.
+    ring_timeout : float, optional
+        Seconds to wait for a free slot of `ring` before a merged block is dropped (Default: 1.0).
+    resync : bool, optional
+        Drop or insert samples of devices whose sample clock drifts from the one of the leader, for devices sharing
+        only the start trigger (Default: False).
+
+    Example
+    -------
+    >>> merger = StreamMerger({"Dev1": ring_dev1, "Dev2": ring_dev2}, ring)
+    >>> merger.run()
+    """
+
+    def __init__(self, rings: dict, ring, ring_timeout: float = 1.0, resync: bool = False):
+        self.ring = ring
+        self.ring_timeout = ring_timeout
+        self.resync = resync
+        self.streams = []
+        first_row = 0
+        for device, device_ring in rings.items():
+            self.streams.append(DeviceStream(device, device_ring, slice(first_row, first_row + device_ring.n_channels)))
+            first_row += device_ring.n_channels
+        if first_row != ring.n_channels:
+            raise ValueError(f"merged ring has {ring.n_channels} channels, the devices deliver {first_row}")
+        self.fill = 0 if ring.dtype.kind == "i" else np.nan
+        self.position = 0
+        self._scratch = np.empty((ring.n_channels, ring.block_size), dtype=ring.dtype)
+        self._dropping = False
+        self._drift_warned = {stream.device: False for stream in self.streams}
+
+    def drift_ppm(self) -> dict:
+        """
+        Deviation of the sample clock of every device from the one of the leader in ppm, estimated from the host
+        time at which the blocks were read. None for devices which did not yet span `MIN_DRIFT_SPAN` seconds.
+        """
+        leader = self.streams[0].clock.seconds_per_sample
+        drift = {}
+        for stream in self.streams:
+            seconds_per_sample = stream.clock.seconds_per_sample
+            if leader is None or seconds_per_sample is None or \
+                    stream.clock.span * seconds_per_sample < MIN_DRIFT_SPAN:
+                drift[stream.device] = None
+                continue
+            drift[stream.device] = (leader / seconds_per_sample - 1) * 1e6
+        return drift
+
+    def _merge(self, end: int):
+        while self.position < end:
+            n_samples = min(end - self.position, self.ring.block_size)
+            # once the writer fell behind, blocks are dropped without waiting until it frees a slot again, so the
+            # device rings are not held up by a writer which stopped
+            block = self.ring.reserve(n_samples, timeout=0 if self._dropping else self.ring_timeout)
+            self._dropping = block is None
+            if block is None:
+                block = self._scratch[:, :n_samples]
+            for stream in self.streams:
+                stream.copy_into(block[stream.rows], self.position + stream.shift, self.fill)
+            if self._dropping:
+                self.ring.drop(n_samples)
+                print(Fore.YELLOW + f"Ring buffer full, dropped {n_samples} merged samples per channel "
+                                    f"(overflows: {self.ring.overflows})" + Style.RESET_ALL)
+            else:
+                self.ring.commit(self.position)
+            self.position += n_samples
+
+    def step(self, timeout: float) -> bool:
+        """
+        Receive the blocks available from every device and merge the samples all devices delivered.
+
+        Waits at most `timeout` seconds for the slowest device if nothing could be merged. Returns False once every
+        device stopped and all of its samples were merged.
+        """
+        for stream in self.streams:
+            while not stream.finished and stream.receive(timeout=0):
+                pass
+        if self.ring.start_time_ns is None and self.streams[0].ring.start_time_ns is not None:
+            # sample 0 of every device was acquired at the start of the leader
+            self.ring.mark_start(self.streams[0].ring.start_time_ns)
+        running = [stream for stream in self.streams if not stream.finished]
+        end = min(stream.merged_end for stream in running) if running \
+            else max(stream.merged_end for stream in self.streams)
+        if end > self.position:
+            self._merge(end)
+            return True
+        if not running:
+            return False
+        min(running, key=lambda stream: stream.merged_end).receive(timeout=timeout)
+        return True
+
+    def resynchronize(self, drift: dict):
+        """
+        Shift every device by the samples its clock gained against the leader up to the current position, see
+        `resync`. Device samples skipped by a growing shift are dropped, a shrinking shift inserts fill samples into
+        the stream of the device.
+        """
+        for stream in self.streams[1:]:
+            ppm = drift[stream.device]
+            if ppm is None or stream.finished:
+                continue
+            shift = round(ppm * 1e-6 * self.position)
+            if shift != stream.shift and stream.shift == 0:
+                print(Fore.YELLOW + f"{stream.device}: following the sample clock of {self.streams[0].device}, "
+                                    f"{'dropping' if shift > 0 else 'inserting'} samples" + Style.RESET_ALL)
+            stream.shift = shift
+
+    def check_drift(self) -> dict:
+        """Estimate the drift of every device and warn about devices exceeding `DRIFT_WARNING_PPM`."""
+        drift = self.drift_ppm()
+        for device, ppm in drift.items():
+            if ppm is None:
+                continue
+            if abs(ppm) > DRIFT_WARNING_PPM and not self._drift_warned[device]:
+                print(Fore.YELLOW + f"{device}: sample clock deviates by {ppm:.0f} ppm from {self.streams[0].device}, "
+                                    f"the devices are {abs(ppm) * 1e-6 * self.position:.0f} samples apart, share "
+                                    f"the sample clock to avoid drift" + Style.RESET_ALL)
+            # the warning is rearmed once the drift fell below half of the threshold
+            self._drift_warned[device] = abs(ppm) > DRIFT_WARNING_PPM / 2 if self._drift_warned[device] \
+                else abs(ppm) > DRIFT_WARNING_PPM
+        return drift
+
+    def run(self, metrics=None):
+        """Merge until every device stopped, then close the merged ring for the writer."""
+        try:
+            while self.step(timeout=0.5):
+                drift = self.check_drift()
+                if self.resync:
+                    self.resynchronize(drift)
+                if metrics is None:
+                    continue
+                metrics.gauge("merged_samples_total", self.position)
+                metrics.gauge("ring_depth", self.ring.depth)
+                metrics.gauge("ring_overflows_total", self.ring.overflows)
+                for stream in self.streams:
+                    prefix = stream.device.lower()
+                    # samples a device delivered ahead of the slowest one, waiting in its ring
+                    metrics.gauge(f"{prefix}_lead_samples", max(0, stream.merged_end - self.position))
+                    metrics.gauge(f"{prefix}_shift_samples", stream.shift)
+                    metrics.gauge(f"{prefix}_ring_depth", stream.ring.depth)
+                    metrics.gauge(f"{prefix}_gaps_total", stream.gaps)
+                    metrics.gauge(f"{prefix}_missing_samples_total", stream.missing_samples)
+                    if drift[stream.device] is not None:
+                        metrics.gauge(f"{prefix}_drift_ppm", drift[stream.device])
+                metrics.maybe_emit()
+        finally:
+            self.ring.close_writer()
+            for stream in self.streams:
+                stream.ring.close()
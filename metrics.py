@@ -0,0 +1,176 @@
+import json
+import os
+import re
+import time
+
+
+class _Summary:
+    """Count, sum and maximum of the values observed during one export interval."""
+
+    __slots__ = ("count", "total", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+
+class JsonLinesExporter:
+    """Appends every snapshot as a single json object on its own line to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a")
+
+    def export(self, snapshot: dict):
+        self._file.write(json.dumps(snapshot) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class PrometheusTextfileExporter:
+    """
+    Writes the latest snapshot in the Prometheus text format to `path`, e.g. for the textfile collector of the node
+    exporter. The file is replaced atomically, so a scrape never sees a partially written snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, snapshot: dict):
+        # metric names may only hold letters, digits and underscores, device names inside of them may hold others
+        prefix = _metric_name(f"daq_{snapshot['stage']}_")
+        lines = [f"# TYPE {prefix}timestamp_seconds gauge", f"{prefix}timestamp_seconds {snapshot['timestamp']}"]
+        for name, value in snapshot.items():
+            if name in ("stage", "timestamp") or value is None:
+                continue
+            kind = "counter" if name.endswith("_total") else "gauge"
+            name = prefix + _metric_name(name)
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, self.path)
+
+    def close(self):
+        pass
+
+
+EXPORTERS = {
+    "jsonl": (JsonLinesExporter, ".jsonl"),
+    "prometheus": (PrometheusTextfileExporter, ".prom"),
+}
+
+
+class PipelineMetrics:
+    """
+    Lightweight instrumentation of one stage of the acquisition pipeline, exported as periodic snapshots.
+
+    The hot path only updates a few numbers in process local memory. Everything else, i.e. building the snapshot
+    and writing it, happens in `maybe_emit` at most once per `interval` seconds.
+
+    Three kinds of metrics are supported:
+        - observations (`observe`), e.g. durations, exported as `<name>_count`, `<name>_mean` and `<name>_max`
+          over the last interval
+        - counters (`count`), exported as `<name>_total` since the start and `<name>_per_second` over the last
+          interval
+        - gauges (`gauge`), exported with their latest value
+
+    Parameters
+    ----------
+    stage : str
+        Name of the pipeline stage, e.g. 'acquisition' or 'writer'.
+    exporter : JsonLinesExporter or PrometheusTextfileExporter
+        Receives the snapshots.
+    interval : float, optional
+        Seconds between two snapshots (Default: 1.0).
+
+    Example
+    -------
+    >>> metrics = PipelineMetrics("writer", JsonLinesExporter("writer.jsonl"))
+    >>> metrics.observe("encode_seconds", 0.002)
+    >>> metrics.count("bytes_written", 4096)
+    >>> metrics.gauge("ring_depth", 3)
+    >>> metrics.maybe_emit()
+    """
+
+    def __init__(self, stage: str, exporter, interval: float = 1.0):
+        self.stage = stage
+        self.exporter = exporter
+        self.interval = interval
+        self._summaries = {}
+        self._counters = {}
+        self._interval_counts = {}
+        self._gauges = {}
+        self._last_emit = time.monotonic()
+
+    def observe(self, name: str, value: float):
+        summary = self._summaries.get(name)
+        if summary is None:
+            summary = self._summaries[name] = _Summary()
+        summary.add(value)
+
+    def count(self, name: str, value: int = 1):
+        self._interval_counts[name] = self._interval_counts.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        self._gauges[name] = value
+
+    def maybe_emit(self):
+        """Export a snapshot if the interval elapsed and return it, None otherwise."""
+        now = time.monotonic()
+        if now - self._last_emit < self.interval:
+            return None
+        return self.emit(now)
+
+    def emit(self, now: float = None) -> dict:
+        """Export a snapshot of the current interval and start the next one."""
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self._last_emit, 1e-9)
+        snapshot = {"timestamp": round(time.time(), 3), "stage": self.stage, "interval_seconds": round(elapsed, 3)}
+        for name, summary in self._summaries.items():
+            snapshot[f"{name}_count"] = summary.count
+            snapshot[f"{name}_mean"] = summary.total / summary.count if summary.count else None
+            snapshot[f"{name}_max"] = summary.maximum if summary.count else None
+        for name in self._counters.keys() | self._interval_counts.keys():
+            interval_count = self._interval_counts.get(name, 0)
+            self._counters[name] = self._counters.get(name, 0) + interval_count
+            snapshot[f"{name}_total"] = self._counters[name]
+            snapshot[f"{name}_per_second"] = interval_count / elapsed
+        snapshot.update(self._gauges)
+        self.exporter.export(snapshot)
+        self._summaries = {}
+        self._interval_counts = {}
+        self._last_emit = now
+        return snapshot
+
+    def close(self):
+        """Export the last, possibly shorter, interval and close the exporter."""
+        self.emit()
+        self.exporter.close()
+
+
+def create_metrics(stage: str, kind: str, directory: str, interval: float = 1.0):
+    """
+    Metrics of a pipeline stage exported to `<directory>/<stage>.jsonl` or `<directory>/<stage>.prom`.
+
+    Returns None if `kind` is None, so callers can skip the instrumentation entirely with a single check.
+    """
+    if kind is None:
+        return None
+    exporter_class, extension = EXPORTERS[kind]
+    os.makedirs(directory, exist_ok=True)
+    return PipelineMetrics(stage, exporter_class(os.path.join(directory, stage + extension)), interval)
@@ -0,0 +1,153 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from storage import NpyAppender, read_npy
+
+# samples per bucket of the finest level, every further level merges FACTOR buckets of the level below
+BUCKET_SIZE = 64
+FACTOR = 4
+# levels are added until the coarsest one holds at most this many buckets
+MIN_BUCKETS = 1024
+# samples read at once while building, a power of two so chunks never split a bucket of any level
+CHUNK_SIZE = 2 ** 22
+PYRAMID_FILE = "pyramid.json"
+# columns of a pyramid level
+MIN, MAX, MEAN = 0, 1, 2
+
+
+def pyramid_path(path: str) -> str:
+    """Directory of the pyramid of the measurement at `path`, e.g. 'data/measurements.csv.pyramid'."""
+    return os.path.normpath(path) + ".pyramid"
+
+
+def bucket_size(level: int) -> int:
+    """Number of samples aggregated by a single bucket of `level`."""
+    return BUCKET_SIZE * FACTOR ** level
+
+
+def number_of_levels(n_samples: int) -> int:
+    levels = 1
+    while math.ceil(n_samples / bucket_size(levels - 1)) > MIN_BUCKETS:
+        levels += 1
+    return levels
+
+
+def level_file_name(channel: str, level: int) -> str:
+    return f"{channel.replace('/', '_')}.{level}.npy"
+
+
+def aggregate(values: np.ndarray, size: int) -> np.ndarray:
+    """
+    Minimum, maximum and mean of consecutive buckets of `size` samples, the last bucket may be shorter.
+
+    Returns an array of shape `(n_buckets, 3)`, its columns are indexed by `MIN`, `MAX` and `MEAN`.
+    """
+    starts = np.arange(0, len(values), size)
+    buckets = np.empty((len(starts), 3))
+    if len(values) == 0:
+        return buckets
+    buckets[:, MIN] = np.minimum.reduceat(values, starts)
+    buckets[:, MAX] = np.maximum.reduceat(values, starts)
+    buckets[:, MEAN] = np.add.reduceat(values, starts, dtype=np.float64) / np.diff(np.append(starts, len(values)))
+    return buckets
+
+
+def build_pyramid(path: str, channels: list, values, n_samples: int, source=None):
+    """
+    Compute the min/max/mean pyramid of every channel and store it in `path`.
+
+    The samples are read in chunks of `CHUNK_SIZE` through `values(channel, start, stop)`, which returns them in
+    volts, so the memory needed does not depend on the length of the recording. Level 0 aggregates `BUCKET_SIZE`
+    samples per bucket and every further level `FACTOR` buckets of the level below. Each level of a channel is
+    stored as .npy file of shape `(n_buckets, 3)`.
+
+    `source` identifies the state of the measurement the pyramid was built from, see `Pyramid.open`.
+    """
+    levels = number_of_levels(n_samples)
+    chunk_size = max(CHUNK_SIZE, bucket_size(levels - 1))
+    parent = os.path.dirname(os.path.abspath(path))
+    temporary_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        for channel in channels:
+            level_files = [NpyAppender(os.path.join(temporary_path, level_file_name(channel, level)), np.float64,
+                                       row_shape=(3,))
+                           for level in range(levels)]
+            for start in range(0, n_samples, chunk_size):
+                chunk = np.asarray(values(channel, start, min(start + chunk_size, n_samples)), dtype=np.float64)
+                minimum, maximum = chunk, chunk
+                sums, counts = chunk, np.ones(len(chunk))
+                size = BUCKET_SIZE
+                for level_file in level_files:
+                    # every level is merged from the level below, sums and counts keep the mean of short buckets exact
+                    starts = np.arange(0, len(minimum), size)
+                    minimum = np.minimum.reduceat(minimum, starts)
+                    maximum = np.maximum.reduceat(maximum, starts)
+                    sums = np.add.reduceat(sums, starts)
+                    counts = np.add.reduceat(counts, starts)
+                    level_file.append(np.column_stack((minimum, maximum, sums / counts)))
+                    size = FACTOR
+            for level_file in level_files:
+                level_file.close()
+        with open(os.path.join(temporary_path, PYRAMID_FILE), "w") as f:
+            json.dump({"channels": channels, "n_samples": n_samples, "levels": levels, "bucket_size": BUCKET_SIZE,
+                       "factor": FACTOR, "source": source}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(temporary_path, path)
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+
+
+class Pyramid:
+    """
+    Read access to the pyramid of a measurement, see `build_pyramid`.
+
+    The levels are memory mapped, so serving a viewport only reads the buckets inside of it.
+
+    Example
+    -------
+    >>> pyramid = Pyramid.open("data/measurements.csv.pyramid", source=[mtime, size])
+    >>> level = pyramid.select_level(n_samples=10_000_000, max_buckets=1000)
+    >>> buckets = pyramid.level("ai0", level)[100:1100]
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.channels = header["channels"]
+        self.n_samples = header["n_samples"]
+        self.levels = header["levels"]
+
+    @classmethod
+    def open(cls, path: str, source=None):
+        """The pyramid stored at `path`, None if there is none or it was built from a different `source`."""
+        try:
+            with open(os.path.join(path, PYRAMID_FILE)) as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if header["source"] != source or header["bucket_size"] != BUCKET_SIZE or header["factor"] != FACTOR:
+            return None
+        return cls(path, header)
+
+    def level(self, channel: str, level: int) -> np.ndarray:
+        """Memory mapped buckets of `level`, an array of shape `(n_buckets, 3)`."""
+        return read_npy(os.path.join(self.path, level_file_name(channel, level)))
+
+    def select_level(self, n_samples: int, max_buckets: int):
+        """
+        Finest level showing `n_samples` in at most `max_buckets` buckets.
+
+        Returns None if even level 0 is coarser than necessary, the raw samples are then few enough to be aggregated
+        on the fly, see `aggregate`.
+        """
+        if n_samples <= bucket_size(0) * max_buckets:
+            return None
+        for level in range(self.levels):
+            if math.ceil(n_samples / bucket_size(level)) <= max_buckets:
+                return level
+        return self.levels - 1
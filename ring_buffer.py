@@ -0,0 +1,255 @@
+import multiprocessing
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+Block = namedtuple("Block", ["data", "first_sample", "timestamp_ns"])
+
+# layout of the int64 control words at the start of the shared memory segment
+_WRITE_SEQ = 0
+_READ_SEQ = 1
+_OVERFLOWS = 2
+_DROPPED_SAMPLES = 3
+_CLOSED = 4
+_START_TIME = 5
+_CONTROL_WORDS = 8
+# every slot stores the number of valid samples per channel, the index of its first sample and a timestamp
+_SLOT_WORDS = 3
+_ALIGNMENT = 64
+
+
+class SharedRingBuffer:
+    """
+    Preallocated ring of sample blocks inside a shared memory segment.
+
+    The ring connects exactly one producer (the acquisition loop) and one consumer (the file writer) living in
+    different processes. Every slot holds up to `block_size` samples for each of `n_channels` channels, stored
+    channel-major so that a block of `n` samples is a contiguous `(n_channels, n)` array which can directly be
+    passed to the `read_many_sample`/`read_int16` methods of the nidaqmx stream readers. The consumer receives views
+    into the same memory, so no sample is copied or pickled between the processes.
+
+    Two semaphores count the free and the filled slots. The producer waits at most a given timeout for a free slot
+    (backpressure) and reports an overflow if the consumer did not catch up in time, instead of buffering an
+    unbounded amount of data in RAM.
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels contained in every block.
+    block_size : int
+        Maximum number of samples per channel of a single block.
+    n_blocks : int
+        Number of slots in the ring.
+    dtype : numpy.dtype, optional
+        Sample data type, e.g. `numpy.float64` for scaled or `numpy.int16` for raw samples (Default: float64).
+
+    Notes
+    -----
+    The ring is created by the parent process and handed to child processes as a `multiprocessing.Process`
+    argument. Only the creating instance is allowed to `unlink` the shared memory.
+
+    Example
+    -------
+    >>> ring = SharedRingBuffer(n_channels=2, block_size=1000, n_blocks=16)
+    >>> block = ring.reserve(500)
+    >>> block[:] = 0.0
+    >>> ring.commit(first_sample=0)
+    >>> data, first_sample, timestamp_ns = ring.get()
+    >>> data.shape
+    (2, 500)
+    >>> ring.release()
+    """
+
+    def __init__(self, n_channels: int, block_size: int, n_blocks: int, dtype=np.float64):
+        if n_channels < 1 or block_size < 1 or n_blocks < 2:
+            raise ValueError("ring buffer requires at least one channel, one sample per block and two blocks")
+        self.n_channels = n_channels
+        self.block_size = block_size
+        self.n_blocks = n_blocks
+        self.dtype = np.dtype(dtype)
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self._segment_size())
+        self._free = multiprocessing.Semaphore(n_blocks)
+        self._filled = multiprocessing.Semaphore(0)
+        self._owner = True
+        self._attach()
+        self._control[:] = 0
+
+    def _segment_size(self) -> int:
+        return self._data_offset() + self.n_blocks * self.n_channels * self.block_size * self.dtype.itemsize
+
+    def _data_offset(self) -> int:
+        meta_bytes = (_CONTROL_WORDS + self.n_blocks * _SLOT_WORDS) * 8
+        return -(-meta_bytes // _ALIGNMENT) * _ALIGNMENT
+
+    def _attach(self):
+        buffer = self._shm.buf
+        self._control = np.ndarray((_CONTROL_WORDS,), dtype=np.int64, buffer=buffer)
+        self._slots = np.ndarray((self.n_blocks, _SLOT_WORDS), dtype=np.int64, buffer=buffer,
+                                 offset=_CONTROL_WORDS * 8)
+        self._data = np.ndarray((self.n_blocks, self.n_channels * self.block_size), dtype=self.dtype,
+                                buffer=buffer, offset=self._data_offset())
+        # process local positions, the shared counters are only advanced by their respective side
+        self._pending = None
+        self._cursor = int(self._control[_READ_SEQ])
+
+    def __getstate__(self):
+        return {
+            "n_channels": self.n_channels,
+            "block_size": self.block_size,
+            "n_blocks": self.n_blocks,
+            "dtype": self.dtype.str,
+            "shm": self._shm,
+            "free": self._free,
+            "filled": self._filled,
+        }
+
+    def __setstate__(self, state):
+        self.n_channels = state["n_channels"]
+        self.block_size = state["block_size"]
+        self.n_blocks = state["n_blocks"]
+        self.dtype = np.dtype(state["dtype"])
+        self._shm = state["shm"]
+        self._free = state["free"]
+        self._filled = state["filled"]
+        self._owner = False
+        self._attach()
+
+    def _slot_view(self, seq: int, n_samples: int) -> np.ndarray:
+        return self._data[seq % self.n_blocks, :self.n_channels * n_samples].reshape(self.n_channels, n_samples)
+
+    # ------------------------------------------------------------------ producer side
+
+    def reserve(self, n_samples: int, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Wait for a free slot and return a writable, contiguous `(n_channels, n_samples)` view into it.
+
+        Returns None if no slot became free within `timeout` seconds. The caller is then expected to discard the
+        samples and report them through `drop`.
+        """
+        if not 0 < n_samples <= self.block_size:
+            raise ValueError(f"block of {n_samples} samples does not fit into ring slots of {self.block_size}")
+        if not self._free.acquire(timeout=timeout):
+            return None
+        self._pending = n_samples
+        return self._slot_view(int(self._control[_WRITE_SEQ]), n_samples)
+
+    def commit(self, first_sample: int, timestamp_ns: int = 0):
+        """
+        Publish the previously reserved slot, `first_sample` being the index of its first sample per channel.
+
+        `timestamp_ns` is passed on to the consumer as it is, e.g. the trigger time of a triggered record.
+        """
+        if self._pending is None:
+            raise RuntimeError("commit called without a reserved slot")
+        seq = int(self._control[_WRITE_SEQ])
+        self._slots[seq % self.n_blocks] = (self._pending, first_sample, timestamp_ns)
+        self._pending = None
+        self._control[_WRITE_SEQ] = seq + 1
+        self._filled.release()
+
+    def drop(self, n_samples: int):
+        """Record an overflow of `n_samples` samples per channel that could not be stored in the ring."""
+        self._control[_OVERFLOWS] += 1
+        self._control[_DROPPED_SAMPLES] += n_samples
+
+    def mark_start(self, time_ns: Optional[int] = None):
+        """Record the current time or `time_ns` as start of the acquisition, see `start_time_ns`."""
+        self._control[_START_TIME] = time.time_ns() if time_ns is None else time_ns
+
+    def close_writer(self):
+        """Signal the consumer that no further blocks will be committed."""
+        self._control[_CLOSED] = 1
+        self._filled.release()
+
+    # ------------------------------------------------------------------ consumer side
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Block]:
+        """
+        Return the next committed block as zero-copy view together with the index of its first sample and the
+        timestamp passed to `commit`.
+
+        The view stays valid until the block is handed back through `release`. Several blocks may be held at the
+        same time, they have to be released in the order they were received. Returns None if no block arrived
+        within `timeout` seconds or if the producer closed the ring and every block has been received (see `closed`).
+        """
+        if not self._filled.acquire(timeout=timeout):
+            return None
+        if self._cursor == int(self._control[_WRITE_SEQ]):
+            # only the token released by close_writer can be left at this point
+            return None
+        n_samples, first_sample, timestamp_ns = (int(value) for value in self._slots[self._cursor % self.n_blocks])
+        block = Block(self._slot_view(self._cursor, n_samples), first_sample, timestamp_ns)
+        self._cursor += 1
+        return block
+
+    def view(self, seq: int, n_samples: int) -> np.ndarray:
+        """
+        Read-only access to block number `seq` of the ring from any process, e.g. by workers encoding it.
+
+        The caller is responsible for the block being received and not yet released, see `received`.
+        """
+        return self._slot_view(seq, n_samples)
+
+    @property
+    def received(self) -> int:
+        """Number of blocks received by this consumer so far, the last block returned by `get` is `received - 1`."""
+        return self._cursor
+
+    def release(self):
+        """Hand the oldest received block back to the producer."""
+        self._control[_READ_SEQ] += 1
+        self._free.release()
+
+    @property
+    def closed(self) -> bool:
+        """True once the producer closed the ring and every committed block was received."""
+        return bool(self._control[_CLOSED]) and self._cursor == int(self._control[_WRITE_SEQ])
+
+    # ------------------------------------------------------------------ statistics
+
+    @property
+    def depth(self) -> int:
+        """Number of committed blocks not yet released by the consumer."""
+        return int(self._control[_WRITE_SEQ] - self._control[_READ_SEQ])
+
+    @property
+    def blocks_written(self) -> int:
+        """Number of blocks committed by the producer so far."""
+        return int(self._control[_WRITE_SEQ])
+
+    @property
+    def overflows(self) -> int:
+        """Number of blocks which were dropped because the ring was full."""
+        return int(self._control[_OVERFLOWS])
+
+    @property
+    def dropped_samples(self) -> int:
+        """Number of samples per channel which were dropped because the ring was full."""
+        return int(self._control[_DROPPED_SAMPLES])
+
+    @property
+    def start_time_ns(self) -> Optional[int]:
+        """Wall clock time in ns at which the producer started the acquisition, None if not yet started."""
+        return int(self._control[_START_TIME]) or None
+
+    @property
+    def nbytes(self) -> int:
+        return self._shm.size
+
+    # ------------------------------------------------------------------ cleanup
+
+    def close(self):
+        """Release the views of this process onto the shared memory."""
+        self._control = self._slots = self._data = None
+        self._shm.close()
+
+    def unlink(self):
+        """Close and destroy the shared memory segment, only allowed for the creating process."""
+        if not self._owner:
+            raise RuntimeError("only the process which created the ring buffer may unlink it")
+        self.close()
+        self._shm.unlink()
@@ -0,0 +1,340 @@
+import bisect
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+
+import numpy as np
+
+from storage import Recording, apply_scaling, open_writer
+
+# seconds of samples between two byte offsets recorded in the index of a csv segment
+INDEX_INTERVAL = 1.0
+COMPRESSION_LEVEL = 6
+# gzip container for zlib streams
+_GZIP_WBITS = 31
+
+
+def segment_path(path: str, number: int) -> str:
+    """Path of segment `number` of the recording at `path`, e.g. 'data/measurements_0003.csv'."""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_{number:04d}{extension}"
+
+
+def index_path(path: str) -> str:
+    """Path of the segment index of the recording at `path`, e.g. 'data/measurements.index.json'."""
+    return os.path.splitext(path)[0] + ".index.json"
+
+
+def compress_segment(path: str, offsets: list):
+    """
+    Compress a closed csv segment to `<path>.gz` and delete the uncompressed file.
+
+    Every part between two recorded byte offsets becomes an independent gzip member, so the file stays a valid gzip
+    file while each part can still be decompressed on its own. Returns the path of the compressed file and the
+    offsets translated to positions inside of it.
+    """
+    compressed_path = path + ".gz"
+    boundaries = [byte for _, byte in offsets] + [os.path.getsize(path)]
+    compressed_offsets = []
+    with open(path, "rb") as source, open(compressed_path + ".tmp", "wb") as target:
+        # the header line is a member of its own
+        position = 0
+        for (sample, _), start, stop in zip([(None, 0)] + offsets, [0] + boundaries[:-1], boundaries):
+            if sample is not None:
+                compressed_offsets.append([sample, position])
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, _GZIP_WBITS)
+            source.seek(start)
+            member = compressor.compress(source.read(stop - start)) + compressor.flush()
+            target.write(member)
+            position += len(member)
+    os.replace(compressed_path + ".tmp", compressed_path)
+    os.remove(path)
+    return compressed_path, compressed_offsets
+
+
+def _compression_worker(tasks, results):
+    # a Ctrl+C stops the acquisition, the worker still compresses the remaining segments until the writer stops it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        number, path, offsets = task
+        compressed_path, compressed_offsets = compress_segment(path, offsets)
+        results.put((number, os.path.basename(compressed_path), compressed_offsets))
+
+
+class SegmentEncoder:
+    """Encodes blocks into the payload of `SegmentedWriter.write` with the encoder of the segment format."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def __call__(self, data: np.ndarray, first_sample: int):
+        return first_sample, data.shape[1], self.encoder(data, first_sample)
+
+
+def _write_index(path: str, index: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+class SegmentedWriter:
+    """
+    Writes a recording as a sequence of segments, starting a new one once a size or duration limit is reached.
+
+    Every segment is a complete csv file or binary recording of its own (see `CsvWriter` and `NpyWriter`), holding
+    the samples starting at the sample index `first_sample` stored in its metadata. Segments are rotated between
+    blocks, so a segment may exceed the limits by up to one block. The index file (see `index_path`) lists every
+    segment with its sample and time range and, for csv segments, the byte offset of a block about every
+    `INDEX_INTERVAL` seconds, so a time window can be read without touching the rest of the recording, see
+    `SegmentIndex`. The index is rewritten whenever a segment is started or closed.
+
+    Closed csv segments can be compressed by separate worker processes, see `compress_segment`. Binary segments are
+    never compressed, as they are memory mapped when loaded.
+
+    Parameters
+    ----------
+    file_format : str
+        Format of the segments, 'csv' or 'npy'.
+    path : str
+        Path of the recording, the segments are named after it, see `segment_path`.
+    metadata : dict
+        Description of the recording, see `storage.recording_metadata`.
+    max_bytes : int, optional
+        Size in bytes after which a new segment is started.
+    max_duration : float, optional
+        Duration in seconds after which a new segment is started.
+    compress : bool, optional
+        Compress closed csv segments with gzip in background processes (Default: False).
+    compress_workers : int, optional
+        Number of processes compressing closed segments in parallel (Default: 1).
+
+    Example
+    -------
+    >>> writer = SegmentedWriter("csv", "data/measurements.csv", recording_metadata(["ai0"], 1000), max_duration=3600)
+    >>> writer.write_block(np.zeros((1, 100)), first_sample=0)
+    >>> writer.close()
+    """
+
+    def __init__(self, file_format: str, path: str, metadata: dict, max_bytes: int = None,
+                 max_duration: float = None, compress: bool = False, compress_workers: int = 1):
+        self.file_format = file_format
+        self.path = path
+        self.metadata = metadata
+        self.max_bytes = max_bytes
+        self.max_samples = None if max_duration is None else max(1, int(max_duration * metadata["sampling_rate"]))
+        self._index_path = index_path(path)
+        self._index = {key: value for key, value in metadata.items() if key not in ("n_samples", "first_sample")}
+        self._index.update(format=file_format, segments=[])
+        self._closed_bytes = 0
+        self._tasks = self._results = None
+        self._workers = []
+        self._pending_compressions = 0
+        if compress and file_format == "csv":
+            self._tasks, self._results = multiprocessing.Queue(), multiprocessing.Queue()
+            self._workers = [multiprocessing.Process(target=_compression_worker, args=(self._tasks, self._results))
+                             for _ in range(max(1, compress_workers))]
+            for worker in self._workers:
+                worker.start()
+        self._open_segment(0)
+
+    @property
+    def bytes_written(self) -> int:
+        return self._closed_bytes + self._writer.bytes_written
+
+    @property
+    def encoder(self):
+        """Encoder of the blocks which can run in other processes, None if the segments store blocks as they are."""
+        return None if self._writer.encoder is None else SegmentEncoder(self._writer.encoder)
+
+    def _open_segment(self, first_sample: int):
+        number = len(self._index["segments"])
+        segment_metadata = dict(self.metadata, first_sample=first_sample, n_samples=0)
+        self._writer = open_writer(self.file_format, segment_path(self.path, number), segment_metadata)
+        self._segment = {
+            "file": os.path.basename(segment_path(self.path, number)),
+            "first_sample": first_sample,
+            "n_samples": 0,
+            "start": first_sample / self.metadata["sampling_rate"],
+            "stop": first_sample / self.metadata["sampling_rate"],
+            "compressed": False,
+            "offsets": [],
+        }
+        self._index["segments"].append(self._segment)
+        self._next_offset_sample = first_sample
+        _write_index(self._index_path, self._index)
+
+    def _close_segment(self):
+        self._writer.close()
+        self._closed_bytes += self._writer.bytes_written
+        if self._workers and self._segment["n_samples"]:
+            self._tasks.put((len(self._index["segments"]) - 1, self._writer.path, self._segment["offsets"]))
+            self._pending_compressions += 1
+        _write_index(self._index_path, self._index)
+
+    def _collect_compressed(self, block: bool = False):
+        """Record the segments compressed in the meantime in the index, with `block` wait for all of them."""
+        while self._pending_compressions:
+            try:
+                number, file_name, offsets = self._results.get(block=block, timeout=1.0 if block else None)
+            except queue.Empty:
+                if block and any(worker.is_alive() for worker in self._workers):
+                    continue
+                return
+            self._pending_compressions -= 1
+            self._index["segments"][number].update(file=file_name, offsets=offsets, compressed=True)
+            _write_index(self._index_path, self._index)
+
+    def update_metadata(self, **fields):
+        """Update the metadata of the recording, the current segment and the index."""
+        self.metadata.update(fields)
+        self._writer.update_metadata(**fields)
+        self._index.update(fields)
+        _write_index(self._index_path, self._index)
+
+    def encode(self, data: np.ndarray, first_sample: int):
+        """Encode a block in the format of the segments, see `CsvWriter.encode` and `NpyWriter.encode`."""
+        return first_sample, data.shape[1], self._writer.encode(data, first_sample)
+
+    def write(self, payload) -> int:
+        """Append an encoded block to the current segment, starting a new one first if it is full."""
+        first_sample, n_samples, segment_payload = payload
+        segment_samples = first_sample - self._segment["first_sample"]
+        if self._segment["n_samples"] and (
+                (self.max_bytes is not None and self._writer.bytes_written >= self.max_bytes) or
+                (self.max_samples is not None and segment_samples >= self.max_samples)):
+            self._close_segment()
+            self._open_segment(first_sample)
+        if self.file_format == "csv" and first_sample >= self._next_offset_sample:
+            self._segment["offsets"].append([first_sample, self._writer.bytes_written])
+            self._next_offset_sample = first_sample + INDEX_INTERVAL * self.metadata["sampling_rate"]
+        n_bytes = self._writer.write(segment_payload)
+        self._segment["n_samples"] = first_sample + n_samples - self._segment["first_sample"]
+        self._segment["stop"] = (first_sample + n_samples) / self.metadata["sampling_rate"]
+        self._collect_compressed()
+        return n_bytes
+
+    def write_block(self, data: np.ndarray, first_sample: int) -> int:
+        """Append a block of shape `(n_channels, n_samples)` starting at sample index `first_sample`."""
+        return self.write(self.encode(data, first_sample))
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        """Close the current segment and wait for the compression of all closed segments."""
+        self._close_segment()
+        if self._workers:
+            self._collect_compressed(block=True)
+            for _ in self._workers:
+                self._tasks.put(None)
+            for worker in self._workers:
+                worker.join()
+
+
+def _decompress_members(data: bytes) -> bytes:
+    parts = []
+    while data:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        parts.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(parts)
+
+
+class SegmentIndex:
+    """
+    Read access to a segmented recording through its index, see `SegmentedWriter`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the index file or of the recording, see `index_path`.
+
+    Example
+    -------
+    >>> index = SegmentIndex("data/measurements.index.json")
+    >>> time, values = index.read_window(3600.0, 3610.0)
+    """
+
+    def __init__(self, path: str):
+        self.path = path if path.endswith(".index.json") else index_path(path)
+        with open(self.path) as f:
+            self.index = json.load(f)
+        self.directory = os.path.dirname(self.path)
+        self.channels = self.index["channels"]
+        self.sampling_rate = self.index["sampling_rate"]
+        self.segments = self.index["segments"]
+
+    def segments_between(self, start: float, stop: float) -> list:
+        """Segments holding samples of the time range `start` to `stop` in seconds."""
+        return [segment for segment in self.segments if segment["start"] < stop and segment["stop"] > start]
+
+    def _read_csv(self, segment: dict, first_sample: int, stop_sample: int, columns: list) -> np.ndarray:
+        samples = [sample for sample, _ in segment["offsets"]]
+        bytes_offsets = [byte for _, byte in segment["offsets"]]
+        first = max(bisect.bisect_right(samples, first_sample) - 1, 0)
+        last = bisect.bisect_left(samples, stop_sample)
+        with open(os.path.join(self.directory, segment["file"]), "rb") as f:
+            f.seek(bytes_offsets[first])
+            data = f.read() if last >= len(samples) else f.read(bytes_offsets[last] - bytes_offsets[first])
+        if segment["compressed"]:
+            data = _decompress_members(data)
+        if not data.strip():
+            return np.empty((0, len(columns) + 1))
+        rows = np.loadtxt(io.BytesIO(data), delimiter=",", ndmin=2, usecols=[0, *(column + 1 for column in columns)])
+        # rows of the blocks around the window are dropped by their sample index
+        sample_index = np.rint(rows[:, 0] * self.sampling_rate)
+        return rows[(sample_index >= first_sample) & (sample_index < stop_sample)]
+
+    @property
+    def n_samples(self) -> int:
+        """Sample index following the last sample of the recording."""
+        return max((segment["first_sample"] + segment["n_samples"] for segment in self.segments), default=0)
+
+    def read_samples(self, first_sample: int, stop_sample: int, channels: list = None):
+        """
+        Timestamps and samples in volts of `channels` with a sample index from `first_sample` to `stop_sample`.
+
+        Only the segments holding these samples are opened and, for csv segments, only the blocks around them are
+        read. Returns the timestamps and an array of shape `(len(channels), n_samples)`, all channels if None.
+        """
+        channels = self.channels if channels is None else channels
+        columns = [self.channels.index(channel) for channel in channels]
+        times, values = [], []
+        for segment in self.segments:
+            if segment["first_sample"] >= stop_sample or segment["first_sample"] + segment["n_samples"] <= first_sample:
+                continue
+            if self.index["format"] == "csv":
+                rows = self._read_csv(segment, first_sample, stop_sample, columns)
+                times.append(rows[:, 0])
+                samples = rows[:, 1:].T
+                if self.index.get("scaling"):
+                    samples = np.array([apply_scaling(channel_samples, self.index["scaling"][channel])
+                                        for channel, channel_samples in zip(channels, samples)])
+                values.append(samples.reshape(len(channels), -1))
+            else:
+                recording = Recording(os.path.join(self.directory, segment["file"]))
+                start_index = max(first_sample - recording.first_sample, 0)
+                stop_index = min(stop_sample - recording.first_sample, recording.n_samples)
+                times.append(recording.time(start_index, stop_index))
+                values.append(np.array([recording.values(channel, start_index, stop_index)
+                                        for channel in channels]).reshape(len(channels), -1))
+        if not times:
+            return np.empty(0), np.empty((len(channels), 0))
+        return np.concatenate(times), np.concatenate(values, axis=1)
+
+    def read_window(self, start: float, stop: float, channels: list = None):
+        """
+        Timestamps and samples in volts of `channels` in the time range `start` to `stop` in seconds.
+
+        Returns the timestamps and an array of shape `(len(channels), n_samples)`, all channels if None, see
+        `read_samples`.
+        """
+        return self.read_samples(int(np.ceil(start * self.sampling_rate)), int(np.ceil(stop * self.sampling_rate)),
+                                 channels)
@@ -0,0 +1,385 @@
+"""
+Simulated DAQ device mimicking the parts of `nidaqmx.Task` and `nidaqmx.stream_readers` used by the data reader.
+
+Samples are generated on demand from the wall clock, so a simulated task behaves like a device acquiring at the
+configured sampling rate: samples become available over time, reads wait for them and reading too slowly overflows
+the input buffer with the same error codes as the NI-DAQmx driver. Every channel carries a sine wave of its own
+frequency, quantized to 16 bit like the ADC of a real board.
+
+Reference triggers do not evaluate the signal, instead they fire periodically at `trigger_rate`. With a retriggerable
+reference trigger every trigger produces a new record, otherwise the task is done after the first record. With
+`timestamp_enable` set, `timestamp_val` reports the time of the most recent trigger like the timestamping engine of
+an X Series device.
+
+Several simulated tasks can share a start trigger like devices connected through RTSI: a task whose start trigger
+is configured waits for the task without one, the start time is exchanged through a shared `multiprocessing.Value`
+so the tasks may live in different processes. Unless a task takes its sample clock from another device, its clock
+deviates by `clock_drift` ppm from the nominal sampling rate.
+"""
+import datetime
+import math
+import threading
+import time
+
+import numpy as np
+from nidaqmx.constants import AcquisitionType, READ_ALL_AVAILABLE, WAIT_INFINITELY
+from nidaqmx.error_codes import DAQmxErrors
+from nidaqmx.errors import DaqError, DaqReadError
+
+# input range of the simulated channels in volts, mapped onto the 16 bit ADC codes
+VOLTAGE_RANGE = 10.0
+LSB = 2 * VOLTAGE_RANGE / 2 ** 16
+# seconds between two checks for available samples while a read waits
+_WAIT_INTERVAL = 0.001
+
+
+class SimulatedChannel:
+    def __init__(self, physical_channel: str, index: int):
+        self.name = physical_channel
+        self.physical_channel = physical_channel
+        self.ai_dev_scaling_coeff = [0.0, LSB, 0.0, 0.0]
+        # frequency relative to the sampling rate, so the signal looks alike at every rate
+        self.period = 1000 * (index + 1)
+        self.amplitude = VOLTAGE_RANGE * 0.8 / (index + 1)
+
+
+class SimulatedChannelCollection(list):
+    def add_ai_voltage_chan(self, physical_channel: str, *args, **kwargs):
+        channel = SimulatedChannel(physical_channel, len(self))
+        self.append(channel)
+        return channel
+
+
+class SimulatedTiming:
+    def __init__(self):
+        self.samp_clk_rate = 1000.0
+        self.samp_quant_samp_mode = AcquisitionType.FINITE
+        self.samp_quant_samp_per_chan = 1000
+        self.samp_clk_src = ""
+
+    def cfg_samp_clk_timing(self, rate, source="", active_edge=None, sample_mode=AcquisitionType.FINITE,
+                            samps_per_chan=1000):
+        self.samp_clk_rate = float(rate)
+        self.samp_clk_src = source
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = samps_per_chan
+
+
+class SimulatedReferenceTrigger:
+    def __init__(self, task):
+        self._task = task
+        self.trigger_source = None
+        self.pretrig_samples = 0
+        self.retriggerable = False
+        self.timestamp_enable = False
+
+    @property
+    def timestamp_val(self) -> datetime.datetime:
+        if not self.timestamp_enable:
+            raise DaqError("Reference trigger timestamps are not enabled.", DAQmxErrors.INVALID_ATTRIBUTE_VALUE,
+                           task_name=self._task.name)
+        return self._task._last_trigger_time()
+
+    def cfg_anlg_edge_ref_trig(self, trigger_source, pretrigger_samples, trigger_slope=None, trigger_level=0.0):
+        self.trigger_source = trigger_source
+        self.pretrig_samples = pretrigger_samples
+
+    def cfg_dig_edge_ref_trig(self, trigger_source, pretrigger_samples, trigger_edge=None):
+        self.trigger_source = trigger_source
+        self.pretrig_samples = pretrigger_samples
+
+
+class SimulatedStartTrigger:
+    def __init__(self):
+        self.trigger_source = None
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=None):
+        self.trigger_source = trigger_source
+
+
+class SimulatedTriggers:
+    def __init__(self, task):
+        self.reference_trigger = SimulatedReferenceTrigger(task)
+        self.start_trigger = SimulatedStartTrigger()
+
+
+class SimulatedInStream:
+    """Input buffer of a simulated task, see `SimulatedTask`."""
+
+    def __init__(self, task):
+        self._task = task
+        self._input_buf_size = None
+        self.wait_mode = None
+        self.read_all_avail_samp = False
+        # number of samples per channel read so far
+        self.curr_read_pos = 0
+
+    @property
+    def num_chans(self) -> int:
+        return len(self._task.ai_channels)
+
+    @property
+    def input_buf_size(self) -> int:
+        if self._input_buf_size is not None:
+            return self._input_buf_size
+        timing = self._task.timing
+        if timing.samp_quant_samp_mode != AcquisitionType.CONTINUOUS:
+            return timing.samp_quant_samp_per_chan
+        # default buffer sizes of the NI-DAQmx driver for continuous acquisitions
+        rate = timing.samp_clk_rate
+        default = 1000 if rate <= 100 else 10000 if rate <= 10000 else 100000 if rate <= 1000000 else 1000000
+        return max(default, timing.samp_quant_samp_per_chan)
+
+    @input_buf_size.setter
+    def input_buf_size(self, value: int):
+        self._input_buf_size = value
+
+    @property
+    def avail_samp_per_chan(self) -> int:
+        return min(self._task._acquired() - self.curr_read_pos, self.input_buf_size)
+
+    def _read(self, data: np.ndarray, number_of_samples_per_channel: int, timeout: float, raw: bool) -> int:
+        task = self._task
+        if not task._running and task._start_time is None:
+            raise DaqError("Simulated task has not been started.", DAQmxErrors.INVALID_TASK, task_name=task.name)
+        if number_of_samples_per_channel == READ_ALL_AVAILABLE:
+            number_of_samples_per_channel = self.avail_samp_per_chan
+        deadline = None if timeout == WAIT_INFINITELY else time.perf_counter() + timeout
+        while True:
+            acquired = task._acquired()
+            if acquired - self.curr_read_pos > self.input_buf_size:
+                raise DaqReadError(
+                    "The application is not able to keep up with the hardware acquisition. Attempted to read "
+                    "samples that are no longer available.",
+                    DAQmxErrors.SAMPLES_NO_LONGER_AVAILABLE, 0, task_name=task.name)
+            if acquired - self.curr_read_pos >= number_of_samples_per_channel:
+                break
+            if task._finished():
+                raise DaqReadError(
+                    "Attempted to read a sample beyond the final sample acquired.",
+                    DAQmxErrors.SAMPLES_WILL_NEVER_BE_AVAILABLE, 0, task_name=task.name)
+            if deadline is not None and time.perf_counter() > deadline:
+                raise DaqReadError(
+                    "Some or all of the samples requested have not yet been acquired.",
+                    DAQmxErrors.SAMPLES_NOT_YET_AVAILABLE, 0, task_name=task.name)
+            time.sleep(_WAIT_INTERVAL)
+
+        codes = task._generate(self.curr_read_pos, number_of_samples_per_channel)
+        if raw:
+            data[:, :number_of_samples_per_channel] = codes
+        else:
+            np.multiply(codes, LSB, out=data[:, :number_of_samples_per_channel])
+        self.curr_read_pos += number_of_samples_per_channel
+        return number_of_samples_per_channel
+
+
+class SimulatedTask:
+    """
+    Simulated analog input task, used in place of `nidaqmx.task.Task`.
+
+    Parameters
+    ----------
+    new_task_name : str, optional
+        Name of the task.
+    trigger_rate : float, optional
+        Number of reference triggers per second (Default: 1.0).
+    shared_start : multiprocessing.Value, optional
+        Start time (`time.perf_counter`) shared by the tasks of one synchronized acquisition, set by the task without
+        a start trigger and waited for by the others. A double initialized to 0.
+    clock_drift : float, optional
+        Deviation of the sample clock from the sampling rate in ppm, ignored if the sample clock is imported from
+        another device (Default: 0.0).
+
+    Example
+    -------
+    >>> task = SimulatedTask("AcquisitionTask")
+    >>> task.ai_channels.add_ai_voltage_chan("/Dev1/ai0")
+    >>> task.timing.cfg_samp_clk_timing(1000, sample_mode=AcquisitionType.CONTINUOUS)
+    >>> task.start()
+    """
+
+    def __init__(self, new_task_name: str = "", trigger_rate: float = 1.0, shared_start=None,
+                 clock_drift: float = 0.0):
+        self.name = new_task_name
+        self.trigger_rate = trigger_rate
+        self.clock_drift = clock_drift
+        self._shared_start = shared_start
+        self.ai_channels = SimulatedChannelCollection()
+        self.timing = SimulatedTiming()
+        self.triggers = SimulatedTriggers(self)
+        self.in_stream = SimulatedInStream(self)
+        self._running = False
+        self._start_time = None
+        self._start_wall_time = None
+        self._every_n_samples = None
+        self._event_thread = None
+        # trigger sample index (relative to the start) of every record of a reference triggered acquisition
+        self._record_triggers = []
+        self._completed_records = 0
+        # the event thread and the reading thread both advance the records
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ nidaqmx.Task interface
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        if self._running:
+            raise DaqError("Events have to be registered before the task is started.",
+                           DAQmxErrors.INVALID_ATTRIBUTE_VALUE, task_name=self.name)
+        self._every_n_samples = None if callback_method is None else (sample_interval, callback_method)
+
+    def start(self):
+        self._running = True
+        if self.triggers.start_trigger.trigger_source is None:
+            self._start_wall_time = time.time()
+            self._start_time = time.perf_counter()
+            if self._shared_start is not None:
+                self._shared_start.value = self._start_time
+        if self._every_n_samples is not None:
+            self._event_thread = threading.Thread(target=self._fire_events, daemon=True)
+            self._event_thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        self._running = False
+        if self._event_thread is not None and self._event_thread is not threading.current_thread():
+            self._event_thread.join()
+            self._event_thread = None
+
+    def is_task_done(self) -> bool:
+        return self._finished()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------ simulation
+
+    @property
+    def _triggered(self) -> bool:
+        return self.triggers.reference_trigger.trigger_source is not None
+
+    def _started(self) -> bool:
+        """True once the acquisition started, for a task with start trigger after the start of the other task."""
+        if self._start_time is None and self._running and self._shared_start is not None \
+                and self._shared_start.value:
+            self._start_time = self._shared_start.value
+            self._start_wall_time = time.time() - (time.perf_counter() - self._start_time)
+        return self._start_time is not None
+
+    def _elapsed_samples(self) -> float:
+        rate = self.timing.samp_clk_rate
+        if not self.timing.samp_clk_src:
+            rate *= 1 + self.clock_drift * 1e-6
+        return (time.perf_counter() - self._start_time) * rate
+
+    def _acquired(self) -> int:
+        """Number of samples per channel acquired into the buffer since the start of the task."""
+        if not self._started():
+            return 0
+        elapsed = self._elapsed_samples()
+        record_length = self.timing.samp_quant_samp_per_chan
+        if self.timing.samp_quant_samp_mode == AcquisitionType.CONTINUOUS:
+            return int(elapsed)
+        if not self._triggered:
+            return min(int(elapsed), record_length)
+
+        with self._lock:
+            return self._acquired_records(elapsed, record_length)
+
+    def _acquired_records(self, elapsed: float, record_length: int) -> int:
+        reference_trigger = self.triggers.reference_trigger
+        pretrigger = reference_trigger.pretrig_samples
+        # time only moves forward, so records completed before stay completed
+        while True:
+            if self._completed_records == len(self._record_triggers):
+                self._record_triggers.append(self._next_trigger(self._completed_records))
+            trigger = self._record_triggers[self._completed_records]
+            if elapsed < trigger:
+                return self._completed_records * record_length
+            in_record = min(record_length, pretrigger + int(elapsed - trigger))
+            if in_record < record_length or not reference_trigger.retriggerable:
+                return self._completed_records * record_length + in_record
+            self._completed_records += 1
+
+    def _next_trigger(self, record: int) -> float:
+        """Trigger sample index of `record`, triggers during the previous record and its pretrigger are ignored."""
+        rate = self.timing.samp_clk_rate
+        pretrigger = self.triggers.reference_trigger.pretrig_samples
+        if record == 0:
+            return float(pretrigger)
+        previous_end = self._record_triggers[-1] + self.timing.samp_quant_samp_per_chan - pretrigger
+        earliest = previous_end + pretrigger
+        # triggers arrive periodically, the first one right after the first pretrigger phase
+        period = rate / self.trigger_rate
+        return pretrigger + math.ceil((earliest - pretrigger) / period) * period
+
+    def _last_trigger_time(self) -> datetime.datetime:
+        """Wall clock time of the most recent reference trigger, the start of the task if none occurred yet."""
+        if not self._started():
+            raise DaqError("Simulated task has not been started.", DAQmxErrors.INVALID_TASK, task_name=self.name)
+        elapsed = self._elapsed_samples()
+        with self._lock:
+            self._acquired_records(elapsed, self.timing.samp_quant_samp_per_chan)
+            # only the trigger of the next record can lie in the future
+            latest = next((trigger for trigger in reversed(self._record_triggers) if trigger <= elapsed), 0.0)
+        offset = latest / self.timing.samp_clk_rate
+        return datetime.datetime.fromtimestamp(self._start_wall_time + offset)
+
+    def _finished(self) -> bool:
+        if self.timing.samp_quant_samp_mode == AcquisitionType.CONTINUOUS:
+            return not self._running
+        if self._triggered and self.triggers.reference_trigger.retriggerable:
+            return not self._running
+        return self._acquired() >= self.timing.samp_quant_samp_per_chan or not self._running
+
+    def _generate(self, first_sample: int, number_of_samples: int) -> np.ndarray:
+        """ADC codes of shape (channels, number_of_samples) starting at position `first_sample` of the buffer."""
+        positions = np.arange(first_sample, first_sample + number_of_samples)
+        if self._triggered:
+            # map buffer positions to the time of the samples inside their record
+            record_length = self.timing.samp_quant_samp_per_chan
+            pretrigger = self.triggers.reference_trigger.pretrig_samples
+            records = positions // record_length
+            first_record = int(records[0])
+            triggers = np.asarray(self._record_triggers[first_record:int(records[-1]) + 1],
+                                  dtype=np.float64)[records - first_record]
+            positions = np.floor(triggers) - pretrigger + positions % record_length
+        codes = np.empty((len(self.ai_channels), number_of_samples), dtype=np.int16)
+        for i, channel in enumerate(self.ai_channels):
+            volts = channel.amplitude * np.sin(positions * (2 * np.pi / channel.period))
+            codes[i] = np.round(volts / LSB)
+        return codes
+
+    def _fire_events(self):
+        interval, callback = self._every_n_samples
+        fired = 0
+        while self._running:
+            acquired = self._acquired()
+            while (fired + 1) * interval <= acquired:
+                fired += 1
+                callback(0, 1, interval, None)
+            time.sleep(max(_WAIT_INTERVAL, interval / self.timing.samp_clk_rate / 2))
+
+
+class AnalogMultiChannelReader:
+    """Counterpart of `nidaqmx.stream_readers.AnalogMultiChannelReader` for simulated tasks."""
+
+    def __init__(self, task_in_stream: SimulatedInStream):
+        self._in_stream = task_in_stream
+
+    def read_many_sample(self, data, number_of_samples_per_channel=READ_ALL_AVAILABLE, timeout=10.0):
+        return self._in_stream._read(data, number_of_samples_per_channel, timeout, raw=False)
+
+
+class AnalogUnscaledReader:
+    """Counterpart of `nidaqmx.stream_readers.AnalogUnscaledReader` for simulated tasks."""
+
+    def __init__(self, task_in_stream: SimulatedInStream):
+        self._in_stream = task_in_stream
+
+    def read_int16(self, data, number_of_samples_per_channel=READ_ALL_AVAILABLE, timeout=10.0):
+        return self._in_stream._read(data, number_of_samples_per_channel, timeout, raw=True)
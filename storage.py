@@ -0,0 +1,499 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# number of significant digits written to csv files, timestamps need more digits than the samples to stay
+# unambiguous over long recordings at high sampling rates (e.g. 1 MHz over several days)
+TIME_FORMAT = "%.12g"
+VALUE_FORMAT = "%.10g"
+LINE_TERMINATOR = "\r\n"
+# file extension of each output format, binary recordings are directories containing a json header and one
+# .npy file per channel
+EXTENSIONS = {"csv": ".csv", "npy": ".rec"}
+HEADER_FILE = "header.json"
+# columns of an event index, see `EventIndexWriter`
+EVENT_FILE = "events.npy"
+EVENT_TIME, EVENT_OFFSET, EVENT_LENGTH = 0, 1, 2
+# fixed size of the .npy headers written by NpyAppender, leaves enough room to rewrite the shape in place
+_NPY_HEADER_SIZE = 128
+
+
+def sample_times(first_sample: int, n_samples: int, sampling_rate: float) -> np.ndarray:
+    """
+    Timestamps in seconds of `n_samples` consecutive samples starting at sample index `first_sample`.
+
+    Every timestamp is computed from its absolute sample index, so no rounding error accumulates over long runs.
+    """
+    return (first_sample + np.arange(n_samples, dtype=np.float64)) / sampling_rate
+
+
+def format_csv_block(data: np.ndarray, first_sample: int, sampling_rate: float,
+                     value_format: str = VALUE_FORMAT) -> str:
+    """
+    Format a block of samples as csv rows in a single batch.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Samples of shape `(n_channels, n_samples)`.
+    first_sample : int
+        Index of the first sample of the block, used to compute the time column.
+    sampling_rate : float
+        Sampling rate in Hz.
+    value_format : str, optional
+        printf style format of a single sample (Default: VALUE_FORMAT).
+
+    Returns
+    -------
+    str
+        One line per sample, containing the timestamp followed by the value of each channel.
+
+    Example
+    -------
+    >>> format_csv_block(np.array([[1.5, 2.5], [3.0, 4.0]]), 0, 1000)
+    '0,1.5,3\\r\\n0.001,2.5,4\\r\\n'
+    """
+    n_channels, n_samples = data.shape
+    rows = np.empty((n_samples, n_channels + 1), dtype=np.float64)
+    rows[:, 0] = sample_times(first_sample, n_samples, sampling_rate)
+    rows[:, 1:] = data.T
+    row_format = ",".join([TIME_FORMAT] + [value_format] * n_channels) + LINE_TERMINATOR
+    # a single formatting operation for the whole block instead of one csv.writerow call per sample
+    return (row_format * n_samples) % tuple(rows.ravel().tolist())
+
+
+def recording_metadata(channels: list, sampling_rate: float, start_time: str = None, trigger: dict = None,
+                       dtype=np.float64, scaling: dict = None, first_sample: int = 0) -> dict:
+    """
+    Metadata describing a recording, stored as json header of binary recordings and as json sidecar of csv files.
+
+    Parameters
+    ----------
+    channels : list
+        Names of the recorded channels.
+    sampling_rate : float
+        Sampling rate in Hz.
+    start_time : str, optional
+        Start of the acquisition as ISO 8601 timestamp.
+    trigger : dict, optional
+        Trigger settings (channel, slope, level, pretrigger_samples), None for continuous acquisitions.
+    dtype : numpy.dtype, optional
+        Data type of the stored samples (Default: float64).
+    scaling : dict, optional
+        Polynomial coefficients (constant term first) per channel converting stored raw ADC codes to volts, None if
+        the samples are stored in volts.
+    first_sample : int, optional
+        Sample index of the first stored sample, e.g. for segments of a longer recording (Default: 0).
+    """
+    return {
+        "channels": list(channels),
+        "sampling_rate": sampling_rate,
+        "start_time": start_time,
+        "trigger": trigger,
+        "dtype": np.dtype(dtype).str,
+        "scaling": scaling,
+        "first_sample": first_sample,
+        "n_samples": 0,
+    }
+
+
+def metadata_path(path: str) -> str:
+    """Path of the json metadata of the csv file or binary recording at `path`."""
+    if path.endswith(EXTENSIONS["npy"]):
+        return os.path.join(path, HEADER_FILE)
+    return os.path.splitext(path)[0] + ".json"
+
+
+def read_metadata(path: str):
+    """Metadata of the csv file or binary recording at `path`, None for csv files written without metadata."""
+    try:
+        with open(metadata_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_metadata(path: str, metadata: dict):
+    with open(metadata_path(path), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def apply_scaling(samples: np.ndarray, coefficients: list) -> np.ndarray:
+    """
+    Convert raw ADC codes to volts using the device scaling polynomial of the channel.
+
+    Parameters
+    ----------
+    samples : numpy.ndarray
+        Raw ADC codes.
+    coefficients : list
+        Polynomial coefficients, constant term first, as reported by the `ai_dev_scaling_coeff` channel property.
+
+    Example
+    -------
+    >>> apply_scaling(np.array([0, 100], dtype=np.int16), [0.01, 0.001])
+    array([0.01, 0.11])
+    """
+    return np.polynomial.polynomial.polyval(samples.astype(np.float64), coefficients)
+
+
+def _npy_header(dtype: np.dtype, shape: tuple) -> bytes:
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    prefix = np.lib.format.MAGIC_PREFIX + bytes([1, 0])
+    padding = _NPY_HEADER_SIZE - len(prefix) - 2 - len(header) - 1
+    return prefix + struct.pack("<H", len(header) + padding + 1) + header.encode("latin1") + b" " * padding + b"\n"
+
+
+def channel_file_name(channel: str) -> str:
+    """Name of the .npy file holding the samples of `channel` inside a binary recording."""
+    return channel.replace("/", "_") + ".npy"
+
+
+class NpyAppender:
+    """
+    A .npy file that grows along its first axis while rows are appended.
+
+    The header reserves a fixed amount of space, so the final shape can be written in place once the file is
+    closed. Until then the number of rows can be derived from the file size, see `read_npy`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .npy file, an existing file is overwritten.
+    dtype : numpy.dtype
+        Data type of the stored values.
+    row_shape : tuple, optional
+        Shape of a single row, empty for one dimensional arrays (Default: ()).
+    """
+
+    def __init__(self, path: str, dtype, row_shape: tuple = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.n_rows = 0
+        self._file = open(path, "wb")
+        self._file.write(_npy_header(self.dtype, (0, *self.row_shape)))
+        self._file.flush()
+
+    def append(self, rows: np.ndarray):
+        """Append rows of shape `(n, *row_shape)` (or a single row) to the end of the file."""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self._file.write(memoryview(rows).cast("B"))
+        self.n_rows += rows.size // max(1, int(np.prod(self.row_shape)))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, (self.n_rows, *self.row_shape)))
+        self._file.close()
+
+
+def read_npy(path: str) -> np.ndarray:
+    """
+    Memory map a .npy file written by `NpyAppender`.
+
+    The number of rows is derived from the file size, so files which are still being written or were not closed
+    properly can be read as well.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+            else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    row_shape = shape[1:]
+    row_bytes = dtype.itemsize * int(np.prod(row_shape))
+    n_rows = (os.path.getsize(path) - offset) // row_bytes
+    if n_rows == 0:
+        return np.empty((0, *row_shape), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_rows, *row_shape))
+
+
+class CsvEncoder:
+    """
+    Turns blocks of samples into the payload written by `CsvWriter.write`.
+
+    The encoder holds no file, so it can be sent to other processes encoding blocks in parallel, see
+    `encoder_pool.EncoderPool`.
+    """
+
+    def __init__(self, sampling_rate: float, value_format: str):
+        self.sampling_rate = sampling_rate
+        self.value_format = value_format
+
+    def __call__(self, data: np.ndarray, first_sample: int):
+        return first_sample, first_sample + data.shape[1], \
+            format_csv_block(data, first_sample, self.sampling_rate, self.value_format).encode("ascii")
+
+
+class CsvWriter:
+    """
+    Writes blocks of samples to a csv file with a time column followed by one column per channel.
+
+    The metadata of the recording is stored in a json file next to the csv file (see `metadata_path`), raw ADC codes
+    are written as integers.
+
+    Parameters
+    ----------
+    path : str
+        Path of the csv file, an existing file is overwritten.
+    metadata : dict
+        Description of the recording, see `recording_metadata`.
+
+    Example
+    -------
+    >>> writer = CsvWriter("data/measurements.csv", recording_metadata(["ai0", "ai1"], 1000))
+    >>> writer.write_block(np.zeros((2, 100)), first_sample=0)
+    >>> writer.close()
+    """
+
+    def __init__(self, path: str, metadata: dict):
+        self.path = path
+        self.metadata = metadata
+        self.sampling_rate = metadata["sampling_rate"]
+        self.value_format = "%d" if np.dtype(metadata["dtype"]).kind == "i" else VALUE_FORMAT
+        self.encoder = CsvEncoder(self.sampling_rate, self.value_format)
+        self._file = open(path, "wb")
+        header = (",".join(["time", *metadata["channels"]]) + LINE_TERMINATOR).encode("ascii")
+        self._file.write(header)
+        self.bytes_written = len(header)
+        self._n_samples = 0
+        write_metadata(path, metadata)
+
+    def update_metadata(self, **fields):
+        """Update the metadata of the recording and rewrite the json sidecar."""
+        self.metadata.update(fields)
+        write_metadata(self.path, self.metadata)
+
+    def encode(self, data: np.ndarray, first_sample: int):
+        """Turn a block of shape `(n_channels, n_samples)` into the payload passed to `write`, i.e. csv text."""
+        return self.encoder(data, first_sample)
+
+    def write(self, payload) -> int:
+        """Append an encoded block and return the number of bytes written."""
+        _, end_sample, text = payload
+        self._file.write(text)
+        self._n_samples = end_sample - self.metadata.get("first_sample", 0)
+        self.bytes_written += len(text)
+        return len(text)
+
+    def write_block(self, data: np.ndarray, first_sample: int) -> int:
+        """Append a block of shape `(n_channels, n_samples)` starting at sample index `first_sample`."""
+        return self.write(self.encode(data, first_sample))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        self.metadata["n_samples"] = self._n_samples
+        write_metadata(self.path, self.metadata)
+
+
+class NpyWriter:
+    """
+    Writes blocks of samples to a binary recording.
+
+    A binary recording is a directory containing the json header `header.json` (see `recording_metadata`) and one
+    .npy file per channel holding its raw samples. The time axis is not stored, it follows from the sampling
+    rate. Every channel can be memory mapped independently, see `Recording`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording directory, existing channel files are overwritten.
+    metadata : dict
+        Description of the recording, see `recording_metadata`.
+
+    Example
+    -------
+    >>> writer = NpyWriter("data/measurements.rec", recording_metadata(["ai0", "ai1"], 1000))
+    >>> writer.write_block(np.zeros((2, 100)), first_sample=0)
+    >>> writer.close()
+    """
+
+    def __init__(self, path: str, metadata: dict):
+        self.path = path
+        self.metadata = metadata
+        os.makedirs(path, exist_ok=True)
+        self._channel_files = [NpyAppender(os.path.join(path, channel_file_name(channel)), metadata["dtype"])
+                               for channel in metadata["channels"]]
+        self.bytes_written = 0
+        # blocks are stored as they are, there is nothing to encode in parallel
+        self.encoder = None
+        write_metadata(path, metadata)
+
+    def update_metadata(self, **fields):
+        """Update the metadata of the recording and rewrite the json header."""
+        self.metadata.update(fields)
+        write_metadata(self.path, self.metadata)
+
+    def encode(self, data: np.ndarray, first_sample: int):
+        """Binary recordings store the samples as they are, the payload is the block itself."""
+        return data, first_sample
+
+    def write(self, payload) -> int:
+        """Append a block passed through `encode` and return the number of bytes written."""
+        data, first_sample = payload
+        written = 0
+        gap = first_sample - self.metadata.get("first_sample", 0) - self._channel_files[0].n_rows
+        for channel_file, samples in zip(self._channel_files, data):
+            if gap > 0:
+                # keep the sample index aligned with the position inside the file after dropped blocks
+                channel_file.append(np.full(gap, np.nan if channel_file.dtype.kind == "f" else 0,
+                                            dtype=channel_file.dtype))
+                written += gap * channel_file.dtype.itemsize
+            channel_file.append(samples)
+            written += samples.nbytes
+        self.bytes_written += written
+        return written
+
+    def write_block(self, data: np.ndarray, first_sample: int) -> int:
+        """Append a block of shape `(n_channels, n_samples)` starting at sample index `first_sample`."""
+        return self.write(self.encode(data, first_sample))
+
+    def flush(self):
+        for channel_file in self._channel_files:
+            channel_file.flush()
+
+    def close(self):
+        for channel_file in self._channel_files:
+            channel_file.close()
+        self.metadata["n_samples"] = self._channel_files[0].n_rows
+        write_metadata(self.path, self.metadata)
+
+
+WRITERS = {"csv": CsvWriter, "npy": NpyWriter}
+
+
+def storage_size(path: str) -> int:
+    """Size in bytes of a csv file or of all files of a binary recording."""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+
+def open_writer(file_format: str, path: str, metadata: dict):
+    """Create the writer of the given output format ('csv' or 'npy')."""
+    return WRITERS[file_format](path, metadata)
+
+
+def events_path(path: str) -> str:
+    """
+    Path of the event index of the recording at `path`.
+
+    Binary recordings hold it as `events.npy` inside of their directory, csv files and segmented recordings next to
+    them, e.g. 'data/measurements.events.npy'.
+    """
+    if os.path.isdir(path):
+        return os.path.join(path, EVENT_FILE)
+    return os.path.splitext(path)[0] + ".events.npy"
+
+
+class EventIndexWriter:
+    """
+    Index of the triggered records appended to a single recording.
+
+    Every row of the int64 .npy file (see `NpyAppender`) describes one record: the trigger time in ns since the
+    epoch (`EVENT_TIME`), the sample index of its first sample inside the recording (`EVENT_OFFSET`) and its number
+    of samples per channel (`EVENT_LENGTH`). The trigger itself is located `pretrigger_samples` after the offset,
+    see the trigger settings in the metadata of the recording.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording the records are written to, see `events_path`.
+
+    Example
+    -------
+    >>> events = EventIndexWriter("data/measurements.rec")
+    >>> events.append(trigger_time_ns=1700000000000000000, offset=0, length=1002)
+    >>> events.close()
+    """
+
+    def __init__(self, path: str):
+        self._file = NpyAppender(events_path(path), np.int64, row_shape=(3,))
+
+    @property
+    def n_events(self) -> int:
+        return self._file.n_rows
+
+    def append(self, trigger_time_ns: int, offset: int, length: int):
+        self._file.append(np.array([trigger_time_ns, offset, length], dtype=np.int64))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_events(path: str) -> np.ndarray:
+    """Event index of shape `(n_events, 3)` of the recording at `path`, see `EventIndexWriter`."""
+    return read_npy(events_path(path))
+
+
+class Recording:
+    """
+    Read access to a binary recording written by `NpyWriter`.
+
+    The samples of every channel are memory mapped, so opening a recording does not read any sample data.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording directory.
+
+    Example
+    -------
+    >>> recording = Recording("data/measurements.rec")
+    >>> recording.channels
+    ['ai0', 'ai1']
+    >>> ai0 = recording.values("ai0")
+    >>> time = recording.time()
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.metadata = read_metadata(path)
+        self.channels = self.metadata["channels"]
+        self.sampling_rate = self.metadata["sampling_rate"]
+        self.scaling = self.metadata.get("scaling")
+        # segments of a longer recording start at a later sample
+        self.first_sample = self.metadata.get("first_sample", 0)
+        self.n_samples = 0
+        self.refresh()
+
+    def refresh(self):
+        """
+        Count the samples available for every channel again, e.g. of a recording which is still written.
+
+        `n_samples` is counted once when the recording is opened and on every refresh only, so accessing it does not
+        open the channel files.
+        """
+        self.n_samples = min((len(read_npy(os.path.join(self.path, channel_file_name(name))))
+                              for name in self.channels), default=0)
+
+    def channel(self, name: str) -> np.ndarray:
+        """Memory mapped samples of channel `name` as stored, i.e. raw ADC codes for raw recordings."""
+        return read_npy(os.path.join(self.path, channel_file_name(name)))[:self.n_samples]
+
+    def values(self, name: str, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Samples `start` to `stop` of channel `name` in volts.
+
+        Raw recordings are scaled on access, otherwise the memory mapped samples are returned without copy.
+        """
+        samples = self.channel(name)[start:stop]
+        if self.scaling is None:
+            return samples
+        return apply_scaling(samples, self.scaling[name])
+
+    def time(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Timestamps in seconds of the samples `start` to `stop`."""
+        stop = self.n_samples if stop is None else stop
+        return sample_times(self.first_sample + start, stop - start, self.sampling_rate)
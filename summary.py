@@ -0,0 +1,187 @@
+import os
+
+import numpy as np
+
+from storage import NpyWriter, apply_scaling, recording_metadata
+
+# statistics stored per channel and window, in this order
+STATISTICS = ["min", "max", "mean", "rms", "frequency"]
+# samples per Welch segment used to estimate the dominant frequency, the resolution is sampling_rate / SPECTRUM_SIZE
+SPECTRUM_SIZE = 4096
+
+
+def summary_path(path: str) -> str:
+    """
+    Path of the summary of the recording at `path`, e.g. 'data/measurements.summary.rec'.
+
+    Segmented recordings may be given by their index file, e.g. 'data/measurements.index.json'.
+    """
+    stem = path[:-len(".index.json")] if path.endswith(".index.json") else os.path.splitext(path)[0]
+    return stem + ".summary.rec"
+
+
+def summary_channel(channel: str, statistic: str) -> str:
+    """Name of the summary channel holding `statistic` of `channel`, e.g. 'ai0.rms'."""
+    return f"{channel}.{statistic}"
+
+
+def is_frequency_channel(channel: str) -> bool:
+    """True for summary channels holding the dominant frequency in Hz instead of a voltage."""
+    return channel.endswith(".frequency")
+
+
+def welch_spectrum(segments: np.ndarray) -> np.ndarray:
+    """
+    Summed power spectra of `segments` of shape `(n_channels, n_segments, segment_size)`.
+
+    Every segment is freed from its mean and weighted with a Hann window, the spectra of all segments of a channel
+    are added up, which is Welch's method without overlap and normalization. Returns an array of shape
+    `(n_channels, segment_size // 2 + 1)`.
+    """
+    segments = segments - segments.mean(axis=2, keepdims=True)
+    spectra = np.fft.rfft(segments * np.hanning(segments.shape[2]), axis=2)
+    return (spectra.real ** 2 + spectra.imag ** 2).sum(axis=1)
+
+
+class SummaryWriter:
+    """
+    Per-window statistics of every channel, computed while a recording is written.
+
+    The samples are split into windows of `window` seconds aligned to the sample index, so the windows of a
+    recording are the same no matter how the blocks were cut. Per window and channel the minimum, maximum, mean,
+    RMS and dominant frequency are stored, the latter being the maximum of the Welch power spectrum of all complete
+    segments of `SPECTRUM_SIZE` samples inside the window (or of the whole window if it is shorter), the DC component
+    excluded.
+
+    The summary is a binary recording of its own (see `storage.NpyWriter`) with one channel per statistic and
+    channel (see `summary_channel`) and a sampling rate of one sample per window, so the dashboard loads and plots a
+    day of summaries like any other recording. Window `i` starts at the time `i * window`. Windows without samples,
+    e.g. after dropped blocks, are stored as NaN. NaN samples, e.g. samples a device dropped while several devices are
+    merged, are left out of the statistics of their channel, as are the spectrum segments containing them.
+
+    Parameters
+    ----------
+    path : str
+        Path of the summary, see `summary_path`.
+    metadata : dict
+        Metadata of the summarized recording, see `storage.recording_metadata`. Raw ADC codes are converted to
+        volts with its scaling coefficients.
+    window : float
+        Length of a window in seconds.
+
+    Example
+    -------
+    >>> summary = SummaryWriter("data/measurements.summary.rec", recording_metadata(["ai0"], 100000), window=1.0)
+    >>> summary.add(np.zeros((1, 5000)), first_sample=0)
+    >>> summary.close()
+    """
+
+    def __init__(self, path: str, metadata: dict, window: float):
+        self.channels = metadata["channels"]
+        self.sampling_rate = metadata["sampling_rate"]
+        self.scaling = metadata.get("scaling")
+        self.window_samples = max(1, round(window * self.sampling_rate))
+        self.spectrum_size = min(SPECTRUM_SIZE, self.window_samples)
+        summary_metadata = recording_metadata(
+            [summary_channel(channel, statistic) for channel in self.channels for statistic in STATISTICS],
+            self.sampling_rate / self.window_samples,
+            start_time=metadata.get("start_time"))
+        summary_metadata["summary"] = {"window": self.window_samples / self.sampling_rate,
+                                       "spectrum_size": self.spectrum_size,
+                                       "statistics": STATISTICS}
+        self._writer = NpyWriter(path, summary_metadata)
+        self.path = path
+        self._window = None
+        self._next_sample = None
+
+    @property
+    def metadata(self) -> dict:
+        return self._writer.metadata
+
+    def update_metadata(self, **fields):
+        self._writer.update_metadata(**fields)
+
+    def _start_window(self, window: int):
+        n_channels = len(self.channels)
+        self._window = window
+        self._minimum = np.full(n_channels, np.inf)
+        self._maximum = np.full(n_channels, -np.inf)
+        self._total = np.zeros(n_channels)
+        self._squares = np.zeros(n_channels)
+        # finite samples and spectrum segments of every channel
+        self._count = np.zeros(n_channels, dtype=np.int64)
+        self._spectrum = np.zeros((n_channels, self.spectrum_size // 2 + 1))
+        self._segments = np.zeros(n_channels, dtype=np.int64)
+        self._carry = np.empty((n_channels, 0))
+
+    def _add_segments(self, segments: np.ndarray):
+        # segments containing NaN are left out of the spectrum of their channel, the others are not affected
+        valid = np.isfinite(segments).all(axis=2)
+        self._spectrum += welch_spectrum(np.where(valid[:, :, np.newaxis], segments, 0.0))
+        self._segments += valid.sum(axis=1)
+
+    def _add_spectrum(self, values: np.ndarray):
+        # samples left over from the previous block are completed to a segment first
+        if self._carry.shape[1]:
+            missing = self.spectrum_size - self._carry.shape[1]
+            self._carry = np.concatenate([self._carry, values[:, :missing]], axis=1)
+            values = values[:, missing:]
+            if self._carry.shape[1] < self.spectrum_size:
+                return
+            self._add_segments(self._carry[:, np.newaxis])
+        n_segments = values.shape[1] // self.spectrum_size
+        if n_segments:
+            segments = values[:, :n_segments * self.spectrum_size].reshape(len(self.channels), n_segments, -1)
+            self._add_segments(segments)
+        self._carry = values[:, n_segments * self.spectrum_size:].copy()
+
+    def _emit(self):
+        frequency = np.full(len(self.channels), np.nan)
+        if self.spectrum_size > 1:
+            peaks = (np.argmax(self._spectrum[:, 1:], axis=1) + 1) * self.sampling_rate / self.spectrum_size
+            frequency = np.where(self._segments > 0, peaks, np.nan)
+        # channels without a single finite sample in the window are stored as NaN
+        with np.errstate(invalid="ignore", divide="ignore"):
+            statistics = np.column_stack([self._minimum, self._maximum, self._total / self._count,
+                                          np.sqrt(self._squares / self._count), frequency])
+        statistics[self._count == 0, :] = np.nan
+        self._writer.write_block(statistics.reshape(-1, 1), first_sample=self._window)
+
+    def add(self, data: np.ndarray, first_sample: int):
+        """Add a block of shape `(n_channels, n_samples)` starting at sample index `first_sample`."""
+        values = data.astype(np.float64, copy=False) if not self.scaling else \
+            np.array([apply_scaling(samples, self.scaling[channel]) for channel, samples in zip(self.channels, data)])
+        if first_sample != self._next_sample:
+            # samples were dropped, the spectrum must not continue across the gap
+            self._carry = np.empty((len(self.channels), 0))
+        position = 0
+        sample = first_sample
+        while position < values.shape[1]:
+            window = sample // self.window_samples
+            if window != self._window:
+                if self._window is not None:
+                    self._emit()
+                self._start_window(window)
+            stop = min(values.shape[1], position + (window + 1) * self.window_samples - sample)
+            part = values[:, position:stop]
+            # fmin and fmax ignore NaN like nanmin and nanmax, without warning about channels which are all NaN
+            np.fmin(self._minimum, np.fmin.reduce(part, axis=1), out=self._minimum)
+            np.fmax(self._maximum, np.fmax.reduce(part, axis=1), out=self._maximum)
+            finite = np.isfinite(part)
+            finite_part = np.where(finite, part, 0.0)
+            self._total += finite_part.sum(axis=1)
+            self._squares += np.einsum("ij,ij->i", finite_part, finite_part)
+            self._count += finite.sum(axis=1)
+            self._add_spectrum(part)
+            sample += stop - position
+            position = stop
+        self._next_sample = sample
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        """Store the last, possibly incomplete window and close the summary."""
+        if self._window is not None:
+            self._emit()
+        self._writer.close()
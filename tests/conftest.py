@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules of the data reader live in the repository root, those of the dashboard in dashboard/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in [ROOT, os.path.join(ROOT, "dashboard")]:
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+import convert
+from catalog import Catalog, find_recordings
+from segments import SegmentedWriter
+from storage import CsvWriter, NpyWriter, recording_metadata
+
+SAMPLING_RATE = 1000
+
+
+def _write_segmented(path: str, file_format: str, n_samples: int, compress: bool = False):
+    writer = SegmentedWriter(file_format, path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE),
+                             max_duration=2.0, compress=compress)
+    for first_sample in range(0, n_samples, 500):
+        writer.write_block(np.zeros((2, 500)), first_sample)
+    writer.close()
+
+
+@pytest.fixture
+def directory(tmp_path):
+    _write_segmented(str(tmp_path / "run.csv"), "csv", 5000, compress=True)
+    _write_segmented(str(tmp_path / "binary.rec"), "npy", 3000)
+    # a recording of its own, named like a segment of another recording
+    writer = CsvWriter(str(tmp_path / "single_0001.csv"), recording_metadata(["ai0"], SAMPLING_RATE))
+    writer.write_block(np.zeros((1, 100)), first_sample=0)
+    writer.close()
+    writer = NpyWriter(str(tmp_path / "other.rec"), recording_metadata(["ai0"], SAMPLING_RATE))
+    writer.write_block(np.zeros((1, 100)), first_sample=0)
+    writer.close()
+    return str(tmp_path)
+
+
+def test_segments_are_one_entry(directory):
+    assert sorted(os.path.basename(path) for path in find_recordings(directory)) == \
+        ["binary.index.json", "other.rec", "run.index.json", "single_0001.csv"]
+
+    catalog = Catalog(directory)
+    catalog.refresh()
+    entries = {entry["name"]: entry for entry in catalog.entries}
+
+    run = entries["run.index.json"]
+    assert run["format"] == "csv"
+    assert run["channels"] == ["ai0", "ai1"]
+    assert run["sampling_rate"] == SAMPLING_RATE
+    assert run["n_samples"] == 5000
+    assert run["duration"] == 5.0
+    assert run["segments"] == 3
+    assert run["size"] == sum(os.path.getsize(os.path.join(directory, f"run_{i:04d}.csv.gz")) for i in range(3))
+    binary = entries["binary.index.json"]
+    assert (binary["format"], binary["n_samples"], binary["segments"]) == ("npy", 3000, 2)
+    assert catalog.search(min_duration=4.0) == [run]
+    # unchanged segmented recordings are not described again
+    assert catalog.refresh() == 0
+
+
+def test_segments_are_not_converted(directory):
+    tasks, converted = convert.find_csv_files(directory)
+    assert [os.path.basename(path) for path, _ in tasks] == ["single_0001.csv"]
+    assert converted == []
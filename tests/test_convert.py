@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+import convert
+from catalog import Catalog
+from pyramid import Pyramid, pyramid_path
+from storage import CsvWriter, Recording, read_metadata, recording_metadata
+
+
+def _write_csv(path: str, n_samples: int, seed: int):
+    writer = CsvWriter(path, recording_metadata(["ai0", "ai1"], 1000))
+    rng = np.random.default_rng(seed)
+    writer.write_block(rng.standard_normal((2, n_samples)), first_sample=0)
+    # a dropped block, filled with NaN by the conversion
+    writer.write_block(rng.standard_normal((2, 100)), first_sample=n_samples + 50)
+    writer.close()
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for i in range(3):
+        _write_csv(str(tmp_path / f"run{i}.csv"), 5000 + i, seed=i)
+    return str(tmp_path)
+
+
+def _convert_all(directory: str) -> list:
+    tasks, converted = convert.find_csv_files(directory)
+    return [convert.convert_file(path, destination) for path, destination in tasks], converted
+
+
+def test_interrupted_conversion_is_resumed(directory, monkeypatch):
+    build_pyramid = convert.build_pyramid
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        calls.append(args[0])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return build_pyramid(*args, **kwargs)
+
+    monkeypatch.setattr(convert, "build_pyramid", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _convert_all(directory)
+    # a worker killed in the middle of a conversion leaves its temporary recording behind
+    os.makedirs(os.path.join(directory, convert.TEMPORARY_PREFIX + "run2.rec"))
+    assert os.path.isdir(os.path.join(directory, "run0.rec"))
+    assert not os.path.exists(os.path.join(directory, "run1.rec"))
+    monkeypatch.setattr(convert, "build_pyramid", build_pyramid)
+
+    results, converted = _convert_all(directory)
+
+    assert converted == [os.path.join(directory, "run0.csv")]
+    assert [result["n_samples"] for result in results] == [5151, 5152]
+    assert all(result["missing_samples"] == 50 for result in results)
+    assert not [entry for entry in os.listdir(directory) if entry.startswith(".")]
+    assert convert.find_csv_files(directory)[0] == []
+    for i in range(3):
+        path = os.path.join(directory, f"run{i}.rec")
+        recording = Recording(path)
+        csv = np.loadtxt(os.path.join(directory, f"run{i}.csv"), delimiter=",", skiprows=1)
+        np.testing.assert_array_equal(recording.values("ai1")[:5000 + i], csv[:5000 + i, 2])
+        assert np.isnan(recording.values("ai1")[5000 + i:5050 + i]).all()
+        np.testing.assert_array_equal(recording.values("ai1")[5050 + i:], csv[5000 + i:, 2])
+        assert read_metadata(path)[convert.SOURCE_FIELD]["file"] == f"run{i}.csv"
+        assert os.path.isdir(pyramid_path(path))
+
+
+def test_changed_csv_is_converted_again(directory):
+    _convert_all(directory)
+    _write_csv(os.path.join(directory, "run1.csv"), 6000, seed=5)
+    tasks, converted = convert.find_csv_files(directory)
+    assert [os.path.basename(path) for path, _ in tasks] == ["run1.csv"]
+
+
+def test_corrupted_recording_is_rejected(directory, monkeypatch):
+    read = convert._ChecksumReader.__call__
+
+    def corrupted(self, channel, start, stop):
+        samples = read(self, channel, start, stop)
+        self.checksums[channel] ^= 1
+        return samples
+
+    monkeypatch.setattr(convert._ChecksumReader, "__call__", corrupted)
+    path = os.path.join(directory, "run0.csv")
+    with pytest.raises(ValueError, match="checksum"):
+        convert.convert_file(path, os.path.join(directory, "run0.rec"))
+    assert not os.path.exists(os.path.join(directory, "run0.rec"))
+    assert not os.path.exists(pyramid_path(os.path.join(directory, "run0.rec")))
+
+
+def test_converted_recordings_are_cataloged(directory):
+    _convert_all(directory)
+    catalog = Catalog(directory)
+    catalog.refresh()
+    entries = {entry["name"]: entry for entry in catalog.entries}
+    assert entries["run0.rec"]["n_samples"] == entries["run0.csv"]["n_samples"] == 5150
+    assert Pyramid.open(pyramid_path(os.path.join(directory, "run0.rec")),
+                        entries["run0.rec"]["state"]) is not None
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from data_reader import AdaptiveBlockSize, create_ring_buffer, create_task, main_data_loop, parser
+
+SAMPLING_RATE = 20000
+
+
+def test_block_size_adapts_between_latency_and_maximum():
+    sizer = AdaptiveBlockSize(SAMPLING_RATE, latency=0.05, maximum=8000)
+    assert sizer.minimum == sizer.size == 1000
+    # reads taking longer than a tenth of their block merge blocks
+    for expected in [2000, 4000, 8000, 8000]:
+        sizer.update(read_duration=1.0, number_of_samples=sizer.size)
+        assert sizer.size == expected
+    for expected in [4000, 2000, 1000, 1000]:
+        sizer.update(read_duration=0.0, number_of_samples=sizer.size)
+        assert sizer.size == expected
+    assert AdaptiveBlockSize(SAMPLING_RATE, latency=1.0, maximum=8000).minimum == 8000
+    assert AdaptiveBlockSize(10, latency=0.01, maximum=8000).minimum == 1
+
+
+@pytest.mark.parametrize("read_mode", ["poll", "event"])
+def test_reads_wait_for_the_block_size(read_mode):
+    args = parser.parse_args(["-b", "simulated", "-c", "ai0", "-sr", str(SAMPLING_RATE), "-rm", read_mode,
+                              "-lat", "0.05"])
+    ring = create_ring_buffer(args)
+    stop_event = threading.Event()
+    reader = threading.Thread(target=main_data_loop, args=(args, create_task(args), ring, stop_event))
+    reader.start()
+    sizes = []
+    try:
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            block = ring.get(timeout=0.1)
+            if block is not None:
+                sizes.append(block.data.shape[1])
+                ring.release()
+    finally:
+        stop_event.set()
+        reader.join()
+        overflows = ring.overflows
+        ring.unlink()
+
+    assert sizes and overflows == 0
+    # a poll without a fixed number of samples does not read every sample on its own
+    assert min(sizes) >= SAMPLING_RATE * 0.05
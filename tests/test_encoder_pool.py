@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+import pytest
+
+from encoder_pool import EncoderPool
+from ring_buffer import SharedRingBuffer
+
+
+class _SlowFirstEncoder:
+    """Encodes the first block slowest, so the workers finish out of order."""
+
+    def __call__(self, data: np.ndarray, first_sample: int):
+        if first_sample == 0:
+            time.sleep(0.5)
+        return first_sample, float(data.sum()), time.monotonic()
+
+
+class _FailingEncoder:
+    def __call__(self, data: np.ndarray, first_sample: int):
+        raise ValueError("cannot encode")
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(n_channels=2, block_size=10, n_blocks=8)
+    yield ring
+    ring.unlink()
+
+
+def _submit(ring, pool, n_blocks: int):
+    for i in range(n_blocks):
+        ring.reserve(10)[:] = i
+        ring.commit(first_sample=10 * i)
+        pool.submit(ring.get(timeout=1), ring.received - 1)
+
+
+def test_blocks_completed_in_submission_order(ring):
+    pool = EncoderPool(_SlowFirstEncoder(), ring, n_workers=2)
+    try:
+        _submit(ring, pool, 4)
+        results = []
+        deadline = time.monotonic() + 10
+        while len(results) < 4 and time.monotonic() < deadline:
+            for block, payload, encode_seconds in pool.completed(timeout=0.5):
+                results.append((block.first_sample, payload))
+                ring.release()
+    finally:
+        pool.close()
+    assert [first_sample for first_sample, _ in results] == [0, 10, 20, 30]
+    assert [payload[:2] for _, payload in results] == [(10 * i, 20.0 * i) for i in range(4)]
+    # the first block finished last, but was committed first
+    assert results[0][1][2] > results[1][1][2]
+    assert pool.in_flight == 0
+
+
+def test_encoder_errors_are_raised(ring):
+    pool = EncoderPool(_FailingEncoder(), ring, n_workers=1)
+    try:
+        _submit(ring, pool, 1)
+        with pytest.raises(ValueError, match="cannot encode"):
+            for _ in range(20):
+                pool.completed(timeout=0.5)
+    finally:
+        pool.close()
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from live import LiveTail, RollingBuffer
+from segments import SegmentedWriter, index_path
+from storage import CsvWriter, NpyWriter, recording_metadata
+
+SAMPLING_RATE = 1000
+BLOCK_SIZE = 100
+
+
+def _assert_window(tail, samples, end):
+    """The buffer of `tail` holds the samples of the window ending before sample `end`."""
+    tail.poll()
+    start = max(0, end - tail.buffer.capacity)
+    time, values = tail.buffer.since(0)
+    np.testing.assert_allclose(time, np.arange(start, end) / SAMPLING_RATE)
+    np.testing.assert_allclose(values, samples[:, start:end], rtol=1e-9)
+
+
+def test_rolling_buffer_keeps_the_last_samples():
+    buffer = RollingBuffer(2, capacity=100)
+    samples = np.arange(2 * 1000, dtype=float).reshape(2, 1000)
+    position = 0
+    for n in [30, 80, 1, 250, 99, 100, 40]:
+        buffer.extend(np.arange(position, position + n) / SAMPLING_RATE, samples[:, position:position + n])
+        position += n
+        assert buffer.end == position
+        assert buffer.start == max(0, position - 100)
+        time, values = buffer.since(0)
+        np.testing.assert_array_equal(values, samples[:, buffer.start:position])
+        np.testing.assert_array_equal(time, np.arange(buffer.start, position) / SAMPLING_RATE)
+    # samples newer than `index` only
+    time, values = buffer.since(position - 7)
+    np.testing.assert_array_equal(values, samples[:, position - 7:position])
+
+
+def _assert_tail(tail, samples):
+    """The buffer of `tail` holds the newest samples written, up to the length of its window."""
+    time, values = tail.buffer.since(0)
+    sample_index = np.rint(time * SAMPLING_RATE).astype(int)
+    assert len(time) == min(tail.buffer.capacity, sample_index[-1] + 1)
+    np.testing.assert_array_equal(sample_index, np.arange(sample_index[0], sample_index[-1] + 1))
+    np.testing.assert_allclose(values, samples[:, sample_index], rtol=1e-9)
+
+
+@pytest.mark.parametrize("file_format", ["csv", "npy"])
+def test_tail_of_growing_recording(tmp_path, file_format):
+    path = str(tmp_path / ("measurements.csv" if file_format == "csv" else "measurements.rec"))
+    samples = np.random.default_rng(1).standard_normal((2, 6000))
+    writer_class = CsvWriter if file_format == "csv" else NpyWriter
+    writer = writer_class(path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE))
+    # recorded before the tail starts, only the last window is read
+    writer.write_block(samples[:, :2500], 0)
+    writer.flush()
+
+    tail = LiveTail(path, window=1.0)
+    tail.poll()
+
+    assert (tail.channels, tail.sampling_rate) == (["ai0", "ai1"], SAMPLING_RATE)
+    _assert_tail(tail, samples)
+    assert tail.buffer.since(0)[0][-1] == 2.499
+    for end in [2600, 2601, 4000, 6000]:
+        start = int(np.rint(tail.buffer.since(0)[0][-1] * SAMPLING_RATE)) + 1
+        writer.write_block(samples[:, start:end], start)
+        writer.flush()
+        tail.poll()
+        _assert_tail(tail, samples)
+        assert tail.buffer.since(0)[0][-1] == (end - 1) / SAMPLING_RATE
+    writer.close()
+
+
+def test_csv_tail_skips_incomplete_lines(tmp_path):
+    path = str(tmp_path / "measurements.csv")
+    with open(path, "wb") as f:
+        f.write(b"time,ai0\n0,1.5\n0.001,2.5\n0.0")
+    tail = LiveTail(path, window=1.0)
+    tail.poll()
+    np.testing.assert_array_equal(tail.buffer.since(0)[1], [[1.5, 2.5]])
+    with open(path, "ab") as f:
+        f.write(b"02,3.5\n0.003,")
+    tail.poll()
+    np.testing.assert_array_equal(tail.buffer.since(0)[1], [[1.5, 2.5, 3.5]])
+
+
+def test_points_continue_seamlessly(tmp_path):
+    path = str(tmp_path / "measurements.rec")
+    samples = np.random.default_rng(2).standard_normal((1, 50000))
+    writer = NpyWriter(path, recording_metadata(["ai0"], SAMPLING_RATE))
+    writer.write_block(samples[:, :20000], 0)
+    writer.flush()
+    tail = LiveTail(path, window=10.0)
+    tail.poll()
+
+    fig, index = tail.figure()
+    assert len(fig.data[0].x) <= tail.max_points
+    writer.write_block(samples[:, 20000:23333], 20000)
+    writer.flush()
+    tail.poll()
+    x, ys, next_index = tail.points(index)
+
+    # only complete buckets are sent, each drawn by its minimum and maximum
+    assert (next_index - index) % tail.bucket_size == 0 and len(x) == 2 * (next_index - index) // tail.bucket_size
+    assert x[0] > fig.data[0].x[-1]
+    assert not tail.expired(next_index)
+    writer.write_block(samples[:, 23333:], 23333)
+    writer.flush()
+    tail.poll()
+    assert tail.expired(next_index)
+    writer.close()
+
+
+@pytest.mark.parametrize("file_format", ["csv", "npy"])
+def test_tail_follows_segment_rotation(tmp_path, file_format):
+    path = str(tmp_path / ("measurements.csv" if file_format == "csv" else "measurements.rec"))
+    samples = np.random.default_rng(0).standard_normal((2, 5000))
+    writer = SegmentedWriter(file_format, path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE), max_duration=1.0)
+    writer.write_block(samples[:, :BLOCK_SIZE], 0)
+    writer.flush()
+
+    tail = LiveTail(index_path(path), window=0.75)
+
+    assert tail.channels == ["ai0", "ai1"]
+    _assert_window(tail, samples, BLOCK_SIZE)
+    # several blocks between two polls, some of them starting new segments
+    for end in [700, 1200, 1300, 3600, 5000]:
+        for first_sample in range(tail.buffer.end, end, BLOCK_SIZE):
+            writer.write_block(samples[:, first_sample:first_sample + BLOCK_SIZE], first_sample)
+        writer.flush()
+        _assert_window(tail, samples, end)
+    writer.close()
+    assert tail._source._number == 4
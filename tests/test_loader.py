@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import loader
+import viewer
+from loader import Selection, load_csv, load_dataset, read_csv_window
+from pyramid import pyramid_path
+from storage import CsvWriter, NpyWriter, recording_metadata
+
+SAMPLING_RATE = 1000
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / "measurements.csv")
+    writer = CsvWriter(path, recording_metadata(["ai0", "ai1", "ai2"], SAMPLING_RATE))
+    rng = np.random.default_rng(0)
+    writer.write_block(rng.standard_normal((3, 15000)), first_sample=0)
+    # a dropped block leaves a gap of the time axis
+    writer.write_block(rng.standard_normal((3, 5000)), first_sample=17000)
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize("selection", [
+    Selection.of(["ai1"], 2.5, 7.25),
+    Selection.of(["ai2", "ai0"], None, 0.0),
+    Selection.of(None, 14.9995, 17.0005),
+    Selection.of(["ai1"], 21.5, None),
+    Selection.of(None, -5.0, 100.0),
+    Selection.of(["ai0"], 15.5, 16.5),
+    Selection.of(["ai0"], 50.0, 60.0),
+])
+def test_csv_window_matches_full_read(csv_path, selection):
+    full = pd.read_csv(csv_path)
+    start = -np.inf if selection.start is None else selection.start
+    stop = np.inf if selection.stop is None else selection.stop
+    expected = full[(full["time"] >= start) & (full["time"] <= stop)]
+
+    dataset = read_csv_window(csv_path, selection)
+
+    assert dataset.channels == selection.select(["ai0", "ai1", "ai2"])
+    np.testing.assert_array_equal(dataset.time(), expected["time"].to_numpy())
+    for channel in dataset.channels:
+        np.testing.assert_array_equal(dataset.values(channel), expected[channel].to_numpy())
+
+
+def test_csv_window_with_small_scan_range(csv_path, monkeypatch):
+    # forces the bisection down to single lines
+    monkeypatch.setattr(loader, "CSV_SCAN_BYTES", 16)
+    dataset = read_csv_window(csv_path, Selection.of(["ai0"], 3.0, 3.01))
+    np.testing.assert_allclose(dataset.time(), np.arange(3000, 3011) / SAMPLING_RATE)
+
+
+def test_csv_window_matches_binary_copy(csv_path):
+    selection = Selection.of(["ai1"], 12.0, 18.0)
+    window = read_csv_window(csv_path, selection)
+    load_csv(csv_path)
+    cached = load_csv(csv_path, selection)
+    np.testing.assert_array_equal(window.time(), cached.time())
+    np.testing.assert_array_equal(window.values("ai1"), cached.values("ai1"))
+
+
+@pytest.fixture
+def recording_path(tmp_path):
+    """A binary recording of 1000 s, samples outside of 100 s to 900 s are far off those inside."""
+    path = str(tmp_path / "measurements.rec")
+    samples = np.random.default_rng(1).standard_normal((2, 1000 * SAMPLING_RATE))
+    samples[:, :100 * SAMPLING_RATE] = 100.0
+    samples[:, 900 * SAMPLING_RATE:] = -100.0
+    writer = NpyWriter(path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE))
+    writer.write_block(samples, first_sample=0)
+    writer.close()
+    return path
+
+
+def _assert_envelope_inside(dataset, channel, start, stop):
+    x, y = viewer.trace_data(dataset, channel, start, stop)
+    assert len(x) <= viewer.MAX_POINTS
+    assert x.min() >= dataset.time(0, 1)[0] and x.max() <= dataset.time(dataset.n_samples - 1)[0]
+    values = dataset.values(channel)
+    # buckets at the edges of the selection hold no samples outside of it
+    assert y.min() >= values.min() and y.max() <= values.max()
+    if (start, stop) == (0, dataset.n_samples):
+        assert y.min() == values.min() and y.max() == values.max()
+
+
+@pytest.mark.parametrize("start, stop", [(100.0, 899.999), (123.4567, 800.0), (100.001, 500.0), (250.0, None)])
+def test_selection_uses_pyramid_of_measurement(recording_path, start, stop):
+    load_dataset(recording_path)
+    selection = Selection.of(["ai1"], start, stop)
+    if stop is None:
+        # the samples after 900 s are part of this selection
+        selection = Selection.of(["ai1"], start, 899.999)
+
+    dataset = load_dataset(recording_path, selection)
+
+    assert dataset.pyramid is not None and dataset.pyramid.path == pyramid_path(recording_path)
+    assert dataset.offset == round(selection.start * SAMPLING_RATE)
+    _assert_envelope_inside(dataset, "ai1", 0, dataset.n_samples)
+    _assert_envelope_inside(dataset, "ai1", 12345, 234567)
+
+
+def test_large_selection_builds_pyramid_of_measurement(recording_path, monkeypatch):
+    monkeypatch.setattr(loader, "SELECTION_PYRAMID_SAMPLES", 1000)
+    dataset = load_dataset(recording_path, Selection.of(None, 200.0, 300.0))
+    assert dataset.pyramid is not None and dataset.pyramid.n_samples == 1000 * SAMPLING_RATE
+    assert not (os.path.exists(os.path.join(os.path.dirname(recording_path), loader.CACHE_DIRECTORY)))
+    _assert_envelope_inside(dataset, "ai0", 0, dataset.n_samples)
+
+
+def test_small_selection_is_aggregated_on_the_fly(recording_path):
+    dataset = load_dataset(recording_path, Selection.of(None, 200.0, 300.0))
+    assert dataset.pyramid is None
+    assert not os.path.exists(pyramid_path(recording_path))
+    _assert_envelope_inside(dataset, "ai0", 0, dataset.n_samples)
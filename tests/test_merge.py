@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from merge import StreamMerger
+from ring_buffer import SharedRingBuffer
+
+
+@pytest.fixture
+def rings():
+    rings = {"Dev1": SharedRingBuffer(2, 10, 8), "Dev2": SharedRingBuffer(1, 15, 8)}
+    merged = SharedRingBuffer(3, 10, 16)
+    yield rings, merged
+    for ring in [*rings.values(), merged]:
+        ring.unlink()
+
+
+def _commit(ring, first_sample: int, n_samples: int):
+    ring.reserve(n_samples)[:] = np.arange(first_sample, first_sample + n_samples) \
+        + 1000 * np.arange(ring.n_channels)[:, None]
+    ring.commit(first_sample)
+
+
+def _merged(ring) -> np.ndarray:
+    blocks = []
+    while (block := ring.get(timeout=1)) is not None:
+        blocks.append(block.data.copy())
+        ring.release()
+    return np.concatenate(blocks, axis=1)
+
+
+def test_dropped_block_is_filled(rings):
+    rings, merged = rings
+    for first_sample in [0, 10, 20]:
+        _commit(rings["Dev1"], first_sample, 10)
+    # Dev2 is read in other blocks and its reader dropped samples 15 to 20, it stops at sample 25
+    _commit(rings["Dev2"], 0, 15)
+    _commit(rings["Dev2"], 20, 5)
+    for ring in rings.values():
+        ring.close_writer()
+
+    merger = StreamMerger(rings, merged)
+    merger.run()
+    data = _merged(merged)
+
+    assert data.shape == (3, 30)
+    np.testing.assert_array_equal(data[0], np.arange(30))
+    np.testing.assert_array_equal(data[1], np.arange(30) + 1000)
+    np.testing.assert_array_equal(data[2, :15], np.arange(15))
+    assert np.isnan(data[2, 15:20]).all()
+    np.testing.assert_array_equal(data[2, 20:25], np.arange(20, 25))
+    assert np.isnan(data[2, 25:]).all()
+    dev2 = merger.streams[1]
+    assert (dev2.gaps, dev2.missing_samples) == (1, 5)
+    assert merger.streams[0].gaps == 0
+    assert merged.overflows == 0
+
+
+def test_merges_only_samples_every_device_delivered(rings):
+    rings, merged = rings
+    _commit(rings["Dev1"], 0, 10)
+    _commit(rings["Dev2"], 0, 4)
+    merger = StreamMerger(rings, merged)
+    assert merger.step(timeout=0)
+    assert merger.position == 4
+    _commit(rings["Dev2"], 4, 15)
+    merger.step(timeout=0)
+    assert merger.position == 10
+    assert merger.streams[1].end - merger.position == 9
+
+
+@pytest.mark.parametrize("ppm, shift", [(1e5, 2), (-1e5, -2)])
+def test_resynchronize_follows_the_leader(rings, ppm, shift):
+    rings, merged = rings
+    _commit(rings["Dev1"], 0, 10)
+    _commit(rings["Dev1"], 10, 10)
+    _commit(rings["Dev2"], 0, 15)
+    _commit(rings["Dev2"], 15, 15)
+    merger = StreamMerger(rings, merged, resync=True)
+    merger.step(timeout=0)
+    assert merger.position == 20
+    # after 20 samples of the leader the device gained or lost 2 samples
+    merger.resynchronize({"Dev1": 0.0, "Dev2": ppm})
+    assert merger.streams[1].shift == shift
+    _commit(rings["Dev1"], 20, 8)
+    merger.step(timeout=0)
+    data = _merged(merged)
+
+    np.testing.assert_array_equal(data[0], np.arange(28))
+    np.testing.assert_array_equal(data[2, :20], np.arange(20))
+    if shift > 0:
+        np.testing.assert_array_equal(data[2, 20:], np.arange(22, 30))
+    else:
+        assert np.isnan(data[2, 20:22]).all()
+        np.testing.assert_array_equal(data[2, 22:], np.arange(20, 26))
+    # the samples of the device remaining in its ring are those after the merged position
+    assert merger.streams[1].merged_end - merger.position == 30 - shift - 28
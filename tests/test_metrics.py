@@ -0,0 +1,95 @@
+import json
+import re
+
+import pytest
+
+from metrics import JsonLinesExporter, PipelineMetrics, PrometheusTextfileExporter, create_metrics
+
+# a sample of the Prometheus text format: comment lines and `<name> <value>`
+_COMMENT = re.compile(r"# TYPE [a-zA-Z_:][a-zA-Z0-9_:]* (counter|gauge)")
+_SAMPLE = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]* \S+")
+
+
+class _ListExporter:
+
+    def __init__(self):
+        self.snapshots = []
+
+    def export(self, snapshot: dict):
+        self.snapshots.append(snapshot)
+
+    def close(self):
+        pass
+
+
+def test_snapshot_of_every_interval():
+    exporter = _ListExporter()
+    metrics = PipelineMetrics("writer", exporter, interval=1.0)
+    start = metrics._last_emit
+    for seconds in [0.1, 0.3, 0.2]:
+        metrics.observe("write_seconds", seconds)
+    metrics.count("samples", 1000)
+    metrics.count("samples", 3000)
+    metrics.gauge("ring_depth", 3)
+
+    assert metrics.maybe_emit() is None
+    first = metrics.emit(start + 2.0)
+    metrics.count("bytes_written", 10)
+    second = metrics.emit(start + 3.0)
+
+    assert exporter.snapshots == [first, second]
+    assert first["stage"] == "writer" and first["interval_seconds"] == 2.0
+    assert (first["write_seconds_count"], first["write_seconds_max"]) == (3, 0.3)
+    assert first["write_seconds_mean"] == pytest.approx(0.2)
+    assert (first["samples_total"], first["samples_per_second"]) == (4000, 2000.0)
+    assert first["ring_depth"] == 3
+    # observations and interval counts start over, totals and gauges are kept
+    assert "write_seconds_count" not in second
+    assert (second["samples_total"], second["samples_per_second"]) == (4000, 0.0)
+    assert (second["bytes_written_total"], second["bytes_written_per_second"]) == (10, 10.0)
+    assert second["ring_depth"] == 3
+
+
+def test_json_lines(tmp_path):
+    metrics = create_metrics("acquisition", "jsonl", str(tmp_path / "metrics"))
+    assert isinstance(metrics.exporter, JsonLinesExporter)
+    metrics.count("samples", 5)
+    first = metrics.emit()
+    metrics.close()
+
+    with open(tmp_path / "metrics" / "acquisition.jsonl") as f:
+        snapshots = [json.loads(line) for line in f]
+    assert len(snapshots) == 2 and snapshots[0] == first
+    assert snapshots[1]["samples_total"] == 5
+    assert create_metrics("acquisition", None, str(tmp_path)) is None
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = create_metrics("merge", "prometheus", str(tmp_path))
+    assert isinstance(metrics.exporter, PrometheusTextfileExporter)
+    metrics.observe("read_seconds", 0.5)
+    metrics.gauge("ring_overflows_total", 2)
+    metrics.gauge("cdaq1-mod1_lead_samples", 7)
+    metrics.emit()
+    # observations without values in the next interval are left out
+    metrics.observe("encode_seconds", 1.0)
+    metrics._summaries["encode_seconds"].count = 0
+    metrics.emit()
+
+    with open(tmp_path / "merge.prom") as f:
+        text = f.read()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert all(_COMMENT.fullmatch(line) if line.startswith("#") else _SAMPLE.fullmatch(line) for line in lines)
+    values = dict(line.split(" ") for line in lines if not line.startswith("#"))
+    assert values["daq_merge_ring_overflows_total"] == "2"
+    assert values["daq_merge_cdaq1_mod1_lead_samples"] == "7"
+    assert values["daq_merge_encode_seconds_count"] == "0"
+    assert "daq_merge_encode_seconds_mean" not in values and "daq_merge_read_seconds_count" not in values
+    assert "# TYPE daq_merge_ring_overflows_total counter" in lines
+    assert "# TYPE daq_merge_cdaq1_mod1_lead_samples gauge" in lines
+    # every sample is preceded by the type of its metric
+    for i, line in enumerate(lines):
+        if not line.startswith("#"):
+            assert lines[i - 1].startswith(f"# TYPE {line.split(' ')[0]} ")
+    assert not (tmp_path / "merge.prom.tmp").exists()
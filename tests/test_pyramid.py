@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import pyramid
+import viewer
+from loader import Dataset
+from pyramid import MAX, MEAN, MIN, MIN_BUCKETS, Pyramid, bucket_size, build_pyramid
+
+N_SAMPLES = 1_000_003
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(0)
+    return {"ai0": rng.standard_normal(N_SAMPLES), "Dev2/ai0": np.cumsum(rng.standard_normal(N_SAMPLES))}
+
+
+@pytest.fixture
+def measurement(tmp_path, samples, monkeypatch):
+    # chunks much smaller than the measurement, the levels are merged across chunk boundaries
+    monkeypatch.setattr(pyramid, "CHUNK_SIZE", 2 ** 16)
+    path = str(tmp_path / "measurements.rec.pyramid")
+    build_pyramid(path, list(samples), lambda channel, start, stop: samples[channel][start:stop], N_SAMPLES,
+                  source=[1, 2])
+    return path
+
+
+def test_levels_match_brute_force(measurement, samples):
+    levels = Pyramid.open(measurement, [1, 2])
+    assert levels.n_samples == N_SAMPLES
+    assert np.ceil(N_SAMPLES / bucket_size(levels.levels - 1)) <= MIN_BUCKETS
+    for channel, values in samples.items():
+        for level in range(levels.levels):
+            size = bucket_size(level)
+            buckets = levels.level(channel, level)
+            n_buckets = -(-N_SAMPLES // size)
+            assert buckets.shape == (n_buckets, 3)
+            padded = np.full(n_buckets * size, np.nan)
+            padded[:N_SAMPLES] = values
+            padded = padded.reshape(n_buckets, size)
+            np.testing.assert_array_equal(buckets[:, MIN], np.nanmin(padded, axis=1))
+            np.testing.assert_array_equal(buckets[:, MAX], np.nanmax(padded, axis=1))
+            np.testing.assert_allclose(buckets[:, MEAN], np.nanmean(padded, axis=1), rtol=1e-9, atol=1e-12)
+
+
+def test_pyramid_of_other_source_is_not_used(measurement):
+    assert Pyramid.open(measurement, [1, 3]) is None
+    assert Pyramid.open(measurement + ".missing", [1, 2]) is None
+
+
+@pytest.mark.parametrize("x_range", [
+    None,
+    [0.0, 1000.003],
+    [12.3456, 987.654],
+    [500.0, 500.5],
+    [499.9, 501.7],
+    [-50.0, 20000.0],
+])
+def test_zoom_stays_within_max_points(measurement, samples, x_range):
+    dataset = Dataset("measurements.rec", list(samples), samples, sampling_rate=1000)
+    dataset.pyramid = Pyramid.open(measurement, [1, 2])
+
+    patch = viewer.patch_figure(viewer.view(dataset, x_range)).to_plotly_json()
+
+    assigned = {tuple(operation["location"]): operation["params"]["value"] for operation in patch["operations"]}
+    for i, channel in enumerate(samples):
+        x, y = assigned[("data", i, "x")], assigned[("data", i, "y")]
+        assert 0 < len(x) == len(y) <= viewer.MAX_POINTS
+        start, stop = viewer._window(dataset, x_range)
+        values = samples[channel][start:stop]
+        # the envelope covers every sample of the window, the buckets at its edges may reach slightly beyond it
+        assert np.min(y) <= values.min() and np.max(y) >= values.max()
+        assert np.all(np.diff(x) >= 0)
+
+
+def test_buckets_of_selection_with_offset(measurement, samples):
+    offset, n_samples = 100_001, 500_000
+    selection = {channel: values[offset:offset + n_samples] for channel, values in samples.items()}
+    dataset = Dataset("measurements.rec", list(samples), selection, sampling_rate=1000, first_sample=offset,
+                      offset=offset)
+    dataset.pyramid = Pyramid.open(measurement, [1, 2])
+    level = 2
+    size = bucket_size(level)
+
+    first, buckets = viewer._pyramid_buckets(dataset, "ai0", level, 0, n_samples)
+
+    assert first == (offset // size) * size - offset
+    # buckets inside the selection come from the pyramid, the edges hold only samples of the selection
+    first_bucket = offset // size
+    np.testing.assert_array_equal(buckets[1:-1],
+                                  dataset.pyramid.level("ai0", level)[first_bucket + 1:first_bucket + len(buckets) - 1])
+    assert buckets[0, MIN] == selection["ai0"][:first + size].min()
+    assert buckets[-1, MAX] == selection["ai0"][first + (len(buckets) - 1) * size:].max()
@@ -0,0 +1,80 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from ring_buffer import SharedRingBuffer
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(n_channels=2, block_size=10, n_blocks=3)
+    yield ring
+    ring.unlink()
+
+
+def _produce(ring, n_blocks: int):
+    for i in range(n_blocks):
+        block = ring.reserve(i % 10 + 1)
+        block[:] = i
+        ring.commit(first_sample=i, timestamp_ns=i + 1)
+    ring.close_writer()
+    ring.close()
+
+
+def test_wrap_around(ring):
+    for i in range(10):
+        ring.reserve(5)[:] = np.arange(10).reshape(2, 5) + i
+        ring.commit(first_sample=5 * i, timestamp_ns=i)
+        data, first_sample, timestamp_ns = ring.get(timeout=1)
+        np.testing.assert_array_equal(data, np.arange(10).reshape(2, 5) + i)
+        assert (first_sample, timestamp_ns) == (5 * i, i)
+        ring.release()
+    assert ring.blocks_written == 10
+    assert ring.depth == 0
+
+
+def test_full_ring_drops_and_keeps_held_blocks(ring):
+    for i in range(3):
+        ring.reserve(10)[:] = i
+        ring.commit(first_sample=10 * i)
+    assert ring.reserve(10, timeout=0) is None
+    ring.drop(10)
+    assert (ring.overflows, ring.dropped_samples, ring.depth) == (1, 10, 3)
+
+    held = [ring.get(timeout=1) for _ in range(2)]
+    ring.release()
+    # only the slot of the first block is free again, the second block is still held
+    ring.reserve(4)[:] = 3
+    ring.commit(first_sample=40)
+    assert ring.reserve(4, timeout=0) is None
+    np.testing.assert_array_equal(held[1].data, 1)
+    assert [ring.get(timeout=1).first_sample for _ in range(2)] == [20, 40]
+
+
+def test_closed_after_final_get(ring):
+    for i in range(2):
+        ring.reserve(1)[:] = i
+        ring.commit(first_sample=i)
+    ring.close_writer()
+    assert not ring.closed
+    assert ring.get(timeout=1).first_sample == 0
+    assert not ring.closed
+    assert ring.get(timeout=1).first_sample == 1
+    assert ring.closed
+    assert ring.get(timeout=1) is None
+
+
+def test_blocks_cross_processes(ring):
+    producer = multiprocessing.Process(target=_produce, args=(ring, 50))
+    producer.start()
+    received = []
+    while (block := ring.get(timeout=5)) is not None:
+        assert block.data.shape == (2, len(received) % 10 + 1)
+        np.testing.assert_array_equal(block.data, len(received))
+        received.append((block.first_sample, block.timestamp_ns))
+        ring.release()
+    producer.join()
+    assert ring.closed
+    assert received == [(i, i + 1) for i in range(50)]
+    assert ring.overflows == 0
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from loader import Selection, load_dataset
+from segments import SegmentedWriter, SegmentIndex, index_path
+from storage import recording_metadata
+
+SAMPLING_RATE = 1000
+BLOCK_SIZE = 250
+
+
+@pytest.fixture(params=["csv", "npy"])
+def recording(request, tmp_path):
+    """A recording of three channels in segments of 5 s, csv segments are compressed, and its samples."""
+    file_format = request.param
+    path = str(tmp_path / ("measurements.csv" if file_format == "csv" else "measurements.rec"))
+    samples = np.random.default_rng(0).standard_normal((3, 12 * SAMPLING_RATE))
+    writer = SegmentedWriter(file_format, path, recording_metadata(["ai0", "ai1", "ai2"], SAMPLING_RATE),
+                             max_duration=5.0, compress=file_format == "csv")
+    for first_sample in range(0, samples.shape[1], BLOCK_SIZE):
+        writer.write_block(samples[:, first_sample:first_sample + BLOCK_SIZE], first_sample)
+    writer.close()
+    return index_path(path), samples
+
+
+def test_window_across_segments(recording):
+    path, samples = recording
+    index = SegmentIndex(path)
+    assert len(index.segments) == 3
+    assert index.n_samples == samples.shape[1]
+    if index.index["format"] == "csv":
+        assert all(segment["compressed"] for segment in index.segments)
+
+    # spans the boundary of the first two segments and several gzip members of each
+    time, values = index.read_window(3.3, 7.05)
+
+    np.testing.assert_allclose(time, np.arange(3300, 7050) / SAMPLING_RATE)
+    np.testing.assert_allclose(values, samples[:, 3300:7050], rtol=1e-9)
+
+
+def test_window_of_some_channels(recording):
+    path, samples = recording
+    time, values = SegmentIndex(path).read_samples(9800, 10200, ["ai2", "ai0"])
+    np.testing.assert_allclose(time, np.arange(9800, 10200) / SAMPLING_RATE)
+    np.testing.assert_allclose(values, samples[[2, 0], 9800:10200], rtol=1e-9)
+
+
+@pytest.mark.parametrize("selection", [
+    Selection.of(["ai1"], 4.5, 5.5),
+    Selection.of(None, None, 0.5),
+    Selection.of(["ai0", "ai2"], 11.0, None),
+])
+def test_load_selection(recording, selection):
+    path, samples = recording
+    start = 0 if selection.start is None else round(selection.start * SAMPLING_RATE)
+    stop = samples.shape[1] if selection.stop is None else round(selection.stop * SAMPLING_RATE) + 1
+
+    dataset = load_dataset(path, selection)
+
+    assert dataset.channels == selection.select(["ai0", "ai1", "ai2"])
+    np.testing.assert_allclose(dataset.time(), np.arange(start, stop) / SAMPLING_RATE)
+    for channel in dataset.channels:
+        np.testing.assert_allclose(dataset.values(channel), samples[int(channel[-1]), start:stop], rtol=1e-9)
+
+
+def test_open_whole_segmented_csv_recording(tmp_path):
+    path = str(tmp_path / "measurements.csv")
+    samples = np.random.default_rng(1).standard_normal((2, 600 * SAMPLING_RATE))
+    writer = SegmentedWriter("csv", path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE), max_duration=120.0)
+    for first_sample in range(0, samples.shape[1], 10 * BLOCK_SIZE):
+        # a dropped block inside of the third segment
+        if first_sample != 250 * SAMPLING_RATE:
+            writer.write_block(samples[:, first_sample:first_sample + 10 * BLOCK_SIZE], first_sample)
+    writer.close()
+
+    dataset = load_dataset(index_path(path))
+
+    # nothing but the pyramid is read up front, windows are read from the segments on access
+    assert dataset.nbytes == 0
+    assert dataset.n_samples == samples.shape[1]
+    assert dataset.pyramid is not None and dataset.pyramid.n_samples == samples.shape[1]
+    window = dataset.values("ai1", 249 * SAMPLING_RATE, 361 * SAMPLING_RATE)
+    expected = samples[1, 249 * SAMPLING_RATE:361 * SAMPLING_RATE].copy()
+    expected[SAMPLING_RATE:SAMPLING_RATE + 10 * BLOCK_SIZE] = np.nan
+    np.testing.assert_allclose(window, expected, rtol=1e-9)
+    np.testing.assert_allclose(dataset.time(1000, 1003), [1.0, 1.001, 1.002])
+
+    selection = load_dataset(index_path(path), Selection.of(["ai0"], 300.0, 420.0))
+    assert selection.pyramid is not None and selection.offset == 300 * SAMPLING_RATE
+    np.testing.assert_allclose(selection.values("ai0"), samples[0, 300 * SAMPLING_RATE:420 * SAMPLING_RATE + 1],
+                               rtol=1e-9)
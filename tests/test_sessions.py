@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+import sessions
+from loader import DatasetCache, Selection
+from sessions import SessionStore
+from storage import CsvWriter, recording_metadata
+
+SAMPLING_RATE = 1000
+N_SAMPLES = 20000
+# read from the CSV files themselves, so every dataset holds its samples in memory
+SELECTION = Selection.of(None, 0.0, 19.0)
+
+
+@pytest.fixture
+def paths(tmp_path):
+    paths = []
+    for i in range(4):
+        path = str(tmp_path / f"run{i}.csv")
+        writer = CsvWriter(path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE))
+        writer.write_block(np.random.default_rng(i).standard_normal((2, N_SAMPLES)) + 10 * i, first_sample=0)
+        writer.close()
+        paths.append(path)
+    return paths
+
+
+def _store(budget: int) -> SessionStore:
+    # the datasets are only trimmed by the budget of the store
+    return SessionStore(DatasetCache(budget=2 ** 40), budget=budget)
+
+
+def _footprint(paths) -> int:
+    """Bytes of a single session and the dataset it displays."""
+    store = _store(2 ** 40)
+    store.open("probe", paths[0], SELECTION)
+    return store.nbytes + store.datasets.nbytes
+
+
+def test_sessions_are_isolated(paths):
+    store = _store(2 ** 30)
+    store.open("a", paths[0])
+    store.open("b", paths[1], SELECTION)
+
+    store.relayout("a", paths[0], [5.0, 6.0])
+
+    path, selection, fig = store.restore("a")
+    assert (path, selection) == (paths[0], None)
+    assert list(fig.layout.xaxis.range) == [5.0, 6.0]
+    assert all(5.0 - 0.01 <= x <= 6.0 + 0.01 for trace in fig.data for x in trace.x)
+    path, selection, fig = store.restore("b")
+    assert (path, selection) == (paths[1], SELECTION)
+    assert fig.layout.xaxis.range is None
+    # the samples of the other measurement are offset by 10
+    assert all(5.0 <= np.mean(trace.y) <= 15.0 for trace in fig.data)
+    assert store.restore("unknown") is None
+
+    # displaying another selection starts over with the whole selection
+    store.open("a", paths[0], SELECTION)
+    assert store.restore("a")[2].layout.xaxis.range is None
+    assert store.paths() == {paths[0], paths[1]}
+
+
+def test_least_recently_used_sessions_are_dropped(paths):
+    store = _store(int(2.5 * _footprint(paths)))
+    store.open("a", paths[0], SELECTION)
+    store.open("b", paths[1], SELECTION)
+    store.open("c", paths[2], SELECTION)
+
+    assert store.restore("a") is None
+    assert store.paths() == {paths[1], paths[2]}
+    # the dataset of the dropped session is no longer displayed and evicted
+    assert {os.path.basename(key[0]) for key in store.datasets._datasets} == {"run1.csv", "run2.csv"}
+    assert store.nbytes + store.datasets.nbytes <= store.budget
+
+    store.relayout("b", paths[1], [1.0, 2.0], SELECTION)
+    store.open("d", paths[3], SELECTION)
+    assert store.restore("c") is None
+    assert store.restore("b")[0] == paths[1]
+
+
+def test_newest_session_is_kept_over_budget(paths):
+    store = _store(1)
+    store.open("a", paths[0], SELECTION)
+    store.open("b", paths[1], SELECTION)
+    assert store.restore("a") is None
+    assert store.restore("b")[0] == paths[1]
+    assert len(store.datasets._datasets) == 1
+
+
+def test_idle_sessions_are_dropped(paths):
+    store = _store(2 ** 30)
+    store.open("a", paths[0])
+    store._sessions["a"].last_access -= 2 * sessions.SESSION_TIMEOUT
+    store.open("b", paths[1])
+    assert store.paths() == {paths[1]}
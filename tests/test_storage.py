@@ -0,0 +1,167 @@
+import csv
+import io
+import os
+
+import numpy as np
+import pytest
+
+from storage import NpyAppender, NpyWriter, Recording, apply_scaling, channel_file_name, format_csv_block, \
+    read_metadata, read_npy, recording_metadata
+
+SAMPLING_RATE = 1000
+
+
+def test_appender_rewrites_header_on_close(tmp_path):
+    path = str(tmp_path / "levels.npy")
+    rows = np.arange(30, dtype=np.float64).reshape(10, 3)
+    appender = NpyAppender(path, np.float64, row_shape=(3,))
+    appender.append(rows[:4])
+    appender.append(rows[4])
+    appender.flush()
+
+    # before the header is rewritten the rows follow from the file size
+    assert np.load(path).shape == (0, 3)
+    np.testing.assert_array_equal(read_npy(path), rows[:5])
+
+    appender.append(rows[5:])
+    appender.close()
+
+    assert appender.n_rows == 10
+    np.testing.assert_array_equal(np.load(path), rows)
+    stored = read_npy(path)
+    assert isinstance(stored, np.memmap)
+    np.testing.assert_array_equal(stored, rows)
+
+
+def test_empty_appender(tmp_path):
+    path = str(tmp_path / "empty.npy")
+    NpyAppender(path, np.int64).close()
+    assert read_npy(path).shape == (0,)
+    assert np.load(path).shape == (0,)
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / "measurements.rec")
+    samples = np.random.default_rng(0).standard_normal((2, 300))
+    writer = NpyWriter(path, recording_metadata(["ai0", "Dev2/ai0"], SAMPLING_RATE, start_time="2024-01-01"))
+    writer.write_block(samples[:, :100], first_sample=0)
+    # a dropped block is filled with NaN, so the position inside the file stays the sample index
+    writer.write_block(samples[:, 150:], first_sample=150)
+    writer.close()
+
+    assert read_metadata(path)["n_samples"] == 300
+    assert os.path.exists(os.path.join(path, channel_file_name("Dev2/ai0")))
+    recording = Recording(path)
+    assert recording.channels == ["ai0", "Dev2/ai0"]
+    assert (recording.n_samples, recording.sampling_rate) == (300, SAMPLING_RATE)
+    assert recording.metadata["start_time"] == "2024-01-01"
+    expected = samples.copy()
+    expected[:, 100:150] = np.nan
+    for i, channel in enumerate(recording.channels):
+        assert isinstance(recording.channel(channel), np.memmap)
+        np.testing.assert_array_equal(recording.values(channel), expected[i])
+    np.testing.assert_array_equal(recording.values("ai0", 95, 105), expected[0, 95:105])
+    np.testing.assert_allclose(recording.time(98, 102), [0.098, 0.099, 0.1, 0.101])
+
+
+def test_raw_recording_round_trip(tmp_path):
+    path = str(tmp_path / "raw.rec")
+    scaling = {"ai0": [0.5, 0.001]}
+    codes = np.arange(-100, 100, dtype=np.int16).reshape(1, 200)
+    writer = NpyWriter(path, recording_metadata(["ai0"], SAMPLING_RATE, dtype=np.int16, scaling=scaling,
+                                                first_sample=1000))
+    writer.write_block(codes[:, :50], first_sample=1000)
+    # raw codes have no NaN, gaps are filled with 0
+    writer.write_block(codes[:, 60:], first_sample=1060)
+    writer.close()
+
+    recording = Recording(path)
+    assert recording.first_sample == 1000 and recording.n_samples == 200
+    stored = recording.channel("ai0")
+    assert stored.dtype == np.int16
+    expected = codes[0].copy()
+    expected[50:60] = 0
+    np.testing.assert_array_equal(stored, expected)
+    np.testing.assert_allclose(recording.values("ai0"), apply_scaling(expected, scaling["ai0"]))
+    # the time axis starts at the first sample of the segment
+    assert recording.time(0, 1)[0] == 1.0
+
+
+def test_sample_count_of_growing_recording(tmp_path):
+    path = str(tmp_path / "growing.rec")
+    writer = NpyWriter(path, recording_metadata(["ai0", "ai1"], SAMPLING_RATE))
+    writer.write_block(np.ones((2, 10)), first_sample=0)
+    writer.flush()
+
+    recording = Recording(path)
+    assert recording.n_samples == 10
+    writer.write_block(np.ones((2, 5)), first_sample=10)
+    writer.flush()
+    # counted when opened, the channel files are only read again on refresh
+    assert recording.n_samples == 10
+    assert len(recording.values("ai1")) == 10
+    recording.refresh()
+    assert recording.n_samples == 15
+    writer.close()
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.int16])
+def test_empty_recording(tmp_path, dtype):
+    path = str(tmp_path / "empty.rec")
+    NpyWriter(path, recording_metadata(["ai0"], SAMPLING_RATE, dtype=dtype)).close()
+    recording = Recording(path)
+    assert recording.n_samples == 0
+    assert len(recording.values("ai0")) == 0 and len(recording.time()) == 0
+
+
+def _csv_writerow_reference(data: np.ndarray, first_sample: int, sampling_rate: float) -> str:
+    """Rows as written before by csv.writerow, one call per sample with full float precision."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for i, row in enumerate(data.T):
+        writer.writerow([(first_sample + i) / sampling_rate, *row.tolist()])
+    return output.getvalue()
+
+
+def test_csv_block_matches_row_writer_within_precision():
+    data = np.random.default_rng(3).standard_normal((3, 500)) * 10.0 ** np.arange(-6, 9, 5)[:, None]
+    first_sample = 123_456_789
+
+    text = format_csv_block(data, first_sample, 20_000)
+    reference = _csv_writerow_reference(data, first_sample, 20_000)
+
+    # same layout: one CRLF terminated line per sample, the time followed by every channel
+    assert text.count("\r\n") == reference.count("\r\n") == 500 and text.endswith("\r\n")
+    assert "\r" not in text.replace("\r\n", "")
+    rows = [line.split(",") for line in text.split("\r\n")[:-1]]
+    reference_rows = [line.split(",") for line in reference.split("\r\n")[:-1]]
+    assert {len(row) for row in rows} == {4}
+    for row, reference_row in zip(rows, reference_rows):
+        time, *values = row
+        # the documented precision: 12 significant digits of the time, 10 of every sample
+        assert time == "%.12g" % float(reference_row[0])
+        assert values == ["%.10g" % float(value) for value in reference_row[1:]]
+        assert float(time) == pytest.approx(float(reference_row[0]), rel=5e-12)
+        np.testing.assert_allclose([float(value) for value in values],
+                                   [float(value) for value in reference_row[1:]], rtol=5e-10)
+
+
+def test_csv_time_stays_unambiguous():
+    # 1 MHz after more than two days of recording
+    first_sample = 200_000 * 1_000_000
+    text = format_csv_block(np.zeros((1, 1000)), first_sample, 1_000_000)
+    times = [float(line.split(",")[0]) for line in text.split("\r\n")[:-1]]
+    np.testing.assert_array_equal(np.rint(np.array(times) * 1_000_000), first_sample + np.arange(1000))
+
+
+def test_csv_block_of_raw_codes():
+    codes = np.array([[-32768, 0, 32767]], dtype=np.int16)
+    assert format_csv_block(codes, 0, 1000, "%d") == "0,-32768\r\n0.001,0\r\n0.002,32767\r\n"
+
+
+def test_csv_precision_trade_off():
+    # csv.writerow wrote repr(), the block writer rounds to the documented number of digits
+    text = format_csv_block(np.array([[0.12345678901234567]]), 1, 3.0)
+    assert text == "0.333333333333,0.123456789\r\n"
+    assert _csv_writerow_reference(np.array([[0.12345678901234567]]), 1, 3.0) == \
+        "0.3333333333333333,0.12345678901234566\r\n"
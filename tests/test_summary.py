@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from storage import Recording, recording_metadata
+from summary import SPECTRUM_SIZE, STATISTICS, SummaryWriter, summary_channel
+
+SAMPLING_RATE = 4096
+FREQUENCY = 50.0
+
+
+def _summarize(path: str, data: np.ndarray, window: float) -> dict:
+    channels = [f"ai{i}" for i in range(len(data))]
+    summary = SummaryWriter(path, recording_metadata(channels, SAMPLING_RATE), window=window)
+    # blocks cut across windows and spectrum segments
+    for start in range(0, data.shape[1], 1000):
+        summary.add(data[:, start:start + 1000], first_sample=start)
+    summary.close()
+    recording = Recording(path)
+    return {(channel, statistic): recording.values(summary_channel(channel, statistic))
+            for channel in channels for statistic in STATISTICS}
+
+
+def _sine(n_samples: int) -> np.ndarray:
+    return np.sin(2 * np.pi * FREQUENCY * np.arange(n_samples) / SAMPLING_RATE)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "measurements.summary.rec")
+
+
+def test_statistics_of_a_sine(path):
+    statistics = _summarize(path, np.vstack([_sine(4 * SAMPLING_RATE), np.full(4 * SAMPLING_RATE, 2.0)]), 2.0)
+    np.testing.assert_allclose(statistics["ai0", "rms"], np.sqrt(0.5), rtol=1e-3)
+    np.testing.assert_allclose(statistics["ai0", "frequency"], FREQUENCY, atol=SAMPLING_RATE / SPECTRUM_SIZE)
+    np.testing.assert_array_equal(statistics["ai1", "mean"], 2.0)
+
+
+def test_nan_samples_are_left_out(path):
+    data = np.vstack([_sine(4 * SAMPLING_RATE), _sine(4 * SAMPLING_RATE)])
+    # one NaN in the first and ten in the last spectrum segment of the first window of ai0
+    data[0, 100] = np.nan
+    data[0, 2 * SAMPLING_RATE - 20:2 * SAMPLING_RATE - 10] = np.nan
+    # ten NaN in the second spectrum segment of the first window of ai1, the first segment still gives the frequency
+    data[1, 5000:5010] = np.nan
+
+    statistics = _summarize(path, data, 2.0)
+    finite = data[0, :2 * SAMPLING_RATE][np.isfinite(data[0, :2 * SAMPLING_RATE])]
+    np.testing.assert_allclose(statistics["ai0", "min"][0], finite.min())
+    np.testing.assert_allclose(statistics["ai0", "max"][0], finite.max())
+    np.testing.assert_allclose(statistics["ai0", "mean"][0], finite.mean(), atol=1e-12)
+    np.testing.assert_allclose(statistics["ai0", "rms"][0], np.sqrt(np.mean(finite ** 2)))
+    # both segments of the first window contain NaN, the second window is not affected
+    assert np.isnan(statistics["ai0", "frequency"][0])
+    np.testing.assert_allclose(statistics["ai0", "frequency"][1], FREQUENCY, atol=SAMPLING_RATE / SPECTRUM_SIZE)
+    np.testing.assert_allclose(statistics["ai1", "rms"], np.sqrt(0.5), rtol=1e-3)
+    np.testing.assert_allclose(statistics["ai1", "frequency"], FREQUENCY, atol=SAMPLING_RATE / SPECTRUM_SIZE)
+
+
+def test_windows_spanning_one_segment(path):
+    data = _sine(2 * SAMPLING_RATE)[np.newaxis].copy()
+    data[0, 10:20] = np.nan
+    statistics = _summarize(path, data, 1.0)
+    assert np.isnan(statistics["ai0", "frequency"][0])
+    np.testing.assert_allclose(statistics["ai0", "frequency"][1], FREQUENCY, atol=SAMPLING_RATE / SPECTRUM_SIZE)
+
+
+def test_window_of_nan_samples(path):
+    data = _sine(2 * SAMPLING_RATE)[np.newaxis].copy()
+    data[0, :SAMPLING_RATE] = np.nan
+    statistics = _summarize(path, data, 1.0)
+    assert all(np.isnan(statistics["ai0", statistic][0]) for statistic in STATISTICS)
+    assert np.isfinite([statistics["ai0", statistic][1] for statistic in STATISTICS]).all()